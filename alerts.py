@@ -0,0 +1,339 @@
+"""Background email alert dispatcher
+
+Alerts are queued instead of being sent inside the request/job that found the
+potholes. A single background thread keeps one authenticated SMTP connection
+open across messages, coalesces alerts for the same location that arrive
+within ``window`` seconds into one digest email, and retries failed deliveries
+with exponential backoff. ``detections.alert_sent`` is only set once the email
+has actually been accepted by the server.
+
+Queued alerts live in memory, so each detection records which process
+(``detections.alert_owner``) holds its alert. ``stop()`` delivers whatever is
+still queued when the process exits, and ``recover()`` resubmits the alerts
+of processes that died before they could. Alerts the dispatcher gives up on
+have their owner cleared, so they are not resent.
+
+Point SMTP_HOST/SMTP_PORT at a local server (e.g. ``python -m aiosmtpd -n -l
+localhost:8025``) with SMTP_STARTTLS=0 to exercise it without network access.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from db import (DB_PATH, abandon_alerts, claim_alert, list_detection_frames, mark_alerts_sent, queue_alerts,
+                unsent_alerts)
+from jobs import worker_alive, worker_name
+
+MAX_ATTACHMENTS = 5
+# Undelivered alerts older than this are not resent after a crash
+ALERT_RECOVERY_SECONDS = int(os.getenv("ALERT_RECOVERY_SECONDS", 86400))
+
+
+def build_alert_message(sender, recipient, alerts):
+    """Build the alert email for one or more detections at the same location"""
+    # The email stack is imported on first use, not by every process importing alerts
+    from email.mime.image import MIMEImage
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart()
+    total = sum(a['count'] for a in alerts)
+    location = alerts[0]['location']
+    images = [img for a in alerts for img in a['images']]
+    msg["From"] = sender
+    msg["To"] = recipient
+
+    if len(alerts) == 1:
+        alert = alerts[0]
+        msg["Subject"] = f"🚨 URGENT: {alert['count']} Pothole(s) Detected!"
+        body = f"""
+POTHOLE DETECTION ALERT
+=======================
+
+⚠️ IMMEDIATE ATTENTION REQUIRED ⚠️
+
+Location: {location}
+Number of Potholes: {alert['count']}
+Detected At: {alert['timestamp']}
+Detection Type: {alert.get('type', 'Image')}
+
+Please take immediate action to repair the detected road damage.
+This is an automated alert from the Pothole Detection System.
+
+Attached: {min(len(images), MAX_ATTACHMENTS)} detection image(s) showing pothole locations
+
+---
+Automated Pothole Detection System
+Contact: {sender}
+        """
+    else:
+        msg["Subject"] = f"🚨 URGENT: {total} Pothole(s) Detected at {location} ({len(alerts)} reports)"
+        lines = "\n".join(
+            f"- {a['timestamp']}: {a['count']} pothole(s) ({a.get('type', 'Image')})" for a in alerts)
+        body = f"""
+POTHOLE DETECTION DIGEST
+========================
+
+⚠️ IMMEDIATE ATTENTION REQUIRED ⚠️
+
+Location: {location}
+Total Potholes: {total}
+Reports:
+{lines}
+
+Please take immediate action to repair the detected road damage.
+This is an automated alert from the Pothole Detection System.
+
+Attached: {min(len(images), MAX_ATTACHMENTS)} detection image(s) showing pothole locations
+
+---
+Automated Pothole Detection System
+Contact: {sender}
+        """
+
+    msg.attach(MIMEText(body, 'plain'))
+
+    for idx, img_path in enumerate(images[:MAX_ATTACHMENTS]):
+        try:
+            with open(img_path, 'rb') as f:
+                msg.attach(MIMEImage(f.read(), name=f"pothole_detection_{idx+1}.jpg"))
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"   ✗ Could not attach {img_path}: {e}")
+    return msg
+
+
+class AlertDispatcher:
+    """Queue, coalesce and deliver alert emails from a background thread"""
+
+    def __init__(self, sender, password, recipient, host="smtp.gmail.com", port=587,
+                 starttls=True, window=60.0, max_attempts=5, backoff=2.0, max_backoff=300.0,
+                 idle_timeout=120.0, timeout=30.0, db_path=DB_PATH, logger=None):
+        self.sender = sender
+        self.password = password
+        self.recipient = recipient
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.window = window
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.db_path = db_path
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._cond = threading.Condition()
+        self._pending = []  # batches: {'location', 'alerts', 'deadline', 'attempts', 'open'}
+        self._smtp = None
+        self._last_used = 0.0
+        self._stopping = False
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+
+    # ---------- public API ----------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, detection_data, detection_id=None):
+        """Queue an alert; ``detection_id`` (or a list of them) gets alert_sent=1 once delivered"""
+        alert = dict(detection_data)
+        alert['detection_id'] = detection_id
+        try:
+            queue_alerts(_detection_ids([alert]), worker_name(), self.db_path)
+        except sqlite3.Error as e:
+            self.logger.error(f"❌ Could not record queued alert: {e}")
+        now = time.monotonic()
+        with self._cond:
+            for batch in self._pending:
+                if batch['open'] and batch['location'] == alert['location']:
+                    batch['alerts'].append(alert)
+                    break
+            else:
+                self._pending.append({'location': alert['location'], 'alerts': [alert],
+                                      'deadline': now + self.window, 'attempts': 0, 'open': True})
+            self._cond.notify()
+        self.start()
+
+    def stop(self, flush=True, timeout=None):
+        """Stop the thread, delivering everything still queued if ``flush``"""
+        with self._cond:
+            self._stopping = True
+            if not flush:
+                self._pending.clear()
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._close()
+
+    def recover(self, max_age=ALERT_RECOVERY_SECONDS):
+        """Resubmit alerts left undelivered by processes that have exited; returns how many"""
+        owner = worker_name()
+        recovered = 0
+        for row in unsent_alerts(max_age, self.db_path):
+            if worker_alive(row['alert_owner']) or not claim_alert(row['id'], row['alert_owner'], owner,
+                                                                   self.db_path):
+                continue
+            frames, _ = list_detection_frames(row['id'], limit=MAX_ATTACHMENTS, db_path=self.db_path)
+            images = [f['result_path'] for f in frames if f['result_path']]
+            self.submit({
+                'images': images or ([row['result_path']] if row['result_path'] else []),
+                'location': row['location'],
+                'count': row['pothole_count'],
+                'timestamp': row['detected_at'],
+                'type': (row['detection_type'] or 'image').capitalize(),
+            }, row['id'])
+            recovered += 1
+        if recovered:
+            self.logger.info(f"📧 Resubmitted {recovered} undelivered alert(s) from a previous run")
+        return recovered
+
+    def pending_count(self):
+        with self._cond:
+            return sum(len(b['alerts']) for b in self._pending)
+
+    # ---------- worker thread ----------
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [b for b in self._pending if self._stopping or b['deadline'] <= now]
+                if not due:
+                    if self._stopping:
+                        return
+                    next_deadline = min((b['deadline'] for b in self._pending), default=None)
+                    wait = self.idle_timeout if next_deadline is None else next_deadline - now
+                    self._cond.wait(max(0.0, wait))
+                for batch in due:
+                    self._pending.remove(batch)
+                    batch['open'] = False
+
+            for batch in due:
+                self._deliver(batch)
+            if not due:
+                self._close_if_idle()
+
+    def _deliver(self, batch):
+        import smtplib
+
+        alerts = batch['alerts']
+        batch['attempts'] += 1
+        try:
+            msg = build_alert_message(self.sender, self.recipient, alerts)
+            with metrics.timed('smtp'):
+                self._connection().send_message(msg)
+            self._last_used = time.monotonic()
+        except smtplib.SMTPAuthenticationError as e:
+            # Retrying with the same credentials will not help
+            self._close()
+            self.failed += len(alerts)
+            self.logger.error(f"❌ SMTP AUTHENTICATION FAILED, dropping {len(alerts)} alert(s): {e}")
+            self._abandon(_detection_ids(alerts))
+            return
+        except (smtplib.SMTPException, OSError) as e:
+            self._close()
+            if batch['attempts'] >= self.max_attempts or self._stopping:
+                self.failed += len(alerts)
+                self.logger.error(f"❌ Giving up on alert for {batch['location']} after "
+                                  f"{batch['attempts']} attempt(s): {e}")
+                self._abandon(_detection_ids(alerts))
+                return
+            delay = min(self.max_backoff, self.backoff * 2 ** (batch['attempts'] - 1))
+            self.logger.warning(f"⚠️ Alert delivery failed ({e}); retrying in {delay:.1f}s")
+            with self._cond:
+                batch['deadline'] = time.monotonic() + delay
+                self._pending.append(batch)
+            return
+
+        self.sent += len(alerts)
+        self.logger.info(f"✅ Alert email sent for {batch['location']}: "
+                         f"{sum(a['count'] for a in alerts)} pothole(s) in {len(alerts)} report(s)")
+        self._mark_sent(_detection_ids(alerts))
+
+    def _mark_sent(self, detection_ids):
+        if not detection_ids:
+            return
+        try:
+            mark_alerts_sent(detection_ids, self.db_path)
+        except sqlite3.Error as e:
+            self.logger.error(f"❌ Could not mark alerts as sent: {e}")
+
+    def _abandon(self, detection_ids):
+        # Dropped for good: recover() must not resend them after a restart
+        try:
+            abandon_alerts(detection_ids, self.db_path)
+        except sqlite3.Error as e:
+            self.logger.error(f"❌ Could not release dropped alerts: {e}")
+
+    # ---------- SMTP connection ----------
+    def _connection(self):
+        import smtplib
+
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close()
+
+        self.logger.info(f"📧 Connecting to SMTP server ({self.host}:{self.port})...")
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.password:
+                smtp.login(self.sender, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        return smtp
+
+    def _close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+            self._close()
+
+    def _close(self):
+        import smtplib
+
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+def _detection_ids(alerts):
+    detection_ids = []
+    for a in alerts:
+        ids = a.get('detection_id')
+        detection_ids.extend(ids if isinstance(ids, list) else [ids])
+    return [i for i in detection_ids if i is not None]
+
+
+def dispatcher_from_env(db_path=DB_PATH, logger=None):
+    """Build a dispatcher from the NOTIFY_* / SMTP_* / ALERT_* environment variables"""
+    return AlertDispatcher(
+        sender=os.getenv("NOTIFY_SENDER_EMAIL"),
+        password=os.getenv("NOTIFY_APP_PASSWORD"),
+        recipient=os.getenv("NOTIFY_RECIPIENT"),
+        host=os.getenv("SMTP_HOST", "smtp.gmail.com"),
+        port=int(os.getenv("SMTP_PORT", 587)),
+        starttls=os.getenv("SMTP_STARTTLS", "1") == "1",
+        window=float(os.getenv("ALERT_COALESCE_SECONDS", 60)),
+        max_attempts=int(os.getenv("ALERT_MAX_ATTEMPTS", 5)),
+        backoff=float(os.getenv("ALERT_RETRY_BACKOFF", 2)),
+        db_path=db_path,
+        logger=logger,
+    )
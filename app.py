@@ -1,18 +1,35 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import (Flask, Response, g, render_template, request, redirect, url_for, session, flash, jsonify,
+                   send_file, send_from_directory, stream_with_context)
 from dotenv import load_dotenv
 load_dotenv()
 import sqlite3
 import os
+import json
+import queue
+import threading
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
-from ultralytics import YOLO
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.image import MIMEImage
-from datetime import datetime
-import cv2
+import atexit
+from datetime import datetime, timedelta, timezone
 import base64
+import time
 from pathlib import Path
+from db import (DB_PATH, create_user, delete_job_detections, find_user, get_connection, get_detection,
+                init_schema, insert_detection, list_detection_frames, list_user_detections, query_potholes,
+                release_connections, user_daily_stats, user_top_locations, user_totals)
+from alerts import dispatcher_from_env
+from backends import ensure_backend_model
+import storage
+import thumbnails
+from result_cache import ResultCache
+from artifacts import ArtifactWriter
+from batch import create_batch, find_unfinished_batch, get_batch, init_batch_tables, run_batch
+from jobs import enqueue_job, get_job, init_jobs_table, start_workers
+import metrics
+import streaming
+from profiling import SamplingProfiler
+from uploads import (GrowingCapture, UploadConflict, create_upload, get_upload, init_uploads_table,
+                     parse_content_range, record_frame, set_upload_job, write_chunk)
 
 # ========================
 # Flask Configuration
@@ -30,6 +47,31 @@ app.config['RESULT_FOLDER'] = RESULT_FOLDER
 app.config['VIDEO_FOLDER'] = VIDEO_FOLDER
 app.config['DETECTED_FRAMES_FOLDER'] = DETECTED_FRAMES_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
+# Chunked uploads (see uploads.py) are limited per chunk by MAX_CONTENT_LENGTH
+# and in total by this
+app.config['CHUNKED_UPLOAD_MAX_BYTES'] = int(os.getenv("CHUNKED_UPLOAD_MAX_MB", 4096)) * 1024 * 1024
+# Start detecting once this much of a chunked video has arrived
+app.config['UPLOAD_EARLY_START_BYTES'] = int(os.getenv("UPLOAD_EARLY_START_MB", 8)) * 1024 * 1024
+# Uploads are processed by background worker processes (see jobs.py)
+app.config['ASYNC_JOBS'] = os.getenv("ASYNC_JOBS", "1") == "1"
+# Worker processes started with the dev server; set to 0 when running `python jobs.py`
+app.config['JOB_WORKERS'] = int(os.getenv("JOB_WORKERS", 2))
+
+# Requests slower than this many ms get a sampled stack profile in PROFILE_DIR (0 = off)
+app.config['PROFILE_SLOW_REQUESTS_MS'] = float(os.getenv("PROFILE_SLOW_REQUESTS_MS", 0))
+app.config['PROFILE_DIR'] = os.getenv("PROFILE_DIR", 'profiles')
+
+# Thumbnails and full-size result images are served with this max-age (see /images)
+app.config['IMAGE_CACHE_SECONDS'] = int(os.getenv("IMAGE_CACHE_SECONDS", 86400))
+# Saved frames per page of the video results gallery
+app.config['GALLERY_PAGE_SIZE'] = int(os.getenv("GALLERY_PAGE_SIZE", 24))
+# Detections per page of the history, and the days and locations the dashboard shows
+app.config['HISTORY_PAGE_SIZE'] = int(os.getenv("HISTORY_PAGE_SIZE", 20))
+app.config['DASHBOARD_DAYS'] = int(os.getenv("DASHBOARD_DAYS", 30))
+app.config['DASHBOARD_TOP_LOCATIONS'] = int(os.getenv("DASHBOARD_TOP_LOCATIONS", 10))
+# /api/potholes returns the user's own boxes; with 1 it is a shared map of everyone's
+# potholes, reduced to coordinates and confidence
+app.config['POTHOLE_MAP_PUBLIC'] = os.getenv("POTHOLE_MAP_PUBLIC", "0") == "1"
 
 # Create directories
 for folder in [UPLOAD_FOLDER, RESULT_FOLDER, VIDEO_FOLDER, DETECTED_FRAMES_FOLDER]:
@@ -50,56 +92,129 @@ def allowed_file(filename, file_type='image'):
         return ext in ALLOWED_VIDEO_EXTENSIONS
     return False
 
+def parse_coordinates(form, location=''):
+    """``(lat, lon)`` from the latitude/longitude fields or a "lat, lon" location"""
+    candidates = [(form.get('latitude'), form.get('longitude'))]
+    if location.count(',') == 1:
+        candidates.append(tuple(location.split(',')))
+    for lat, lon in candidates:
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            continue
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return lat, lon
+    return None
+
 # ========================
 # Database Setup
 # ========================
 def init_db():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            email TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS detections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            detection_type TEXT,
-            location TEXT,
-            file_path TEXT,
-            result_path TEXT,
-            pothole_count INTEGER DEFAULT 0,
-            detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            alert_sent BOOLEAN DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-init_db()
+    init_schema(DB_PATH)
+    init_jobs_table(DB_PATH)
+    init_uploads_table(DB_PATH)
+    init_batch_tables(DB_PATH)
+    result_cache.init_tables()
+
+@app.teardown_appcontext
+def _release_db(exc=None):
+    # Werkzeug serves each request on a new thread: hand its connection back
+    release_connections()
 
 # ========================
 # Model Setup
 # ========================
-MODEL_PATH = os.path.join(os.getcwd(), 'model', 'pothole_yolov11_best.pt')
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.getcwd(), 'model', 'pothole_yolov11_best.pt'))
+# Minimum box confidence passed to predict()
+app.config['DETECTION_CONF'] = float(os.getenv("DETECTION_CONF", 0.25))
+# pytorch, onnx, onnx-int8 or openvino (see backends.py)
+app.config['INFERENCE_BACKEND'] = os.getenv("INFERENCE_BACKEND", "pytorch")
+# Address of a shared inference_server.py process; when set, no weights are loaded here
+app.config['INFERENCE_SERVER'] = os.getenv("INFERENCE_SERVER")
+# standard: one pass at the model's imgsz; adaptive: input size per image and
+# overlapping tiles for large ones (see tiling.py)
+app.config['INFERENCE_MODE'] = os.getenv("INFERENCE_MODE", "standard")
+app.config['INFERENCE_TILE_SIZE'] = int(os.getenv("INFERENCE_TILE_SIZE", 640))
+app.config['INFERENCE_TILE_OVERLAP'] = float(os.getenv("INFERENCE_TILE_OVERLAP", 0.2))
+# Per-image inference budget in adaptive mode; tiles get coarser to fit it (0 = no limit)
+app.config['INFERENCE_LATENCY_BUDGET_MS'] = float(os.getenv("INFERENCE_LATENCY_BUDGET_MS", 0))
 model = None
+# One model per process is shared by request threads, job threads and camera
+# streams, and ultralytics predict is not thread-safe: every forward pass
+# takes this lock (see SerializedModel)
+model_lock = threading.Lock()
+MODEL_LOAD_SECONDS = metrics.gauge('pothole_model_load_seconds', 'Time the model took to load in this process')
+
+class SerializedModel:
+    """A loaded model whose ``predict`` runs under ``model_lock``"""
+
+    def __init__(self, m):
+        self.model = m
+
+    @property
+    def names(self):
+        return self.model.names
+
+    @names.setter
+    def names(self, value):
+        self.model.names = value
+
+    def predict(self, *args, **kwargs):
+        with model_lock:
+            return self.model.predict(*args, **kwargs)
+
+    def __call__(self, *args, **kwargs):
+        return self.predict(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
 
 def load_model():
     global model
     if model is not None:
         return model
+    start = time.perf_counter()
+    model = _load_model()
+    if model is not None:
+        MODEL_LOAD_SECONDS.set(round(time.perf_counter() - start, 4))
+        if not app.config['INFERENCE_SERVER']:
+            # The inference server serializes its own passes
+            model = SerializedModel(model)
+        if app.config['INFERENCE_MODE'] == 'adaptive':
+            from tiling import AdaptivePredictor
+            model = AdaptivePredictor(model, tile_size=app.config['INFERENCE_TILE_SIZE'],
+                                      overlap=app.config['INFERENCE_TILE_OVERLAP'],
+                                      latency_budget=app.config['INFERENCE_LATENCY_BUDGET_MS'] / 1000,
+                                      batch_size=app.config['VIDEO_BATCH_SIZE'])
+            app.logger.info(f"🧩 Adaptive inference: {app.config['INFERENCE_TILE_SIZE']}px tiles, "
+                            f"budget {app.config['INFERENCE_LATENCY_BUDGET_MS'] or 'unlimited'} ms")
+    return model
+
+def _load_model():
+    if app.config['INFERENCE_SERVER']:
+        from inference_server import InferenceClient
+        try:
+            model = InferenceClient(app.config['INFERENCE_SERVER'])
+            app.logger.info(f"✅ Using inference server at {app.config['INFERENCE_SERVER']}: {model.names}")
+            return model
+        except Exception as e:
+            app.logger.exception(f"Failed to reach inference server: {e}")
+            model = None
+            return None
     if not os.path.isfile(MODEL_PATH):
         app.logger.error(f"Model file not found at {MODEL_PATH}")
         return None
     try:
-        app.logger.info(f"Loading model from {MODEL_PATH} ...")
-        model = YOLO(MODEL_PATH)
+        backend = app.config['INFERENCE_BACKEND']
+        try:
+            path = ensure_backend_model(MODEL_PATH, backend)
+        except Exception as e:
+            app.logger.exception(f"⚠️ Could not prepare {backend} model, falling back to pytorch: {e}")
+            backend, path = 'pytorch', MODEL_PATH
+        app.logger.info(f"Loading model from {path} ({backend} backend) ...")
+        # Imported here so processes that never run the model do not pay for torch
+        from ultralytics import YOLO
+        model = YOLO(path, task='detect')
         
         # ✅ DEBUG: Print original class names
         app.logger.info(f"Original model classes: {model.names}")
@@ -142,26 +257,90 @@ def load_model():
         model = None
         return None
 
+def model_version():
+    """Identifies the weights and backend in use, for result cache keys"""
+    try:
+        st = os.stat(MODEL_PATH)
+        weights = f"{os.path.basename(MODEL_PATH)}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        weights = os.path.basename(MODEL_PATH)
+    version = f"{weights}:{app.config['INFERENCE_BACKEND']}"
+    if app.config['INFERENCE_MODE'] == 'adaptive':
+        version += f":adaptive{app.config['INFERENCE_TILE_SIZE']}"
+    return version
+
+# ========================
+# Result Cache
+# ========================
+app.config['RESULT_CACHE_MAX_BYTES'] = int(float(os.getenv("RESULT_CACHE_MAX_MB", 512)) * 1024 * 1024)
+result_cache = ResultCache(DB_PATH, os.path.join(RESULT_FOLDER, 'detected'),
+                           app.config['RESULT_CACHE_MAX_BYTES'])
+
+# ========================
+# Artifact Writer
+# ========================
+# Inline image detections answer as soon as the boxes are known; annotating,
+# encoding and writing files happens afterwards (see artifacts.py)
+app.config['DEFER_ARTIFACTS'] = os.getenv("DEFER_ARTIFACTS", "1") == "1"
+app.config['ARTIFACT_WRITER_THREADS'] = int(os.getenv("ARTIFACT_WRITER_THREADS", 2))
+artifact_writer = ArtifactWriter(app.config['ARTIFACT_WRITER_THREADS'])
+atexit.register(artifact_writer.flush)
+
+# ========================
+# Storage Lifecycle
+# ========================
+# Retention per class and the disk quota come from STORAGE_* (see storage.py);
+# the sweeper runs in the dev server when enabled, or as `python storage.py`
+app.config['STORAGE_LIFECYCLE'] = os.getenv("STORAGE_LIFECYCLE", "0") == "1"
+app.config['STORAGE_SWEEP_SECONDS'] = float(os.getenv("STORAGE_SWEEP_SECONDS", 600))
+storage_manager = storage.manager_from_env('static', 'batches', DB_PATH)
+
+@app.route('/api/storage')
+def storage_stats():
+    """Disk usage per storage class and what the last sweep removed
+
+    Walking the storage folders is slow, so the numbers come from the last
+    sweep; a dry run refreshes them in the background once they are older
+    than STORAGE_SWEEP_SECONDS (202 until the first one is done).
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    report = storage_manager.request_report(app.config['STORAGE_SWEEP_SECONDS'])
+    if report is None:
+        return jsonify({'status': 'pending'}), 202
+    return jsonify(report)
+
 # ========================
 # Email Notification with Images
 # ========================
-def notify_authorities(detection_data):
+alert_dispatcher = None
+
+def get_alert_dispatcher():
+    """Process-wide background alert dispatcher (see alerts.py)"""
+    global alert_dispatcher
+    if alert_dispatcher is None:
+        alert_dispatcher = dispatcher_from_env(DB_PATH, app.logger).start()
+        atexit.register(alert_dispatcher.stop)
+    return alert_dispatcher
+
+def notify_authorities(detection_data, detection_id=None):
     """
-    Send email to authorities with pothole images
+    Queue an email to authorities with pothole images
     detection_data = {
         'images': [list of image paths],
         'location': 'location string',
         'count': number of potholes,
         'timestamp': datetime
     }
+    Delivery happens in the background; alerts for the same location are
+    coalesced into one digest and ``detection_id``'s alert_sent flag is set
+    once the email is actually delivered.
     """
     sender = os.getenv("NOTIFY_SENDER_EMAIL")
     app_password = os.getenv("NOTIFY_APP_PASSWORD")
     recipient = os.getenv("NOTIFY_RECIPIENT")
 
-    app.logger.info(f"📧 Email notification triggered for {detection_data['count']} pothole(s)")
-    app.logger.info(f"   Sender: {sender}")
-    app.logger.info(f"   Recipient: {recipient}")
+    app.logger.info(f"📧 Email notification queued for {detection_data['count']} pothole(s)")
     app.logger.info(f"   Images to attach: {len(detection_data['images'])}")
 
     if not sender or not app_password or not recipient:
@@ -171,145 +350,158 @@ def notify_authorities(detection_data):
         app.logger.error(f"   NOTIFY_RECIPIENT: {'SET' if recipient else 'MISSING'}")
         return False
 
-    try:
-        msg = MIMEMultipart()
-        msg["Subject"] = f"🚨 URGENT: {detection_data['count']} Pothole(s) Detected!"
-        msg["From"] = sender
-        msg["To"] = recipient
+    get_alert_dispatcher().submit(detection_data, detection_id)
+    return True
 
-        # Email body
-        body = f"""
-POTHOLE DETECTION ALERT
-=======================
+def recover_alerts():
+    """Resend alerts queued by processes that exited before delivering them"""
+    if not all(os.getenv(name) for name in ("NOTIFY_SENDER_EMAIL", "NOTIFY_APP_PASSWORD", "NOTIFY_RECIPIENT")):
+        return 0
+    return get_alert_dispatcher().recover()
 
-⚠️ IMMEDIATE ATTENTION REQUIRED ⚠️
+# ========================
+# Video Processing Function
+# ========================
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", 8))
+VIDEO_WRITER_THREADS = int(os.getenv("VIDEO_WRITER_THREADS", 2))
+VIDEO_QUEUE_SIZE = int(os.getenv("VIDEO_QUEUE_SIZE", 32))
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", 2))
+# Seek instead of grabbing when sampled frames are at least this many frames apart
+VIDEO_SEEK_THRESHOLD = int(os.getenv("VIDEO_SEEK_THRESHOLD", 60))
+app.config['VIDEO_BATCH_SIZE'] = VIDEO_BATCH_SIZE
+app.config['VIDEO_WRITER_THREADS'] = VIDEO_WRITER_THREADS
+app.config['VIDEO_QUEUE_SIZE'] = VIDEO_QUEUE_SIZE
+app.config['VIDEO_SAMPLE_FPS'] = VIDEO_SAMPLE_FPS
+app.config['VIDEO_SEEK_THRESHOLD'] = VIDEO_SEEK_THRESHOLD
 
-Location: {detection_data['location']}
-Number of Potholes: {detection_data['count']}
-Detected At: {detection_data['timestamp']}
-Detection Type: {detection_data.get('type', 'Image')}
+# Track potholes across frames so each one is counted and saved once
+VIDEO_TRACKING = os.getenv("VIDEO_TRACKING", "1") == "1"
+app.config['VIDEO_TRACKING'] = VIDEO_TRACKING
+app.config['VIDEO_TRACK_IOU'] = float(os.getenv("VIDEO_TRACK_IOU", 0.3))
+app.config['VIDEO_TRACK_MAX_AGE'] = int(os.getenv("VIDEO_TRACK_MAX_AGE", 2))
+app.config['VIDEO_TRACK_MIN_HITS'] = int(os.getenv("VIDEO_TRACK_MIN_HITS", 1))
 
-Please take immediate action to repair the detected road damage.
-This is an automated alert from the Pothole Detection System.
+# Split long videos into this many segments processed by parallel processes
+app.config['VIDEO_SEGMENT_WORKERS'] = int(os.getenv("VIDEO_SEGMENT_WORKERS", 1))
+# Shorter videos are not worth the process start-up and model loading
+app.config['VIDEO_SEGMENT_MIN_SECONDS'] = float(os.getenv("VIDEO_SEGMENT_MIN_SECONDS", 300))
 
-Attached: {len(detection_data['images'])} detection image(s) showing pothole locations
+# Skip sampled frames nearly identical to the last analysed one (see motion.py)
+app.config['VIDEO_MOTION_GATE'] = os.getenv("VIDEO_MOTION_GATE", "0") == "1"
+# Share of changed thumbnail pixels (0..1) up to which a frame counts as unchanged
+app.config['VIDEO_MOTION_SKIP_THRESHOLD'] = float(os.getenv("VIDEO_MOTION_SKIP_THRESHOLD", 0.01))
+app.config['VIDEO_MOTION_MAX_SKIPPED'] = int(os.getenv("VIDEO_MOTION_MAX_SKIPPED", 20))
+# Sample twice as often while more than this share of pixels changes between samples (0 = off)
+app.config['VIDEO_MOTION_DENSE_THRESHOLD'] = float(os.getenv("VIDEO_MOTION_DENSE_THRESHOLD", 0))
 
----
-Automated Pothole Detection System
-Contact: {sender}
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
+# Decoded frames alive at once per video run (0 = two batches plus one per writer; see memory.py)
+app.config['VIDEO_FRAME_BUFFERS'] = int(os.getenv("VIDEO_FRAME_BUFFERS", 0))
+# Resident set budget of a job's process in MB; over it the run decodes less ahead, then fails (0 = off)
+app.config['VIDEO_MAX_RSS_MB'] = int(os.getenv("VIDEO_MAX_RSS_MB", 0))
+# Per-stage tracemalloc peaks in the pipeline stats; slows video runs down, for diagnosis only
+app.config['VIDEO_TRACE_MEMORY'] = os.getenv("VIDEO_TRACE_MEMORY", "0") == "1"
 
-        # Attach images with better error handling
-        attached_count = 0
-        for idx, img_path in enumerate(detection_data['images'][:5]):  # Limit to 5 images
-            if os.path.exists(img_path):
-                try:
-                    with open(img_path, 'rb') as f:
-                        img_data = f.read()
-                        image = MIMEImage(img_data, name=f"pothole_detection_{idx+1}.jpg")
-                        msg.attach(image)
-                        attached_count += 1
-                        app.logger.info(f"   ✓ Attached image {idx+1}: {os.path.basename(img_path)}")
-                except Exception as img_error:
-                    app.logger.error(f"   ✗ Failed to attach image {idx+1}: {img_error}")
-            else:
-                app.logger.warning(f"   ✗ Image not found: {img_path}")
-
-        app.logger.info(f"📧 Connecting to Gmail SMTP server (smtp.gmail.com:587)...")
-        with smtplib.SMTP("smtp.gmail.com", 587, timeout=30) as server:
-            app.logger.info("🔐 Starting TLS encryption...")
-            server.starttls()
-            
-            app.logger.info(f"🔑 Logging in as {sender}...")
-            server.login(sender, app_password)
-            
-            app.logger.info("📤 Sending email with attachments...")
-            server.send_message(msg)
-        
-        app.logger.info("=" * 60)
-        app.logger.info(f"✅ EMAIL SENT SUCCESSFULLY!")
-        app.logger.info(f"   To: {recipient}")
-        app.logger.info(f"   Attachments: {attached_count} image(s)")
-        app.logger.info(f"   Subject: {msg['Subject']}")
-        app.logger.info("=" * 60)
-        return True
-        
-    except smtplib.SMTPAuthenticationError as e:
-        app.logger.error("=" * 60)
-        app.logger.error("❌ SMTP AUTHENTICATION FAILED!")
-        app.logger.error("=" * 60)
-        app.logger.error("   Possible issues:")
-        app.logger.error("   1. App Password is incorrect")
-        app.logger.error("   2. 2-Step Verification not enabled")
-        app.logger.error("   3. Need to generate new App Password")
-        app.logger.error(f"   Error: {e}")
-        app.logger.error("=" * 60)
-        return False
-        
-    except smtplib.SMTPException as e:
-        app.logger.error(f"❌ SMTP Error: {e}")
-        return False
-        
-    except Exception as e:
-        app.logger.exception(f"❌ Email sending failed with unexpected error: {e}")
-        return False
+# Stage timings of the most recent video run, served by /api/pipeline/stats
+last_video_stats = {}
 
-# ========================
-# Video Processing Function
-# ========================
-def process_video(video_path, location, user_id):
-    """Process video and extract frames with potholes"""
+def process_video(video_path, location, user_id, batch_size=None, sample_fps=None, progress=None,
+                  capture=None, on_result=None):
+    """Process video and extract frames with potholes
+
+    Decoding, batched inference and annotate/encode/write run as separate
+    pipeline stages (see video_pipeline.py). Sampled frames are grouped into
+    batches of ``batch_size`` (defaults to VIDEO_BATCH_SIZE) so the model runs
+    one forward pass per batch instead of one per frame.
+
+    ``sample_fps`` (defaults to VIDEO_SAMPLE_FPS) sets how many frames per
+    second of video are analysed; skipped frames are grabbed without colour
+    conversion, or seeked over entirely when sampling is sparse.
+
+    ``progress``, if given, is called with the fraction of the video done
+    after every batch, or with None when the length is not known yet.
+
+    ``capture`` replaces opening ``video_path`` (e.g. a GrowingCapture over
+    an upload still in progress); ``on_result`` is passed to the pipeline.
+
+    With VIDEO_TRACKING on, each entry in ``detected_frames`` is one unique
+    pothole (with its ``track_id``) rather than one frame.
+
+    Videos longer than VIDEO_SEGMENT_MIN_SECONDS are split across
+    VIDEO_SEGMENT_WORKERS processes when that is above 1 (see
+    video_segments.py).
+    """
+    import cv2
+    from motion import MotionGate
+    from tracking import PotholeTracker
+    from video_pipeline import run_video_pipeline
+    from video_segments import run_segmented_video
+
+    global last_video_stats
     m = load_model()
     if m is None:
         return None, []
 
-    cap = cv2.VideoCapture(video_path)
+    cap = capture if capture is not None else cv2.VideoCapture(video_path)
     if not cap.isOpened():
         return None, []
 
+    batch_size = max(1, batch_size or app.config['VIDEO_BATCH_SIZE'])
+    sample_fps = sample_fps or app.config['VIDEO_SAMPLE_FPS']
     fps = int(cap.get(cv2.CAP_PROP_FPS))
-    frame_interval = max(1, fps // 2)  # Process 2 frames per second
-    
-    frame_count = 0
-    detected_frames = []
-    pothole_images = []
+    frame_interval = max(1, int(fps / sample_fps))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_folder = os.path.join(app.config['DETECTED_FRAMES_FOLDER'], timestamp)
+    output_folder = os.path.join(app.config['DETECTED_FRAMES_FOLDER'], storage.unique_name())
     os.makedirs(output_folder, exist_ok=True)
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        if frame_count % frame_interval == 0:
-            # Run detection on frame
-            results = m.predict(source=frame, save=False, verbose=False)
-            
-            # If potholes detected, save frame
-            if len(results[0].boxes) > 0:
-                annotated = results[0].plot()
-                frame_filename = f"frame_{frame_count}_potholes_{len(results[0].boxes)}.jpg"
-                frame_path = os.path.join(output_folder, frame_filename)
-                cv2.imwrite(frame_path, annotated)
-                
-                # FIX: Convert path to forward slashes
-                rel_path = frame_path.replace('\\', '/').replace('static/', '')
-                
-                detected_frames.append({
-                    'frame_number': frame_count,
-                    'pothole_count': len(results[0].boxes),
-                    'path': frame_path,
-                    'rel_path': rel_path
-                })
-                pothole_images.append(frame_path)
+    tracker_options = None
+    if app.config['VIDEO_TRACKING']:
+        tracker_options = {'iou_threshold': app.config['VIDEO_TRACK_IOU'],
+                           'max_age': app.config['VIDEO_TRACK_MAX_AGE'],
+                           'min_hits': app.config['VIDEO_TRACK_MIN_HITS']}
+    pipeline_options = {
+        'batch_size': batch_size,
+        'writer_threads': app.config['VIDEO_WRITER_THREADS'],
+        'queue_size': app.config['VIDEO_QUEUE_SIZE'],
+        'conf': app.config['DETECTION_CONF'],
+        'seek_threshold': app.config['VIDEO_SEEK_THRESHOLD'],
+        'frame_buffers': app.config['VIDEO_FRAME_BUFFERS'],
+        'max_rss_mb': app.config['VIDEO_MAX_RSS_MB'],
+        'trace_memory': app.config['VIDEO_TRACE_MEMORY'],
+    }
+    if app.config['VIDEO_MOTION_GATE']:
+        pipeline_options['gate'] = MotionGate(skip_threshold=app.config['VIDEO_MOTION_SKIP_THRESHOLD'],
+                                              max_skipped=app.config['VIDEO_MOTION_MAX_SKIPPED'],
+                                              dense_threshold=app.config['VIDEO_MOTION_DENSE_THRESHOLD'])
+
+    segment_workers = app.config['VIDEO_SEGMENT_WORKERS']
+    if capture is None and segment_workers > 1 and fps \
+            and total_frames >= fps * app.config['VIDEO_SEGMENT_MIN_SECONDS']:
+        cap.release()
+        app.logger.info(f"🧩 Splitting {total_frames} frames across {segment_workers} segment processes")
+        detected_frames, pothole_images, last_video_stats = run_segmented_video(
+            video_path, 'app:load_model', frame_interval, output_folder, total_frames,
+            workers=segment_workers, tracker_options=tracker_options,
+            pipeline_options=pipeline_options, progress=progress)
+        if on_result is not None:
+            for entry in detected_frames:
+                on_result(entry)
+        app.logger.info(f"🎞️ Video pipeline stats: {last_video_stats}")
+        return detected_frames, pothole_images
 
-        frame_count += 1
+    tracker = PotholeTracker(**tracker_options) if tracker_options is not None else None
+    try:
+        detected_frames, pothole_images, stats = run_video_pipeline(
+            cap, m, frame_interval, output_folder,
+            tracker=tracker,
+            on_result=on_result,
+            progress=(lambda n: progress((n + 1) / total_frames if total_frames else None)) if progress else None,
+            **pipeline_options)
+    finally:
+        cap.release()
 
-    cap.release()
+    last_video_stats = stats.as_dict()
+    app.logger.info(f"🎞️ Video pipeline stats: {last_video_stats}")
     
     return detected_frames, pothole_images
 
@@ -327,18 +519,12 @@ def register():
         password = request.form['password']
         email = request.form.get('email', '')
         
-        conn = sqlite3.connect('database.db')
-        cursor = conn.cursor()
         try:
-            cursor.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)', 
-                         (username, password, email))
-            conn.commit()
+            create_user(username, password, email)
             flash('Registration successful! Please login.', 'success')
             return redirect(url_for('login'))
         except sqlite3.IntegrityError:
             flash('Username already exists!', 'error')
-        finally:
-            conn.close()
     return render_template('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -346,15 +532,11 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        conn = sqlite3.connect('database.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
-        user = cursor.fetchone()
-        conn.close()
+        user = find_user(username, password)
         if user:
             session['user'] = username
             session['user_id'] = user[0]
-            return redirect(url_for('upload'))
+            return redirect(url_for('dashboard'))
         else:
             flash('Invalid credentials!', 'error')
     return render_template('login.html')
@@ -365,6 +547,219 @@ def logout():
     session.pop('user_id', None)
     return redirect(url_for('login'))
 
+@app.route('/artifacts/<path:rel_path>')
+def artifact(rel_path):
+    """A file under static/, served from memory while it is still being written"""
+    path = safe_join('static', rel_path)
+    if path is None:
+        return jsonify({'error': 'Not found'}), 404
+    encoded = artifact_writer.get(path)
+    if encoded is not None:
+        return Response(encoded, mimetype='image/jpeg', headers={'Cache-Control': 'no-cache'})
+    return send_from_directory('static', rel_path)
+
+@app.route('/images/<size>/<path:rel_path>')
+def image(size, rel_path):
+    """A result image under static/ at one of ``thumbnails.SIZES`` or ``full``
+
+    WebP is served to clients that accept it. Responses carry an ETag and a
+    max-age and answer conditional and range requests; an artifact that is
+    still being written is served from memory, uncached, at full size.
+    """
+    if size != 'full' and size not in thumbnails.SIZES:
+        return jsonify({'error': 'Unknown size'}), 404
+    path = safe_join('static', rel_path)
+    if path is None:
+        return jsonify({'error': 'Not found'}), 404
+
+    target = path
+    if size != 'full':
+        fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+        target = thumbnails.ensure_variant(path, size, fmt)
+    if target is None or not os.path.isfile(target):
+        encoded = artifact_writer.get(path)
+        if encoded is None:
+            return jsonify({'error': 'Not found'}), 404
+        return Response(encoded, mimetype='image/jpeg', headers={'Cache-Control': 'no-cache'})
+
+    response = send_file(target, conditional=True, etag=True, max_age=app.config['IMAGE_CACHE_SECONDS'])
+    if size != 'full':
+        response.vary.add('Accept')
+    return response
+
+@app.template_global()
+def image_url(rel_path, size='full'):
+    return url_for('image', size=size, rel_path=rel_path)
+
+def _gallery_frame(row):
+    return {
+        'frame_number': row['frame_number'],
+        'pothole_count': row['pothole_count'],
+        'track_id': row['track_id'],
+        'confidence': row['confidence'],
+        'rel_path': (row['result_path'] or '').replace('\\', '/').replace('static/', ''),
+    }
+
+def _format_cursor(after):
+    return f"{after[0]}.{after[1]}"
+
+def _parse_history_cursor(value):
+    """``(detected_at, id)`` from a history cursor; the timestamp may contain dots itself"""
+    detected_at, _, detection_id = value.rpartition('.')
+    if not detected_at or not detection_id.isdigit():
+        raise ValueError(f"Invalid cursor: {value}")
+    return detected_at, int(detection_id)
+
+@app.route('/api/detections/<int:detection_id>/frames')
+def detection_frames(detection_id):
+    """A page of a video run's saved frames with their image URLs
+
+    ``after`` is the cursor from the previous page's ``next``.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    detection = get_detection(detection_id)
+    if detection is None or detection['user_id'] != session['user_id']:
+        return jsonify({'error': 'Not found'}), 404
+    after = None
+    if request.args.get('after'):
+        try:
+            after = tuple(int(v) for v in request.args['after'].split('.'))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        if len(after) != 2:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    limit = min(max(request.args.get('limit', app.config['GALLERY_PAGE_SIZE'], type=int), 1), 200)
+
+    rows, next_after = list_detection_frames(detection_id, after=after, limit=limit)
+    frames = []
+    for row in rows:
+        frame = _gallery_frame(row)
+        frame['images'] = {size: image_url(frame['rel_path'], size) for size in (*thumbnails.SIZES, 'full')}
+        frames.append(frame)
+    return jsonify({
+        'frames': frames,
+        'next': url_for('detection_frames', detection_id=detection_id, after=_format_cursor(next_after),
+                        limit=limit) if next_after is not None else None,
+    })
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """Hit/miss counters and disk usage of the image result cache"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    return jsonify(result_cache.stats())
+
+@app.route('/api/potholes')
+def potholes_in_viewport():
+    """Detected boxes inside ``bbox=min_lon,min_lat,max_lon,max_lat``
+
+    Only the user's own detections, unless POTHOLE_MAP_PUBLIC makes this a
+    shared map, which leaves out everything but where each pothole is.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in request.args.get('bbox', '').split(','))
+    except ValueError:
+        return jsonify({'error': 'bbox must be min_lon,min_lat,max_lon,max_lat'}), 400
+    if min_lon > max_lon or min_lat > max_lat:
+        return jsonify({'error': 'bbox minimum exceeds maximum'}), 400
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+
+    if app.config['POTHOLE_MAP_PUBLIC']:
+        potholes = [{'lat': p['lat'], 'lon': p['lon'], 'confidence': p['confidence']}
+                    for p in query_potholes(min_lon, min_lat, max_lon, max_lat, limit=limit)]
+    else:
+        potholes = query_potholes(min_lon, min_lat, max_lon, max_lat, limit=limit, user_id=session['user_id'])
+    return jsonify({
+        'bbox': [min_lon, min_lat, max_lon, max_lat],
+        'count': len(potholes),
+        'truncated': len(potholes) >= limit,
+        'potholes': potholes,
+    })
+
+@app.route('/api/pipeline/stats')
+def pipeline_stats():
+    """Per-stage timings and queue depths of the most recent video run"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    return jsonify(last_video_stats)
+
+# ========================
+# History & Dashboard
+# ========================
+# Listing pages are keyset-paginated on the detections index and the
+# aggregates come from the rollup tables (see db.py), so neither scans a
+# user's whole history.
+def _history_entry(row):
+    rel_path = (row['result_path'] or '').replace('\\', '/').replace('static/', '')
+    return {
+        'id': row['id'],
+        'detection_type': row['detection_type'],
+        'location': row['location'],
+        'pothole_count': row['pothole_count'],
+        'detected_at': row['detected_at'],
+        'alert_sent': bool(row['alert_sent']),
+        'images': {size: image_url(rel_path, size) for size in (*thumbnails.SIZES, 'full')} if rel_path else None,
+    }
+
+def _dashboard_data(user_id, days):
+    """Totals, one rollup per day of the last ``days`` (zeros filled in) and top locations"""
+    # detected_at is CURRENT_TIMESTAMP, i.e. UTC
+    first_day = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    stored = {row['day']: row for row in user_daily_stats(user_id, since=first_day.isoformat())}
+    daily = []
+    for n in range(days):
+        day = (first_day + timedelta(days=n)).isoformat()
+        daily.append(stored.get(day, {'day': day, 'detections': 0, 'potholes': 0, 'alerts': 0}))
+    return {
+        'totals': user_totals(user_id),
+        'daily': daily,
+        'locations': user_top_locations(user_id, limit=app.config['DASHBOARD_TOP_LOCATIONS']),
+    }
+
+@app.route('/dashboard')
+def dashboard():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    rows, next_before = list_user_detections(session['user_id'], limit=app.config['HISTORY_PAGE_SIZE'])
+    next_url = url_for('history', before=_format_cursor(next_before)) if next_before is not None else None
+    return render_template('dashboard.html',
+                           detections=[_history_entry(r) for r in rows],
+                           next_url=next_url,
+                           **_dashboard_data(session['user_id'], app.config['DASHBOARD_DAYS']))
+
+@app.route('/api/history')
+def history():
+    """A page of the user's detections, newest first
+
+    ``before`` is the cursor from the previous page's ``next``.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    before = None
+    if request.args.get('before'):
+        try:
+            before = _parse_history_cursor(request.args['before'])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    limit = min(max(request.args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int), 1), 200)
+    rows, next_before = list_user_detections(session['user_id'], before=before, limit=limit)
+    return jsonify({
+        'detections': [_history_entry(r) for r in rows],
+        'next': url_for('history', before=_format_cursor(next_before), limit=limit)
+                if next_before is not None else None,
+    })
+
+@app.route('/api/dashboard')
+def dashboard_stats():
+    """The user's totals, daily rollups for ``days`` (default DASHBOARD_DAYS) and top locations"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    days = min(max(request.args.get('days', app.config['DASHBOARD_DAYS'], type=int), 1), 366)
+    return jsonify(_dashboard_data(session['user_id'], days))
+
 # ========================
 # Upload Route (Image/Video/Camera)
 # ========================
@@ -376,28 +771,28 @@ def upload():
     if request.method == 'POST':
         upload_type = request.form.get('upload_type', 'image')
         location = request.form.get('location', 'Unknown')
+        coords = parse_coordinates(request.form, location)
 
         # Handle camera capture
         if upload_type == 'camera':
+            camera_file = request.files.get('camera_file')
             image_data = request.form.get('camera_image')
-            if not image_data:
+            if not camera_file and not image_data:
                 flash('No camera image captured.', 'error')
                 return redirect(request.url)
 
-            # Decode base64 image
             try:
-                image_data = image_data.split(',')[1]
-                image_bytes = base64.b64decode(image_data)
-                
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"camera_{timestamp}.jpg"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                
-                with open(filepath, 'wb') as f:
-                    f.write(image_bytes)
+                if camera_file:
+                    # Sent as a JPEG file part: read once, no text copies
+                    image_bytes = camera_file.read()
+                else:
+                    # Pages loaded before the switch still post a base64 data URL
+                    image_bytes = base64.b64decode(image_data.partition(',')[2])
+                filepath = storage.bytes_path(app.config['UPLOAD_FOLDER'], image_bytes, '.jpg')
                 
                 # Process the captured image
-                return process_image_detection(filepath, location, 'camera')
+                return submit_detection(filepath, location, 'camera', {'coords': coords},
+                                        image_bytes=image_bytes)
                 
             except Exception as e:
                 flash(f'Error processing camera image: {e}', 'error')
@@ -410,20 +805,23 @@ def upload():
             return redirect(request.url)
 
         filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Check if it's video or image
+        ext = os.path.splitext(filename)[1].lower()
+
+        # Check if it's video or image; both are stored under a hash of their bytes
         if allowed_file(filename, 'video'):
-            upload_filename = f"{timestamp}_{filename}"
-            upload_path = os.path.join(app.config['VIDEO_FOLDER'], upload_filename)
-            file.save(upload_path)
-            return process_video_detection(upload_path, location)
+            with metrics.timed('upload_io', 'video'):
+                upload_path = storage.store_stream(app.config['VIDEO_FOLDER'], file.stream, ext)
+            sample_fps = request.form.get('sample_fps', type=float)
+            if sample_fps is not None and sample_fps <= 0:
+                sample_fps = None
+            return submit_detection(upload_path, location, 'video', {'sample_fps': sample_fps, 'coords': coords})
         
         elif allowed_file(filename, 'image'):
-            upload_filename = f"{timestamp}_{filename}"
-            upload_path = os.path.join(app.config['UPLOAD_FOLDER'], upload_filename)
-            file.save(upload_path)
-            return process_image_detection(upload_path, location, 'image')
+            with metrics.timed('upload_io', 'image'):
+                image_bytes = file.read()
+            upload_path = storage.bytes_path(app.config['UPLOAD_FOLDER'], image_bytes, ext)
+            return submit_detection(upload_path, location, 'image', {'coords': coords},
+                                    image_bytes=image_bytes)
         
         else:
             flash('Invalid file type. Please upload an image or video.', 'error')
@@ -431,37 +829,97 @@ def upload():
 
     return render_template('upload.html')
 
-def process_image_detection(image_path, location, detection_type):
-    """Process single image detection"""
+def submit_detection(file_path, location, detection_type, params=None, image_bytes=None):
+    """Queue a detection job, or run it inline when ASYNC_JOBS is off
+
+    ``image_bytes`` is an uploaded image not yet saved to ``file_path``.
+    """
+    params = params or {}
+    if image_bytes is not None:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        defer = app.config['DEFER_ARTIFACTS'] and not app.config['ASYNC_JOBS']
+        if storage.claim(file_path):
+            pass  # the same image was uploaded before
+        elif defer:
+            # Detect from memory; the original lands on disk in the background
+            artifact_writer.submit(file_path, lambda: image_bytes)
+        else:
+            with metrics.timed('upload_io', 'image'), open(file_path, 'wb') as f:
+                f.write(image_bytes)
+        if not defer:
+            # Worker processes read the upload from disk
+            image_bytes = None
+
+    if not app.config['ASYNC_JOBS']:
+        if detection_type == 'video':
+            return process_video_detection(file_path, location, params.get('sample_fps'), params.get('coords'))
+        return process_image_detection(file_path, location, detection_type, params.get('coords'), image_bytes)
+
+    job_id = enqueue_job(session['user_id'], detection_type, file_path, location, params)
+    app.logger.info(f"🗂️ Queued {detection_type} job {job_id}")
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+    return redirect(url_for('job_result', job_id=job_id))
+
+def run_image_detection(image_path, location, detection_type, user_id, coords=None,
+                        image_bytes=None, defer_artifacts=False, job_id=None, alert_sent=False):
+    """Detect potholes in one image, record it and alert if needed
+
+    ``coords`` is an optional ``(lat, lon)`` stored with every box.
+    ``image_bytes`` are the uploaded bytes if already in memory, so the file
+    is not read back. With ``defer_artifacts`` the annotated image is drawn,
+    encoded and written by the background artifact writer, and the alert sent
+    once it is on disk. ``job_id`` is recorded with the detection;
+    ``alert_sent`` means an earlier run already alerted. Returns the
+    (JSON-serialisable) context for results.html.
+    """
+    import cv2
+    import numpy as np
+
     m = load_model()
     if m is None:
-        flash("Model not loaded. Check server logs.", 'error')
-        return redirect(url_for('upload'))
+        raise RuntimeError("Model not loaded. Check server logs.")
 
-    try:
-        results = m.predict(source=image_path, save=False, verbose=False)
-        annotated_image = results[0].plot()
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        result_filename = f"detected_{timestamp}.jpg"
-        result_path = os.path.join(app.config['RESULT_FOLDER'], 'detected', result_filename)
-        cv2.imwrite(result_path, annotated_image)
-
-        pothole_count = len(results[0].boxes)
-        pothole_detected = pothole_count > 0
-
-        # Save to database
-        conn = sqlite3.connect('database.db')
-        cursor = conn.cursor()
-        cursor.execute('''INSERT INTO detections 
-                         (user_id, detection_type, location, file_path, result_path, pothole_count, alert_sent)
-                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                      (session['user_id'], detection_type, location, image_path, result_path, pothole_count, pothole_detected))
-        conn.commit()
-        conn.close()
-
-        # Send alert if pothole detected
-        if pothole_detected:
+    if image_bytes is None:
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+
+    # Identical bytes with the same model/threshold give identical boxes
+    cache_key = ResultCache.make_key(image_bytes, model_version(), app.config['DETECTION_CONF'])
+    cached = result_cache.get(cache_key)
+    render = None
+
+    if cached is not None:
+        app.logger.info(f"⚡ Result cache hit for {os.path.basename(image_path)}")
+        result_path = cached['result_path']
+        pothole_count = cached['pothole_count']
+        box_rows = cached['boxes']
+    else:
+        # Decode once and hand the model the array rather than the path
+        with metrics.timed('decode', 'image'):
+            image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Uploaded file is not a readable image")
+        with metrics.timed('infer', 'image'):
+            results = m.predict(source=image, conf=app.config['DETECTION_CONF'], save=False, verbose=False)
+        boxes = results[0].boxes
+        box_rows = [xyxy + [c, k] for xyxy, c, k in
+                    zip(boxes.xyxy.tolist(), boxes.conf.tolist(), boxes.cls.tolist())]
+        result_path = result_cache.path_for(cache_key)
+        pothole_count = len(box_rows)
+        render = results[0].plot
+
+    pothole_detected = pothole_count > 0
+
+    # Save to database; alert_sent is set by the dispatcher once delivered
+    lat, lon = coords or (None, None)
+    detection_id = insert_detection(user_id, detection_type, location, image_path,
+                                    result_path, pothole_count, alert_sent=alert_sent,
+                                    boxes=[(0, box) for box in box_rows], lat=lat, lon=lon, job_id=job_id)
+
+    # Send alert if pothole detected (the email attaches the annotated image)
+    def alert():
+        if pothole_detected and not alert_sent:
             detection_data = {
                 'images': [result_path],
                 'location': location,
@@ -469,46 +927,64 @@ def process_image_detection(image_path, location, detection_type):
                 'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 'type': detection_type.capitalize()
             }
-            notify_authorities(detection_data)
+            notify_authorities(detection_data, detection_id)
 
-        # FIX: Convert Windows backslashes to forward slashes for URL
-        rel_path = result_path.replace('\\', '/').replace('static/', '')
-        
-        return render_template('results.html',
-                             result="Pothole Detected!" if pothole_detected else "No Pothole Detected",
-                             location=location,
-                             image_path=url_for('static', filename=rel_path),
-                             pothole_count=pothole_count,
-                             detection_type=detection_type,
-                             pothole_detected=pothole_detected)
+    def on_written(_path):
+        result_cache.record(cache_key, box_rows)
+        alert()
 
-    except Exception as e:
-        app.logger.exception(f"Detection error: {e}")
-        flash(f"Error: {e}", 'error')
-        return redirect(url_for('upload'))
+    if render is None:
+        alert()
+    elif defer_artifacts:
+        artifact_writer.submit(result_path, render, on_written=on_written, variants=True)
+    else:
+        with metrics.timed('plot', 'image'):
+            annotated = render()
+        with metrics.timed('imwrite', 'image'):
+            cv2.imwrite(result_path, annotated)
+        thumbnails.write_variants(result_path, annotated)
+        on_written(result_path)
 
-def process_video_detection(video_path, location):
-    """Process video detection"""
-    detected_frames, pothole_images = process_video(video_path, location, session['user_id'])
+    # FIX: Convert Windows backslashes to forward slashes for URL
+    rel_path = result_path.replace('\\', '/').replace('static/', '')
+
+    return {
+        'result': "Pothole Detected!" if pothole_detected else "No Pothole Detected",
+        'location': location,
+        'rel_path': rel_path,
+        'pothole_count': pothole_count,
+        'detection_type': detection_type,
+        'pothole_detected': pothole_detected,
+    }
+
+def run_video_detection(video_path, location, user_id, sample_fps=None, progress=None, coords=None,
+                        capture=None, on_result=None, job_id=None, alert_sent=False):
+    """Detect potholes in a video, record it and alert if needed
+
+    ``coords`` is an optional ``(lat, lon)`` stored with every box;
+    ``capture`` and ``on_result`` are passed to ``process_video``.
+    ``job_id`` and ``alert_sent`` are as for ``run_image_detection``.
+    Returns the (JSON-serialisable) context for video_results.html.
+    """
+    detected_frames, pothole_images = process_video(video_path, location, user_id,
+                                                    sample_fps=sample_fps, progress=progress,
+                                                    capture=capture, on_result=on_result)
     
     if detected_frames is None:
-        flash("Error processing video.", 'error')
-        return redirect(url_for('upload'))
+        raise RuntimeError("Error processing video.")
 
     total_potholes = sum(frame['pothole_count'] for frame in detected_frames)
     
-    # Save to database
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    cursor.execute('''INSERT INTO detections 
-                     (user_id, detection_type, location, file_path, pothole_count, alert_sent)
-                     VALUES (?, ?, ?, ?, ?, ?)''',
-                  (session['user_id'], 'video', location, video_path, total_potholes, total_potholes > 0))
-    conn.commit()
-    conn.close()
+    # Save the run, its saved frames and their boxes in one transaction;
+    # alert_sent is set by the dispatcher once delivered
+    lat, lon = coords or (None, None)
+    detection_id = insert_detection(user_id, 'video', location, video_path,
+                                    pothole_images[0] if pothole_images else None,
+                                    total_potholes, alert_sent=alert_sent, frames=detected_frames,
+                                    lat=lat, lon=lon, job_id=job_id)
 
     # Send alert if potholes detected
-    if total_potholes > 0:
+    if total_potholes > 0 and not alert_sent:
         detection_data = {
             'images': pothole_images,
             'location': location,
@@ -516,16 +992,583 @@ def process_video_detection(video_path, location):
             'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'type': 'Video'
         }
-        notify_authorities(detection_data)
+        notify_authorities(detection_data, detection_id)
+
+    return {
+        'detection_id': detection_id,
+        'detected_frames': detected_frames,
+        'location': location,
+        'total_potholes': total_potholes,
+        'frame_count': len(detected_frames),
+        'tracked': any('track_id' in f for f in detected_frames),
+    }
+
+def render_image_result(context):
+    return render_template('results.html',
+                         result=context['result'],
+                         location=context['location'],
+                         image_path=image_url(context['rel_path'], 'md'),
+                         full_image_path=image_url(context['rel_path']),
+                         pothole_count=context['pothole_count'],
+                         detection_type=context['detection_type'],
+                         pothole_detected=context['pothole_detected'])
 
+def render_video_result(context):
+    """The gallery shows the first page of frames; the rest load as it is scrolled"""
+    detected_frames, next_url = context['detected_frames'], None
+    if context.get('detection_id') is not None:
+        # The pipeline's entries know more about tracks than the table does
+        extra = {(f['frame_number'], f.get('track_id')): f for f in detected_frames}
+        rows, next_after = list_detection_frames(context['detection_id'], limit=app.config['GALLERY_PAGE_SIZE'])
+        detected_frames = [dict(extra.get((r['frame_number'], r['track_id']), {}), **_gallery_frame(r))
+                           for r in rows]
+        if next_after is not None:
+            next_url = url_for('detection_frames', detection_id=context['detection_id'],
+                               after=_format_cursor(next_after))
     return render_template('video_results.html',
                          detected_frames=detected_frames,
-                         location=location,
-                         total_potholes=total_potholes,
-                         frame_count=len(detected_frames))
+                         next_url=next_url,
+                         location=context['location'],
+                         total_potholes=context['total_potholes'],
+                         frame_count=context['frame_count'],
+                         tracked=context.get('tracked', False))
+
+def process_image_detection(image_path, location, detection_type, coords=None, image_bytes=None):
+    """Process single image detection"""
+    try:
+        context = run_image_detection(image_path, location, detection_type, session['user_id'], coords,
+                                      image_bytes, defer_artifacts=app.config['DEFER_ARTIFACTS'])
+    except Exception as e:
+        app.logger.exception(f"Detection error: {e}")
+        flash(f"Error: {e}", 'error')
+        return redirect(url_for('upload'))
+    return render_image_result(context)
+
+def process_video_detection(video_path, location, sample_fps=None, coords=None):
+    """Process video detection"""
+    try:
+        context = run_video_detection(video_path, location, session['user_id'], sample_fps, coords=coords)
+    except Exception as e:
+        app.logger.exception(f"Video detection error: {e}")
+        flash(f"Error: {e}", 'error')
+        return redirect(url_for('upload'))
+    return render_video_result(context)
+
+# ========================
+# Live Camera Streaming
+# ========================
+try:
+    from flask_sock import Sock
+except ImportError:  # WebSocket endpoint is optional; HTTP streaming always works
+    Sock = None
+
+def _get_user_stream(stream_id):
+    stream = streaming.get_session(stream_id)
+    if stream is None or stream.user_id != session.get('user_id'):
+        return None
+    return stream
+
+def _stream_url(stream_id, **kwargs):
+    return {
+        'stream_id': stream_id,
+        'frames_url': url_for('stream_frame', stream_id=stream_id),
+        'events_url': url_for('stream_events', stream_id=stream_id),
+        'mjpeg_url': url_for('stream_mjpeg', stream_id=stream_id),
+        'stats_url': url_for('stream_stats', stream_id=stream_id),
+        **kwargs,
+    }
+
+@app.route('/api/stream', methods=['POST'])
+def start_stream():
+    """Open a live detection session for a camera"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    m = load_model()
+    if m is None:
+        return jsonify({'error': 'Model not loaded. Check server logs.'}), 503
+    stream = streaming.create_session(session['user_id'], m, conf=app.config['DETECTION_CONF'])
+    app.logger.info(f"📡 Started live stream {stream.stream_id}")
+    return jsonify(_stream_url(stream.stream_id)), 201
+
+@app.route('/api/stream/<stream_id>/frames', methods=['POST'])
+def stream_frame(stream_id):
+    """Accept one JPEG frame (raw body or a 'frame' file field)"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    stream = _get_user_stream(stream_id)
+    if stream is None:
+        return jsonify({'error': 'Stream not found'}), 404
+    upload = request.files.get('frame')
+    data = upload.read() if upload else request.get_data()
+    if not data:
+        return jsonify({'error': 'Empty frame'}), 400
+    try:
+        return jsonify(stream.submit(data)), 202
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 410
+
+@app.route('/api/stream/<stream_id>/events')
+def stream_events(stream_id):
+    """Server-Sent Events with one detection message per processed frame"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    stream = _get_user_stream(stream_id)
+    if stream is None:
+        return jsonify({'error': 'Stream not found'}), 404
+
+    def events():
+        q = stream.subscribe()
+        try:
+            # Sends the headers right away and sets the client's reconnect delay
+            yield 'retry: 2000\n\n'
+            while True:
+                try:
+                    event = q.get(timeout=15)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is None:
+                    yield 'event: end\ndata: {}\n\n'
+                    return
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            stream.unsubscribe(q)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/stream/<stream_id>/mjpeg')
+def stream_mjpeg(stream_id):
+    """Annotated frames as an MJPEG stream, for an <img> tag"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    stream = _get_user_stream(stream_id)
+    if stream is None:
+        return jsonify({'error': 'Stream not found'}), 404
+
+    def parts():
+        for jpeg in stream.mjpeg_frames():
+            yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+
+    return Response(stream_with_context(parts()), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/api/stream/<stream_id>', methods=['GET', 'DELETE'])
+def stream_stats(stream_id):
+    """GET: frame counts and latency percentiles; DELETE: end the stream"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    stream = _get_user_stream(stream_id)
+    if stream is None:
+        return jsonify({'error': 'Stream not found'}), 404
+    if request.method == 'DELETE':
+        stream.close()
+        app.logger.info(f"📡 Closed live stream {stream_id}: {stream.stats()}")
+    return jsonify(stream.stats())
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/ws/stream')
+    def stream_ws(ws):
+        """Binary JPEG frames in, JSON detection messages out, on one socket"""
+        if 'user' not in session:
+            ws.close(reason=1008, message='Login required')
+            return
+        m = load_model()
+        if m is None:
+            ws.close(reason=1011, message='Model not loaded')
+            return
+        stream = streaming.create_session(session['user_id'], m, conf=app.config['DETECTION_CONF'])
+        q = stream.subscribe()
+        try:
+            while not stream.closed:
+                data = ws.receive(timeout=0.01)
+                if isinstance(data, (bytes, bytearray)) and data:
+                    stream.submit(bytes(data))
+                while True:
+                    try:
+                        event = q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if event is None:
+                        return
+                    ws.send(json.dumps(event))
+        finally:
+            stream.unsubscribe(q)
+            stream.close()
+
+# ========================
+# Chunked Video Uploads
+# ========================
+def _upload_status(upload):
+    status = {
+        'upload_id': upload['id'],
+        'filename': upload['filename'],
+        'size': upload['size'],
+        'received': upload['received'],
+        'complete': upload['complete'],
+        'job_id': upload['job_id'],
+        # Detections saved so far, while the upload is still arriving
+        'frames': [dict(f, url=url_for('static', filename=f['rel_path'])) for f in upload['frames']],
+    }
+    if upload['job_id']:
+        status['status_url'] = url_for('job_status', job_id=upload['job_id'])
+        status['result_url'] = url_for('job_result', job_id=upload['job_id'])
+    return status
+
+def _start_upload_job(upload):
+    """Queue detection once enough of the video is in (again, if a run failed)"""
+    if upload['received'] < app.config['UPLOAD_EARLY_START_BYTES'] and not upload['complete']:
+        return upload
+    if upload['job_id']:
+        job = get_job(upload['job_id'])
+        if job is not None and job['status'] != 'failed':
+            return upload
+    params = dict(upload['params'], upload_id=upload['id'])
+    job_id = enqueue_job(upload['user_id'], 'video', upload['file_path'], upload['location'], params)
+    set_upload_job(upload['id'], job_id)
+    app.logger.info(f"🗂️ Queued video job {job_id} for upload {upload['id']} "
+                    f"at {upload['received']}/{upload['size']} bytes")
+    return get_upload(upload['id'])
+
+def _get_user_upload(upload_id):
+    upload = get_upload(upload_id)
+    if upload is None or upload['user_id'] != session.get('user_id'):
+        return None
+    return upload
+
+@app.route('/api/uploads', methods=['POST'])
+def start_upload():
+    """Begin a resumable upload; chunks then go to PUT /api/uploads/<id>"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    data = request.get_json(silent=True) or request.form
+    filename = secure_filename(data.get('filename', ''))
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size (in bytes) is required'}), 400
+    if not allowed_file(filename, 'video'):
+        return jsonify({'error': 'Chunked uploads are for video files'}), 400
+    if not 0 < size <= app.config['CHUNKED_UPLOAD_MAX_BYTES']:
+        return jsonify({'error': 'Invalid or too large size'}), 413
+
+    location = data.get('location') or 'Unknown'
+    try:
+        sample_fps = float(data.get('sample_fps') or 0) or None
+    except ValueError:
+        sample_fps = None
+    params = {'sample_fps': sample_fps, 'coords': parse_coordinates(data, location)}
+
+    upload_path = os.path.join(app.config['VIDEO_FOLDER'], storage.unique_name(filename))
+    upload_id = create_upload(session['user_id'], filename, upload_path, size, location, params)
+    app.logger.info(f"📤 Started chunked upload {upload_id} ({size} bytes)")
+    response = jsonify(_upload_status(get_upload(upload_id)))
+    response.headers['Location'] = url_for('upload_chunk', upload_id=upload_id)
+    return response, 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PUT'])
+def upload_chunk(upload_id):
+    """GET: how much has arrived (to resume); PUT: append one Content-Range chunk"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    upload = _get_user_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    if request.method == 'GET':
+        return jsonify(_upload_status(upload))
+
+    try:
+        start, end, total = parse_content_range(request.headers.get('Content-Range'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if total != upload['size']:
+        return jsonify({'error': f"Upload size is {upload['size']} bytes"}), 400
+    try:
+        with metrics.timed('upload_io', 'chunk'):
+            write_chunk(upload, start, end, request.stream)
+    except UploadConflict as e:
+        return jsonify({'error': str(e), 'received': e.received}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e), 'received': get_upload(upload_id)['received']}), 400
+
+    upload = get_upload(upload_id)
+    if not app.config['ASYNC_JOBS']:
+        if not upload['complete']:
+            return jsonify(_upload_status(upload))
+        context = run_video_detection(upload['file_path'], upload['location'], upload['user_id'],
+                                      upload['params'].get('sample_fps'),
+                                      coords=upload['params'].get('coords'))
+        return jsonify(dict(_upload_status(upload), result=context))
+    return jsonify(_upload_status(_start_upload_job(upload)))
+
+# ========================
+# Batch Detection
+# ========================
+# Uploaded zip archives of survey photos; kept out of static/
+BATCH_FOLDER = 'batches'
+os.makedirs(BATCH_FOLDER, exist_ok=True)
+app.config['BATCH_FOLDER'] = BATCH_FOLDER
+# Server directory whose subdirectories can be submitted by path; unset disables it
+app.config['BATCH_ROOT'] = os.getenv("BATCH_ROOT")
+app.config['BATCH_SIZE'] = int(os.getenv("BATCH_SIZE", 8))
+app.config['BATCH_WRITER_THREADS'] = int(os.getenv("BATCH_WRITER_THREADS", 2))
+# Files recorded per database transaction
+app.config['BATCH_CHUNK_SIZE'] = int(os.getenv("BATCH_CHUNK_SIZE", 64))
+
+def run_batch_detection(batch_id, progress=None):
+    """Run (or resume) a batch (see batch.py); returns its status dict"""
+    m = load_model()
+    if m is None:
+        raise RuntimeError("Model not loaded. Check server logs.")
+    output_folder = os.path.join(RESULT_FOLDER, 'batches', batch_id)
+    return run_batch(batch_id, m, output_folder,
+                     batch_size=app.config['BATCH_SIZE'],
+                     writer_threads=app.config['BATCH_WRITER_THREADS'],
+                     conf=app.config['DETECTION_CONF'],
+                     chunk_size=app.config['BATCH_CHUNK_SIZE'],
+                     progress=progress,
+                     notify=notify_authorities)
+
+def _batch_status(batch):
+    return {
+        'batch_id': batch['id'],
+        'status': batch['status'],
+        'total': batch['total'],
+        'processed': batch['processed'],
+        'pothole_count': batch['pothole_count'],
+        'failed': batch['failed'],
+        'error': batch['error'],
+        'status_url': url_for('batch_status', batch_id=batch['id']),
+    }
+
+@app.route('/api/batch', methods=['POST'])
+def start_batch():
+    """Detect potholes in an uploaded zip of photos or a directory under BATCH_ROOT"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    location = request.form.get('location', 'Unknown')
+    coords = parse_coordinates(request.form, location)
+
+    file = request.files.get('file')
+    if file and file.filename:
+        if not file.filename.lower().endswith('.zip'):
+            return jsonify({'error': 'Upload a .zip of images'}), 400
+        source = os.path.abspath(os.path.join(BATCH_FOLDER, storage.unique_name(secure_filename(file.filename))))
+        with metrics.timed('upload_io', 'batch'):
+            file.save(source)
+        batch_id = create_batch(session['user_id'], source, location, coords)
+    elif request.form.get('directory'):
+        if not app.config['BATCH_ROOT']:
+            return jsonify({'error': 'Directory batches are not enabled (BATCH_ROOT)'}), 400
+        source = safe_join(app.config['BATCH_ROOT'], request.form['directory'])
+        if source is None or not os.path.isdir(source):
+            return jsonify({'error': 'Directory not found'}), 404
+        source = os.path.abspath(source)
+        # Submitting the same directory again picks up where it stopped
+        batch_id = find_unfinished_batch(session['user_id'], source) \
+            or create_batch(session['user_id'], source, location, coords)
+    else:
+        return jsonify({'error': 'Send a zip as "file" or a "directory"'}), 400
+
+    if not app.config['ASYNC_JOBS']:
+        try:
+            batch = run_batch_detection(batch_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            # Whatever was recorded stays; submitting the batch again resumes it
+            app.logger.exception(f"Batch {batch_id} failed: {e}")
+            return jsonify(_batch_status(get_batch(batch_id))), 500
+        return jsonify(_batch_status(batch))
+
+    job_id = enqueue_job(session['user_id'], 'batch', source, location, {'batch_id': batch_id})
+    app.logger.info(f"🗂️ Queued batch {batch_id} as job {job_id}")
+    return jsonify(dict(_batch_status(get_batch(batch_id)), job_id=job_id,
+                        job_url=url_for('job_status', job_id=job_id))), 202
+
+@app.route('/api/batch/<batch_id>')
+def batch_status(batch_id):
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    batch = get_batch(batch_id)
+    if batch is None or batch['user_id'] != session['user_id']:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(_batch_status(batch))
+
+# ========================
+# Background Jobs
+# ========================
+def execute_job(job, progress):
+    """Job handler run inside the worker processes (see jobs.py)
+
+    A rerun of an interrupted job first drops the detections its earlier run
+    inserted, so nothing is recorded (or alerted) twice; batches resume from
+    their own per-file progress instead.
+    """
+    init_app_runtime()
+    alert_sent = False
+    if job['attempts'] > 1 and job['job_type'] != 'batch':
+        alert_sent = delete_job_detections(job['id'])
+        app.logger.info(f"🔁 Rerunning job {job['id']} (attempt {job['attempts']})")
+    upload_id = job['params'].get('upload_id')
+    if upload_id:
+        # Chunked upload: read the file while the rest of it is still arriving
+        set_upload_job(upload_id, job['id'])
+        return run_video_detection(job['file_path'], job['location'], job['user_id'],
+                                   job['params'].get('sample_fps'), progress, job['params'].get('coords'),
+                                   capture=GrowingCapture(upload_id, heartbeat=lambda: progress(None)),
+                                   on_result=lambda entry: record_frame(upload_id, entry),
+                                   job_id=job['id'], alert_sent=alert_sent)
+    if job['job_type'] == 'batch':
+        return run_batch_detection(job['params']['batch_id'], progress)
+    if job['job_type'] == 'video':
+        return run_video_detection(job['file_path'], job['location'], job['user_id'],
+                                   job['params'].get('sample_fps'), progress, job['params'].get('coords'),
+                                   job_id=job['id'], alert_sent=alert_sent)
+    return run_image_detection(job['file_path'], job['location'], job['job_type'], job['user_id'],
+                               job['params'].get('coords'), job_id=job['id'], alert_sent=alert_sent)
+
+def _get_user_job(job_id):
+    job = get_job(job_id)
+    if job is None or job['user_id'] != session.get('user_id'):
+        return None
+    return job
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """JSON status/progress of a queued detection"""
+    if 'user' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    job = _get_user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({
+        'id': job['id'],
+        'type': job['job_type'],
+        'status': job['status'],
+        'progress': round(job['progress'] or 0, 3),
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'result_url': url_for('job_result', job_id=job['id']),
+    })
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Rendered results page once the job is done, a progress page until then"""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    job = _get_user_job(job_id)
+    if job is None:
+        flash('Job not found.', 'error')
+        return redirect(url_for('upload'))
+
+    if job['status'] == 'failed':
+        flash(f"Error: {job['error']}", 'error')
+        return redirect(url_for('upload'))
+    if job['status'] != 'done':
+        return render_template('job_status.html', job=job)
+
+    if job['job_type'] == 'batch':
+        return redirect(url_for('batch_status', batch_id=job['params']['batch_id']))
+    if job['job_type'] == 'video':
+        return render_video_result(job['result'])
+    return render_image_result(job['result'])
+
+# ========================
+# Metrics & Profiling
+# ========================
+profiler = None
+if app.config['PROFILE_SLOW_REQUESTS_MS'] > 0:
+    profiler = SamplingProfiler(app.config['PROFILE_DIR'], app.config['PROFILE_SLOW_REQUESTS_MS'] / 1000)
+
+def _job_counts():
+    rows = get_connection(DB_PATH).execute(
+        "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status").fetchall()
+    counts = {'queued': 0, 'running': 0}
+    counts.update({status: n for status, n in rows})
+    return [({'status': status}, n) for status, n in counts.items()]
+
+def _result_cache_stats():
+    stats = result_cache.stats()
+    return [({'field': field}, stats[field]) for field in ('hits', 'misses', 'hit_rate', 'entries', 'size_bytes')]
+
+metrics.gauge('pothole_jobs', 'Detection jobs by status', ('status',), merge='max').set_function(_job_counts)
+metrics.gauge('pothole_alerts_pending', 'Alerts waiting to be emailed').set_function(
+    lambda: alert_dispatcher.pending_count() if alert_dispatcher is not None else 0)
+metrics.gauge('pothole_artifacts_pending', 'Artifacts not yet on disk').set_function(artifact_writer.pending_count)
+metrics.gauge('pothole_stream_sessions', 'Open live stream sessions').set_function(streaming.session_count)
+metrics.gauge('pothole_result_cache', 'Image result cache counters and size', ('field',)).set_function(
+    _result_cache_stats)
+metrics.gauge('pothole_storage_bytes', 'Disk usage per storage class at the last sweep', ('class',)).set_function(
+    lambda: [({'class': name}, size) for name, size in storage_manager.usage().items()])
+
+@app.before_request
+def _start_request_timer():
+    g.request_started_at = time.perf_counter()
+    if profiler is not None:
+        profiler.start()
+
+@app.after_request
+def _record_request(response):
+    elapsed = time.perf_counter() - g.request_started_at
+    metrics.HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint or 'unknown',
+                                         method=request.method, status=response.status_code)
+    if profiler is not None:
+        path = profiler.stop(f"{request.method} {request.path}")
+        if path:
+            app.logger.warning(f"🐢 {request.method} {request.path} took {elapsed * 1000:.0f} ms, profile in {path}")
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of the stage timings, gauges and request latencies"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ========================
+# Application Setup
+# ========================
+_setup_lock = threading.Lock()
+_setup_done = False
+
+def init_app_runtime():
+    """Set up this process (tables, metrics exporter, alert recovery); returns the app
+
+    Importing this module only reads config and registers routes, so job
+    workers and tools start without touching the database, and nothing
+    imports OpenCV or the model stack until a detection needs it. WSGI
+    servers can load ``app:init_app_runtime()``; otherwise this runs on the
+    first request or job.
+
+    This is not an application factory: ``app``, its config and routes,
+    ``result_cache``, ``artifact_writer`` and ``storage_manager`` are module
+    globals built at import time. Calling this again returns the same app,
+    so anything needing separate state (another DATABASE_PATH, say) has to
+    run in its own process, as bench/startup.py and bench/suite.py do.
+    """
+    global _setup_done
+    with _setup_lock:
+        if not _setup_done:
+            init_db()
+            metrics.start_exporter()
+            recover_alerts()
+            _setup_done = True
+    return app
+
+@app.before_request
+def _ensure_setup():
+    if not _setup_done:
+        init_app_runtime()
 
 # ========================
 # Run Flask App
 # ========================
 if __name__ == '__main__':
-    app.run(debug=True, threaded=True)
\ No newline at end of file
+    # Only start workers in the reloader child, not in the watcher process
+    if app.config['ASYNC_JOBS'] and app.config['JOB_WORKERS'] > 0 \
+            and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_workers('app:execute_job', app.config['JOB_WORKERS'], DB_PATH)
+    if app.config['STORAGE_LIFECYCLE'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        storage_manager.start(app.config['STORAGE_SWEEP_SECONDS'])
+    init_app_runtime().run(debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""Background writer for detection artifacts
+
+Rendering the annotated image, JPEG-encoding it and writing it to disk take
+longer than the detection itself for large photos. ``ArtifactWriter`` moves
+that work off the request: the caller hands over the final path and a
+callable that produces the image, and gets the response out as soon as the
+boxes are known. Until the file lands, ``get()`` returns the encoded bytes
+from memory so the result page can already show the image.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import thumbnails
+
+JPEG_QUALITY = 90
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ('encoded', 'ready')
+
+    def __init__(self):
+        self.encoded = None
+        self.ready = threading.Event()
+
+
+class ArtifactWriter:
+    def __init__(self, threads=2):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='artifact-writer')
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._futures = set()
+
+    def submit(self, path, render, on_written=None, variants=False):
+        """Render, encode and write ``path`` in the background
+
+        ``render`` returns a BGR image, or bytes to write as they are.
+        With ``variants``, thumbnails of a rendered image are written too.
+        ``on_written(path)`` runs on the writer thread once the file is on disk.
+        """
+        pending = _Pending()
+        with self._lock:
+            self._pending[path] = pending
+        future = self._pool.submit(self._write, path, render, pending, on_written, variants)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _write(self, path, render, pending, on_written, variants=False):
+        import cv2
+
+        try:
+            start = time.perf_counter()
+            image = render()
+            if isinstance(image, (bytes, bytearray)):
+                pending.encoded = bytes(image)
+            else:
+                metrics.observe_stage('plot', time.perf_counter() - start, 'image')
+                with metrics.timed('encode', 'image'):
+                    ok, buf = cv2.imencode(os.path.splitext(path)[1] or '.jpg', image,
+                                           [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                if not ok:
+                    raise ValueError(f"Could not encode {path}")
+                pending.encoded = buf.tobytes()
+            pending.ready.set()
+
+            # Write next to the target and rename, so readers never see half a file
+            tmp_path = f"{path}.tmp{threading.get_ident()}"
+            with metrics.timed('imwrite', 'image'):
+                with open(tmp_path, 'wb') as f:
+                    f.write(pending.encoded)
+                os.replace(tmp_path, path)
+            if variants and not isinstance(image, (bytes, bytearray)):
+                thumbnails.write_variants(path, image)
+        except Exception:
+            logger.exception(f"Writing artifact {path} failed")
+            pending.ready.set()
+            raise
+        finally:
+            with self._lock:
+                if self._pending.get(path) is pending:
+                    del self._pending[path]
+        if on_written is not None:
+            on_written(path)
+
+    def get(self, path, timeout=10.0):
+        """Encoded bytes of a not-yet-written artifact, or None if not pending"""
+        with self._lock:
+            pending = self._pending.get(path)
+        if pending is None or not pending.ready.wait(timeout):
+            return None
+        return pending.encoded
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far is on disk"""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass  # already logged by _write
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,84 @@
+"""Inference backends for the pothole model
+
+The trained weights are a PyTorch checkpoint, but on CPU-only nodes an
+exported ONNX Runtime or OpenVINO model is usually much faster. Exported
+models are cached next to the ``.pt`` file and rebuilt when the checkpoint
+changes; ultralytics loads all of them through the same ``YOLO`` class, so
+``predict`` returns the same ``Results`` objects whichever backend is used.
+
+Backends:
+    pytorch    the checkpoint as-is (default)
+    onnx       ONNX export run by onnxruntime
+    onnx-int8  the ONNX export with dynamically quantized int8 weights
+    openvino   OpenVINO IR export
+"""
+import logging
+import os
+
+BACKENDS = ('pytorch', 'onnx', 'onnx-int8', 'openvino')
+
+logger = logging.getLogger(__name__)
+
+
+def exported_model_path(model_path, backend):
+    """Where the cached export for ``backend`` lives"""
+    stem, _ = os.path.splitext(model_path)
+    if backend == 'pytorch':
+        return model_path
+    if backend == 'onnx':
+        return stem + '.onnx'
+    if backend == 'onnx-int8':
+        return stem + '_int8.onnx'
+    if backend == 'openvino':
+        return stem + '_openvino_model'
+    raise ValueError(f"Unknown inference backend {backend!r}; choose one of {', '.join(BACKENDS)}")
+
+
+def _is_fresh(export_path, model_path):
+    return os.path.exists(export_path) and os.path.getmtime(export_path) >= os.path.getmtime(model_path)
+
+
+def _export(model_path, fmt, imgsz):
+    from ultralytics import YOLO
+
+    # dynamic axes so the video pipeline can send whole batches of frames
+    return YOLO(model_path).export(format=fmt, imgsz=imgsz, dynamic=True)
+
+
+def _quantize_int8(onnx_path, int8_path):
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+
+    # Keep the ultralytics metadata (class names, stride, imgsz) on the quantized model
+    source = onnx.load(onnx_path, load_external_data=False)
+    quantized = onnx.load(int8_path)
+    existing = {p.key for p in quantized.metadata_props}
+    for prop in source.metadata_props:
+        if prop.key not in existing:
+            quantized.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(quantized, int8_path)
+
+
+def ensure_backend_model(model_path, backend='pytorch', imgsz=640):
+    """Return a loadable model path for ``backend``, exporting it if needed"""
+    path = exported_model_path(model_path, backend)
+    if backend == 'pytorch' or _is_fresh(path, model_path):
+        return path
+
+    logger.info(f"Exporting {os.path.basename(model_path)} for the {backend} backend ...")
+    if backend in ('onnx', 'onnx-int8'):
+        onnx_path = exported_model_path(model_path, 'onnx')
+        if not _is_fresh(onnx_path, model_path):
+            exported = _export(model_path, 'onnx', imgsz)
+            if os.path.abspath(exported) != os.path.abspath(onnx_path):
+                os.replace(exported, onnx_path)
+        if backend == 'onnx-int8':
+            _quantize_int8(onnx_path, path)
+    elif backend == 'openvino':
+        exported = _export(model_path, 'openvino', imgsz)
+        if os.path.abspath(exported) != os.path.abspath(path):
+            os.replace(exported, path)
+    logger.info(f"Cached {backend} model at {path}")
+    return path
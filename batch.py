@@ -0,0 +1,388 @@
+"""Batch detection over a directory or zip archive of photos
+
+Survey contractors deliver thousands of geotagged photos at once. A batch
+streams them through the model instead of one HTTP request per photo: a
+reader thread decodes the next images while the model runs ``batch_size``
+of them per forward pass, a small thread pool draws and writes the annotated
+images, and every chunk of results is recorded, together with the per-file
+progress, in one transaction. One consolidated alert goes out at the end.
+
+Progress is kept per file in ``batch_files``, so running an interrupted
+batch again (a requeued job, or the CLI on the same source) skips every file
+already recorded. A photo that cannot be read, inferred or annotated is
+recorded as failed, with its error, and the batch carries on. Each photo's GPS position is read from its EXIF data when
+Pillow is installed, falling back to the batch's own coordinates.
+
+Run from the command line with ``python batch.py <directory-or-zip> --user <name>``.
+"""
+import argparse
+import io
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import thumbnails
+from db import DB_PATH, get_connection, insert_detections, transaction
+
+try:
+    from PIL import Image
+except ImportError:  # EXIF coordinates are optional; the batch coordinates are used instead
+    Image = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# Most-affected photos attached to the consolidated alert
+ALERT_IMAGES = 5
+_DONE = object()
+
+logger = logging.getLogger(__name__)
+
+
+def init_batch_tables(db_path=DB_PATH):
+    with transaction(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                location TEXT,
+                lat REAL,
+                lon REAL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                total INTEGER NOT NULL DEFAULT 0,
+                processed INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS batch_files (
+                batch_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                detection_id INTEGER,
+                pothole_count INTEGER NOT NULL DEFAULT 0,
+                result_path TEXT,
+                error TEXT,
+                PRIMARY KEY (batch_id, name),
+                FOREIGN KEY (batch_id) REFERENCES batches (id)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_batches_source ON batches (user_id, source)')
+
+
+def create_batch(user_id, source, location, coords=None, db_path=DB_PATH):
+    batch_id = uuid.uuid4().hex
+    lat, lon = coords or (None, None)
+    get_connection(db_path).execute(
+        'INSERT INTO batches (id, user_id, source, location, lat, lon) VALUES (?, ?, ?, ?, ?, ?)',
+        (batch_id, user_id, source, location, lat, lon))
+    return batch_id
+
+
+def get_batch(batch_id, db_path=DB_PATH):
+    conn = get_connection(db_path)
+    row = conn.execute('SELECT * FROM batches WHERE id = ?', (batch_id,)).fetchone()
+    if row is None:
+        return None
+    batch = dict(row)
+    counts = conn.execute('''SELECT COUNT(*), COALESCE(SUM(pothole_count), 0), COUNT(error)
+                             FROM batch_files WHERE batch_id = ?''', (batch_id,)).fetchone()
+    batch['pothole_count'], batch['failed'] = counts[1], counts[2]
+    return batch
+
+
+def find_unfinished_batch(user_id, source, db_path=DB_PATH):
+    """The latest batch over ``source`` that has not completed, if any"""
+    row = get_connection(db_path).execute(
+        '''SELECT id FROM batches WHERE user_id = ? AND source = ? AND status != 'done'
+           ORDER BY created_at DESC, rowid DESC LIMIT 1''', (user_id, source)).fetchone()
+    return row['id'] if row else None
+
+
+def _set_status(batch_id, status, db_path=DB_PATH, **fields):
+    assignments = ''.join(f', {name} = ?' for name in fields)
+    get_connection(db_path).execute(
+        f'UPDATE batches SET status = ?{assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        (status, *fields.values(), batch_id))
+
+
+def list_images(source):
+    """``(name, read)`` for every image in a directory (recursively) or zip archive"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = sorted(info.filename for info in archive.infolist()
+                           if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+                           and not info.filename.startswith('__MACOSX/'))
+        local = threading.local()
+
+        def reader(name):
+            # ZipFile objects are not safe to share between threads
+            def read():
+                archive = getattr(local, 'archive', None)
+                if archive is None:
+                    archive = local.archive = zipfile.ZipFile(source)
+                return archive.read(name)
+            return read
+        return [(name, reader(name)) for name in names]
+
+    if not os.path.isdir(source):
+        raise ValueError(f"{source} is neither a directory nor a zip archive")
+    images = []
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, filename)
+                images.append((os.path.relpath(path, source).replace(os.sep, '/'), _file_reader(path)))
+    return images
+
+
+def _file_reader(path):
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+
+def _dms(values):
+    degrees, minutes, seconds = (float(v) for v in values)
+    return degrees + minutes / 60 + seconds / 3600
+
+
+def exif_coords(data):
+    """``(lat, lon)`` from a photo's EXIF GPS tags, or None"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            gps = img.getexif().get_ifd(0x8825)
+        if 2 not in gps or 4 not in gps:
+            return None
+        lat = _dms(gps[2]) * (-1 if gps.get(1) in ('S', b'S') else 1)
+        lon = _dms(gps[4]) * (-1 if gps.get(3) in ('W', b'W') else 1)
+    except Exception:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def _read_images(pending, default_coords, out_q, stop):
+    import cv2
+    import numpy as np
+
+    for name, read in pending:
+        if stop.is_set():
+            break
+        try:
+            data = read()
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("Not a readable image")
+            item = (name, image, exif_coords(data) or default_coords, None)
+        except Exception as e:
+            item = (name, None, None, f"{type(e).__name__}: {e}")
+        out_q.put(item)
+    out_q.put(_DONE)
+
+
+def _result_filename(index, name):
+    stem = os.path.splitext(name.replace('/', '__'))[0]
+    return f"{index:06d}_{stem}.jpg"
+
+
+def _annotate(result, path):
+    import cv2
+
+    annotated = result.plot()
+    cv2.imwrite(path, annotated)
+    thumbnails.write_variants(path, annotated)
+    return path
+
+
+def run_batch(batch_id, model, output_folder, batch_size=8, writer_threads=2, conf=0.25,
+              chunk_size=64, queue_size=32, progress=None, notify=None, db_path=DB_PATH):
+    """Detect potholes in every not yet processed image of a batch
+
+    Annotated images of photos with potholes are written to
+    ``output_folder``; photos without any get no result image. ``progress``
+    is called with the fraction of files done. ``notify(detection_data,
+    detection_ids)`` sends the consolidated alert once everything is in.
+    Returns the final ``get_batch()`` dict.
+    """
+    batch = get_batch(batch_id, db_path)
+    if batch is None:
+        raise ValueError(f"Unknown batch {batch_id}")
+    images = list_images(batch['source'])
+    done = {row['name'] for row in get_connection(db_path).execute(
+        'SELECT name FROM batch_files WHERE batch_id = ?', (batch_id,))}
+    pending = [(name, read) for name, read in images if name not in done]
+    processed = len(images) - len(pending)
+    _set_status(batch_id, 'running', db_path, total=len(images), processed=processed)
+    if done:
+        logger.info(f"Batch {batch_id}: resuming, {len(done)} of {len(images)} file(s) already done")
+    os.makedirs(output_folder, exist_ok=True)
+
+    default_coords = (batch['lat'], batch['lon']) if batch['lat'] is not None else None
+    images_q = queue.Queue(maxsize=max(queue_size, batch_size))
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_images, name='batch-reader',
+                              args=(pending, default_coords, images_q, stop), daemon=True)
+    reader.start()
+    writers = ThreadPoolExecutor(max_workers=max(1, writer_threads), thread_name_prefix='batch-writer')
+    started = time.perf_counter()
+    chunk = []
+
+    def record(chunk):
+        # One transaction per chunk: the detections and the files they complete
+        nonlocal processed
+        rows, files = [], []
+        for name, result_path, count, boxes, coords, error in chunk:
+            if result_path is not None:
+                try:
+                    result_path = result_path.result()
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    logger.warning(f"Batch {batch_id}: skipping {name}: could not write its result: {error}")
+                    result_path, count = None, 0
+            files.append([batch_id, name, None, count, result_path, error])
+            if error is None:
+                lat, lon = coords or (None, None)
+                rows.append({'user_id': batch['user_id'], 'detection_type': 'batch',
+                             'location': batch['location'], 'file_path': f"{batch['source']}/{name}",
+                             'result_path': result_path, 'pothole_count': count,
+                             'boxes': [(0, box) for box in boxes], 'lat': lat, 'lon': lon})
+        with transaction(db_path) as conn:
+            ids = iter(insert_detections(rows, conn=conn))
+            for entry in files:
+                if entry[5] is None:
+                    entry[2] = next(ids)
+            conn.executemany('''INSERT OR REPLACE INTO batch_files
+                                (batch_id, name, detection_id, pothole_count, result_path, error)
+                                VALUES (?, ?, ?, ?, ?, ?)''', files)
+            processed += len(files)
+            conn.execute('UPDATE batches SET processed = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         (processed, batch_id))
+        if progress is not None and images:
+            progress(processed / len(images))
+
+    def skip(name, e):
+        error = f"{type(e).__name__}: {e}"
+        logger.warning(f"Batch {batch_id}: skipping {name}: {error}")
+        chunk.append((name, None, 0, [], None, error))
+
+    def infer(items):
+        try:
+            results = model.predict(source=[image for _, image, _, _ in items], conf=conf, save=False,
+                                    verbose=False)
+        except Exception as e:
+            if len(items) == 1:
+                skip(items[0][0], e)
+                return
+            # Find the photo(s) the model chokes on instead of failing them all
+            for item in items:
+                infer([item])
+            return
+        for (name, _, coords, _), result in zip(items, results):
+            try:
+                boxes = result.boxes
+                box_rows = [xyxy + [c, k] for xyxy, c, k in
+                            zip(boxes.xyxy.tolist(), boxes.conf.tolist(), boxes.cls.tolist())]
+            except Exception as e:
+                skip(name, e)
+                continue
+            result_path = None
+            if box_rows:
+                path = os.path.join(output_folder, _result_filename(processed + len(chunk), name))
+                result_path = writers.submit(_annotate, result, path)
+            chunk.append((name, result_path, len(box_rows), box_rows, coords, None))
+
+    try:
+        items = []
+        while True:
+            item = images_q.get()
+            if item is not _DONE:
+                if item[3] is not None:
+                    logger.warning(f"Batch {batch_id}: skipping {item[0]}: {item[3]}")
+                    chunk.append((item[0], None, 0, [], None, item[3]))
+                else:
+                    items.append(item)
+            if items and (len(items) >= batch_size or item is _DONE):
+                infer(items)
+                items = []
+            if chunk and (len(chunk) >= chunk_size or item is _DONE):
+                record(chunk)
+                chunk = []
+            if item is _DONE:
+                break
+    except BaseException as e:
+        stop.set()
+        writers.shutdown(wait=True)
+        _set_status(batch_id, 'failed', db_path, error=f"{type(e).__name__}: {e}")
+        raise
+    writers.shutdown(wait=True)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Batch {batch_id}: {len(pending)} file(s) in {elapsed:.1f}s "
+                f"({len(pending) / elapsed if elapsed else 0:.1f} images/sec)")
+    _set_status(batch_id, 'done', db_path, error=None)
+    batch = get_batch(batch_id, db_path)
+    if notify is not None and batch['pothole_count'] > 0:
+        _send_alert(batch, notify, db_path)
+    return batch
+
+
+def _send_alert(batch, notify, db_path=DB_PATH):
+    conn = get_connection(db_path)
+    worst = conn.execute('''SELECT result_path FROM batch_files
+                            WHERE batch_id = ? AND result_path IS NOT NULL
+                            ORDER BY pothole_count DESC, name LIMIT ?''', (batch['id'], ALERT_IMAGES)).fetchall()
+    detection_ids = [row['detection_id'] for row in conn.execute(
+        '''SELECT detection_id FROM batch_files
+           WHERE batch_id = ? AND detection_id IS NOT NULL AND pothole_count > 0''', (batch['id'],))]
+    affected = len(detection_ids)
+    notify({
+        'images': [row['result_path'] for row in worst],
+        'location': batch['location'],
+        'count': batch['pothole_count'],
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'type': f"Batch ({affected} of {batch['total']} photos affected)",
+    }, detection_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Detect potholes in a directory or zip archive of photos')
+    parser.add_argument('source', help="directory (searched recursively) or .zip of images")
+    parser.add_argument('--user', required=True, help="username the detections belong to")
+    parser.add_argument('--location', default='Batch upload')
+    parser.add_argument('--lat', type=float, help="position for photos without EXIF GPS")
+    parser.add_argument('--lon', type=float)
+    parser.add_argument('--new', action='store_true', help="start over instead of resuming an unfinished batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from app import init_app_runtime, run_batch_detection
+
+    init_app_runtime()
+    source = os.path.abspath(args.source)
+    user = get_connection().execute('SELECT id FROM users WHERE username = ?', (args.user,)).fetchone()
+    if user is None:
+        raise SystemExit(f"No user named {args.user}")
+    batch_id = None if args.new else find_unfinished_batch(user['id'], source)
+    if batch_id is None:
+        coords = (args.lat, args.lon) if args.lat is not None and args.lon is not None else None
+        batch_id = create_batch(user['id'], source, args.location, coords)
+
+    batch = run_batch_detection(batch_id, progress=lambda p: logger.info(f"Batch {batch_id}: {p:.0%}"))
+    logger.info(f"✅ Batch {batch_id}: {batch['processed']} file(s), {batch['pothole_count']} pothole(s), "
+                f"{batch['failed']} unreadable")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Accuracy vs latency of the inference backends on static/uploads
+
+The PyTorch checkpoint is the reference: for every other backend we report
+how many of the reference boxes it reproduces (recall, IoU >= 0.5), how many
+of its boxes match a reference box (precision), and per-image latency. If
+the PyTorch run fails, only latencies and box counts are reported.
+
+Uploads are stored content-addressed in ``<xx>/`` subdirectories, so the
+images are collected recursively.
+
+Usage (from the repository root):
+    python bench/backends.py [--backends pytorch,onnx,onnx-int8,openvino] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backends import BACKENDS, ensure_backend_model  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def box_iou(a, b):
+    """IoU matrix between two (N, 4) / (M, 4) xyxy arrays"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter)
+
+
+def matches(reference, boxes, threshold=0.5):
+    """Greedy one-to-one matching; returns the number of matched pairs"""
+    iou = box_iou(reference, boxes)
+    matched = 0
+    while iou.size and iou.max() >= threshold:
+        i, j = np.unravel_index(iou.argmax(), iou.shape)
+        iou[i, :] = 0
+        iou[:, j] = 0
+        matched += 1
+    return matched
+
+
+def run_backend(model_path, backend, images, repeat):
+    from ultralytics import YOLO
+
+    m = YOLO(ensure_backend_model(model_path, backend), task='detect')
+    m.predict(source=images[0], save=False, verbose=False)  # warm-up
+    latencies, boxes = [], []
+    for img in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = m.predict(source=img, save=False, verbose=False)[0]
+            latencies.append(time.perf_counter() - start)
+        xyxy = result.boxes.xyxy
+        boxes.append(xyxy.cpu().numpy() if hasattr(xyxy, 'cpu') else np.asarray(xyxy))
+    return latencies, boxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model', default=os.getenv(
+        "MODEL_PATH", os.path.join(ROOT, 'model', 'pothole_yolov11_best.pt')))
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.model):
+        print(f"❌ Model not found at {args.model}")
+        return 1
+    uploads = os.path.join(ROOT, 'static', 'uploads')
+    paths = sorted(p for ext in IMAGE_EXTENSIONS
+                   for p in glob.glob(os.path.join(uploads, '**', f'*{ext}'), recursive=True))
+    images = [img for img in map(cv2.imread, paths) if img is not None]
+    if not images:
+        print(f"❌ No readable images under {uploads}")
+        return 1
+
+    backends = args.backends.split(',')
+    if 'pytorch' not in backends:
+        backends.insert(0, 'pytorch')
+    results = {}
+    for backend in backends:
+        try:
+            results[backend] = run_backend(args.model, backend, images, args.repeat)
+        except Exception as e:
+            print(f"⚠️ {backend}: {e}")
+
+    if not results:
+        print("❌ No backend could run")
+        return 1
+    reference = results['pytorch'][1] if 'pytorch' in results else None
+    if reference is None:
+        print(f"{len(images)} images; no PyTorch reference, so recall and precision are not reported")
+    else:
+        ref_total = sum(len(b) for b in reference)
+        print(f"{len(images)} images, {ref_total} reference boxes")
+    print(f"{'backend':>10} {'p50 ms':>8} {'p95 ms':>8} {'boxes':>6} {'recall':>7} {'precision':>9}")
+    for backend, (latencies, boxes) in results.items():
+        latencies.sort()
+        total = sum(len(b) for b in boxes)
+        if reference is None:
+            recall = precision = 'n/a'
+        else:
+            matched = sum(matches(r, b) for r, b in zip(reference, boxes))
+            recall = f"{matched / ref_total if ref_total else 1.0:.3f}"
+            precision = f"{matched / total if total else 1.0:.3f}"
+        print(f"{backend:>10} {1000 * statistics.median(latencies):>8.1f} "
+              f"{1000 * latencies[int(0.95 * (len(latencies) - 1))]:>8.1f} "
+              f"{total:>6} {recall:>7} {precision:>9}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
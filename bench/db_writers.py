@@ -0,0 +1,133 @@
+"""Concurrent detection inserts: connect-per-request vs the pooled WAL data layer
+
+Simulates N upload handlers writing detections (with a few saved video frames
+each) at once and reports inserts/sec and "database is locked" failures for:
+  - baseline: a fresh rollback-journal connection per insert, as app.py used to do
+  - pooled:   db.insert_detection on per-thread WAL connections
+  - bulk:     db.insert_detections, one transaction per batch
+
+Usage (from the repository root):
+    python bench/db_writers.py [--threads 8] [--inserts 500] [--frames 5]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+
+def _row(thread_id, i, frames):
+    return {
+        'user_id': 1,
+        'detection_type': 'video' if frames else 'image',
+        'location': f'Street {thread_id}',
+        'file_path': f'static/uploads/{thread_id}_{i}.mp4',
+        'result_path': None,
+        'pothole_count': frames,
+        'frames': [{'frame_number': n * 30, 'pothole_count': 1, 'path': f'f_{thread_id}_{i}_{n}.jpg'}
+                   for n in range(frames)],
+    }
+
+
+def baseline_insert(db_path, row):
+    # Mirrors the old handlers: default journal, 5 s timeout, one commit per statement
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''INSERT INTO detections
+                          (user_id, detection_type, location, file_path, result_path, pothole_count, alert_sent)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                       (row['user_id'], row['detection_type'], row['location'], row['file_path'],
+                        row['result_path'], row['pothole_count'], False))
+        conn.commit()
+        detection_id = cursor.lastrowid
+        for f in row['frames']:
+            cursor.execute('''INSERT INTO detection_frames (detection_id, frame_number, pothole_count, result_path)
+                              VALUES (?, ?, ?, ?)''',
+                           (detection_id, f['frame_number'], f['pothole_count'], f['path']))
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def pooled_insert(db_path, row):
+    db.insert_detection(db_path=db_path, **row)
+
+
+def run(label, db_path, threads, inserts, frames, insert=None, batch=None):
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def writer(thread_id):
+        barrier.wait()
+        rows = [_row(thread_id, i, frames) for i in range(inserts)]
+        try:
+            if batch:
+                for start in range(0, len(rows), batch):
+                    try:
+                        db.insert_detections(rows[start:start + batch], db_path=db_path)
+                    except sqlite3.OperationalError as e:
+                        errors.append(str(e))
+            else:
+                for row in rows:
+                    try:
+                        insert(db_path, row)
+                    except sqlite3.OperationalError as e:
+                        errors.append(str(e))
+        finally:
+            db.close_connections()
+
+    workers = [threading.Thread(target=writer, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(db_path)
+    stored = conn.execute('SELECT COUNT(*) FROM detections').fetchone()[0]
+    conn.close()
+    print(f"{label:<9} {stored:>7} rows  {stored / elapsed:>9.0f} inserts/s  "
+          f"{len(errors):>5} lock errors  ({elapsed:.2f}s)")
+
+
+def fresh_db(folder, name, wal):
+    path = os.path.join(folder, name)
+    db.init_schema(path)
+    db.close_connections()
+    if not wal:
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--inserts', type=int, default=500, help="detections per thread")
+    parser.add_argument('--frames', type=int, default=5, help="saved frames per detection")
+    parser.add_argument('--batch', type=int, default=50, help="rows per transaction in bulk mode")
+    args = parser.parse_args()
+
+    print(f"{args.threads} writer threads x {args.inserts} detections, {args.frames} frames each")
+    with tempfile.TemporaryDirectory() as folder:
+        run('baseline', fresh_db(folder, 'baseline.db', wal=False),
+            args.threads, args.inserts, args.frames, insert=baseline_insert)
+        run('pooled', fresh_db(folder, 'pooled.db', wal=True),
+            args.threads, args.inserts, args.frames, insert=pooled_insert)
+        run('bulk', fresh_db(folder, 'bulk.db', wal=True),
+            args.threads, args.inserts, args.frames, batch=args.batch)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
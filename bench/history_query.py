@@ -0,0 +1,128 @@
+"""History page and dashboard latency on a large synthetic detections table
+
+Fills a temporary database with detections spread over a year and many
+users (1M by default, one heavy user holding a tenth of them), then times
+for the heavy user:
+
+  - the first and a deep page of db.list_user_detections against the same
+    page fetched with LIMIT/OFFSET;
+  - the dashboard queries on the rollup tables (totals, last 30 days, top
+    locations) against the same numbers aggregated from detections.
+
+Usage (from the repository root):
+    python bench/history_query.py [--detections 1000000] [--users 100]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+HEAVY_USER = 1
+PAGE_SIZE = 20
+
+
+def fill(db_path, n_detections, n_users, batch=10000):
+    """Insert through the triggers, as the app does; returns the insert rate"""
+    rng = random.Random(0)
+    start_time = datetime(2025, 1, 1)
+    seconds = 365 * 86400
+    conn = db.get_connection(db_path)
+    started = time.perf_counter()
+    for offset in range(0, n_detections, batch):
+        count = min(batch, n_detections - offset)
+        rows = []
+        for i in range(offset, offset + count):
+            user_id = HEAVY_USER if rng.random() < 0.1 else rng.randint(2, n_users)
+            at = start_time + timedelta(seconds=seconds * i // n_detections)
+            rows.append((user_id, rng.choice(('image', 'video', 'camera')), f'Street {rng.randint(1, 300)}',
+                         f'static/uploads/synthetic_{i}.jpg', rng.randint(0, 5), at.strftime('%Y-%m-%d %H:%M:%S'),
+                         rng.random() < 0.3))
+        with db.transaction(db_path) as tx:
+            tx.executemany('''INSERT INTO detections
+                              (user_id, detection_type, location, file_path, pothole_count, detected_at, alert_sent)
+                              VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+    elapsed = time.perf_counter() - started
+    conn.execute('ANALYZE')
+    return n_detections / elapsed
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return 1000 * statistics.median(samples)
+
+
+def offset_page(conn, user_id, offset):
+    return conn.execute('''SELECT id, detection_type, location, result_path, pothole_count, detected_at, alert_sent
+                           FROM detections WHERE user_id = ?
+                           ORDER BY detected_at DESC, id DESC LIMIT ? OFFSET ?''',
+                        (user_id, PAGE_SIZE, offset)).fetchall()
+
+
+def aggregate_dashboard(conn, user_id, since):
+    conn.execute('''SELECT COUNT(DISTINCT date(detected_at)), COUNT(*), SUM(pothole_count), SUM(alert_sent)
+                    FROM detections WHERE user_id = ?''', (user_id,)).fetchone()
+    conn.execute('''SELECT date(detected_at), COUNT(*), SUM(pothole_count), SUM(alert_sent)
+                    FROM detections WHERE user_id = ? AND detected_at >= ? GROUP BY 1''', (user_id, since)).fetchall()
+    conn.execute('''SELECT location, SUM(pothole_count) AS potholes FROM detections WHERE user_id = ?
+                    GROUP BY location ORDER BY potholes DESC LIMIT 10''', (user_id,)).fetchall()
+
+
+def rollup_dashboard(db_path, user_id, since):
+    db.user_totals(user_id, db_path=db_path)
+    db.user_daily_stats(user_id, since=since, db_path=db_path)
+    db.user_top_locations(user_id, limit=10, db_path=db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--detections', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, 'history.db')
+        db.init_schema(db_path)
+        rate = fill(db_path, args.detections, args.users)
+        conn = db.get_connection(db_path)
+        heavy = conn.execute('SELECT COUNT(*) FROM detections WHERE user_id = ?', (HEAVY_USER,)).fetchone()[0]
+        print(f"Inserted {args.detections:,} detections at {rate:,.0f}/s; user {HEAVY_USER} has {heavy:,}")
+
+        # Cursor of the page 90% of the way into the heavy user's history
+        depth = int(heavy * 0.9)
+        row = offset_page(conn, HEAVY_USER, depth - 1)[0]
+        cursor = (row['detected_at'], row['id'])
+        since = conn.execute('SELECT date(MAX(detected_at), ?) FROM detections', ('-29 days',)).fetchone()[0]
+
+        rows = [
+            ('first page, keyset', timed(lambda: db.list_user_detections(HEAVY_USER, limit=PAGE_SIZE,
+                                                                         db_path=db_path), args.repeat)),
+            ('first page, offset', timed(lambda: offset_page(conn, HEAVY_USER, 0), args.repeat)),
+            (f'page at {depth:,}, keyset', timed(lambda: db.list_user_detections(
+                HEAVY_USER, before=cursor, limit=PAGE_SIZE, db_path=db_path), args.repeat)),
+            (f'page at {depth:,}, offset', timed(lambda: offset_page(conn, HEAVY_USER, depth), args.repeat)),
+            ('dashboard, rollups', timed(lambda: rollup_dashboard(db_path, HEAVY_USER, since), args.repeat)),
+            ('dashboard, aggregated', timed(lambda: aggregate_dashboard(conn, HEAVY_USER, since),
+                                            max(1, args.repeat // 5))),
+        ]
+        for name, ms in rows:
+            print(f"{name:<28} {ms:9.2f} ms")
+        db.close_connections()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
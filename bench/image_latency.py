@@ -0,0 +1,106 @@
+"""Image upload response latency: synchronous artifacts vs the in-memory path
+
+Posts distinct images (so the result cache never hits) to /upload with
+inline processing and reports p50/p99 response times for:
+  - sync:     upload saved, re-read from disk, annotated image drawn and
+              written before the response (DEFER_ARTIFACTS=0)
+  - deferred: bytes decoded once in memory, response returned as soon as the
+              boxes are known, artifacts written in the background
+
+Uploads are spaced by ``--think-ms`` of idle time; with back-to-back
+uploads on a single core the background writer competes with the next
+request for the CPU. Runs in a temporary working directory so no files land in static/.
+
+Usage (from the repository root):
+    python bench/image_latency.py [--requests 50] [--width 3000] [--height 2000]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.pop("INFERENCE_SERVER", None)
+# Resolved before leaving the repository root
+os.environ["MODEL_PATH"] = os.path.abspath(
+    os.getenv("MODEL_PATH", os.path.join(ROOT, 'model', 'pothole_yolov11_best.pt')))
+os.environ["ASYNC_JOBS"] = "0"
+os.environ["NOTIFY_APP_PASSWORD"] = ""
+WORKDIR = tempfile.mkdtemp(prefix='pothole_bench_')
+os.environ["DATABASE_PATH"] = os.path.join(WORKDIR, 'bench.db')
+os.chdir(WORKDIR)
+
+import app as pothole_app  # noqa: E402
+
+
+def make_images(n, width, height):
+    rng = np.random.default_rng(0)
+    base = np.full((height, width, 3), 100, np.uint8)
+    base = cv2.add(base, rng.integers(0, 50, (height, width, 3), dtype=np.uint8))
+    for i in range(n):
+        img = base.copy()
+        # A differently placed dark blob per image keeps every upload a cache miss
+        cv2.circle(img, (int(rng.integers(100, width - 100)), int(rng.integers(100, height - 100))),
+                   80, (30, 30, 30), -1)
+        img[0, 0] = (i % 256, i // 256 % 256, 0)
+        yield cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def run(client, images, label, think=0.0):
+    samples = []
+    for i, data in enumerate(images):
+        # Idle time between uploads, as with real users; not part of the latency
+        time.sleep(think)
+        start = time.perf_counter()
+        r = client.post('/upload', data={'upload_type': 'image', 'location': 'Bench',
+                                         'file': (io.BytesIO(data), f'{label}_{i}.jpg')},
+                        content_type='multipart/form-data')
+        samples.append(time.perf_counter() - start)
+        if r.status_code != 200:
+            raise RuntimeError(f"Upload failed with HTTP {r.status_code}")
+    samples.sort()
+    return {
+        'p50_ms': 1000 * statistics.median(samples),
+        'p99_ms': 1000 * samples[int(0.99 * (len(samples) - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('--think-ms', type=float, default=200,
+                        help="pause between uploads; 0 measures back-to-back load")
+    args = parser.parse_args()
+
+    app = pothole_app.app
+    if pothole_app.load_model() is None:
+        print("❌ Model could not be loaded")
+        return 1
+    client = app.test_client()
+    client.post('/register', data={'username': 'bench', 'password': 'bench'})
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+    images = list(make_images(2 * args.requests + 2, args.width, args.height))
+    print(f"{args.requests} uploads of {args.width}x{args.height} JPEGs "
+          f"(~{len(images[0]) // 1024} KB each), inline processing, {WORKDIR}")
+    for deferred, chunk in ((False, images[:args.requests + 1]), (True, images[args.requests + 1:])):
+        app.config['DEFER_ARTIFACTS'] = deferred
+        label = 'deferred' if deferred else 'sync'
+        run(client, chunk[:1], label + '_warmup')
+        result = run(client, chunk[1:], label, args.think_ms / 1000)
+        pothole_app.artifact_writer.flush()
+        print(f"{label:<9} p50 {result['p50_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Cold vs warm model latency, in-process vs the shared inference server
+
+Measures:
+  - in-process cold start: YOLO weight loading and the first prediction
+  - in-process warm prediction latency
+  - inference server startup (process spawn, load, warm-up, first connect)
+  - per-request latency through the server
+
+Usage (from the repository root):
+    python bench/model_server.py [--requests 50]
+"""
+import argparse
+import glob
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.pop("INFERENCE_SERVER", None)
+# Shared with the server subprocess, which refuses to start without a key
+os.environ.setdefault("INFERENCE_AUTHKEY", secrets.token_hex(16))
+
+import app as pothole_app  # noqa: E402
+from inference_server import InferenceClient  # noqa: E402
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50_ms': 1000 * statistics.median(samples),
+        'p95_ms': 1000 * samples[int(0.95 * (len(samples) - 1))],
+    }
+
+
+def time_requests(m, images, n):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        m.predict(source=images[i % len(images)], save=False, verbose=False)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    images = [cv2.imread(p) for p in sorted(glob.glob(os.path.join(ROOT, 'static', 'uploads', '*.jpg')))]
+    if not images:
+        print("❌ No images in static/uploads")
+        return 1
+
+    start = time.perf_counter()
+    m = pothole_app.load_model()
+    if m is None:
+        print(f"❌ Model not found at {pothole_app.MODEL_PATH}")
+        return 1
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    m.predict(source=images[0], save=False, verbose=False)
+    first_seconds = time.perf_counter() - start
+    warm = percentiles(time_requests(m, images, args.requests))
+
+    print("In-process")
+    print(f"  model load         {load_seconds * 1000:9.1f} ms")
+    print(f"  first prediction   {first_seconds * 1000:9.1f} ms")
+    print(f"  warm p50 / p95     {warm['p50_ms']:9.1f} / {warm['p95_ms']:.1f} ms")
+
+    address = os.path.join(tempfile.mkdtemp(prefix='pothole_bench_'), 'inference.sock')
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'inference_server.py'), '--address', address],
+                              cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        client = InferenceClient(address, connect_timeout=120)
+        startup_seconds = time.perf_counter() - start
+        info = client.info()
+        start = time.perf_counter()
+        client.predict(source=images[0])
+        first_seconds = time.perf_counter() - start
+        served = percentiles(time_requests(client, images, args.requests))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print("Inference server")
+    print(f"  startup (ready)    {startup_seconds * 1000:9.1f} ms "
+          f"(load {info['load_seconds'] * 1000:.1f} ms, warm-up {info['warmup_seconds'] * 1000:.1f} ms)")
+    print(f"  first request      {first_seconds * 1000:9.1f} ms")
+    print(f"  request p50 / p95  {served['p50_ms']:9.1f} / {served['p95_ms']:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Inference calls saved by motion gating, and what it costs in recall
+
+Runs the video pipeline over a clip without a gate and with a MotionGate at
+several skip thresholds (and once with dense sampling on), and reports
+model calls, the fraction avoided, wall time and box recall against the
+ungated run. For recall, a frame the gate skipped is credited with the boxes
+of the last frame it did analyse, which is what a skipped frame effectively
+reports; a box counts as found at IoU >= 0.5.
+
+The default clip is synthetic with a 10 s stop every 20 s; pass --video to
+use real footage. Without the trained weights a randomly initialised
+stand-in is used; its boxes say nothing about potholes, so recall is then
+reported as n/a and only the call counts and timings mean anything. The
+gate's effect on accuracy has not been measured yet: that takes the
+trained weights (--model) and real dashcam footage (--video).
+
+Usage (from the repository root):
+    python bench/motion_gate.py [--video clip.mp4] [--thresholds 0.005,0.01,0.03]
+"""
+import argparse
+import bisect
+import os
+import shutil
+import sys
+import tempfile
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.synthetic import make_standin_model, make_synthetic_video  # noqa: E402
+from motion import MotionGate  # noqa: E402
+from tracking import iou  # noqa: E402
+from video_pipeline import run_video_pipeline  # noqa: E402
+
+DEFAULT_MODEL = os.path.join(ROOT, 'model', 'pothole_yolov11_best.pt')
+
+
+class RecordingGate(MotionGate):
+    """Remembers which frames were let through"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.analysed_frames = []
+
+    def check(self, frame_number, frame):
+        analyse = super().check(frame_number, frame)
+        if analyse:
+            self.analysed_frames.append(frame_number)
+        return analyse
+
+
+def run(video_path, model, interval, output_folder, gate):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        detected, _, stats = run_video_pipeline(cap, model, interval, output_folder, gate=gate)
+    finally:
+        cap.release()
+    return {f['frame_number']: f['boxes'] for f in detected}, stats.as_dict()
+
+
+def recall(reference, boxes, analysed_frames):
+    """Share of the reference boxes also reported at (or carried over to) their frame"""
+    total = found = 0
+    for frame_number, expected in reference.items():
+        i = bisect.bisect_right(analysed_frames, frame_number) - 1
+        reported = boxes.get(analysed_frames[i], []) if i >= 0 else []
+        for box in expected:
+            total += 1
+            found += any(iou(box[:4], other[:4]) >= 0.5 for other in reported)
+    return found / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--video', help="clip to use instead of the synthetic one")
+    parser.add_argument('--model', default=os.getenv("MODEL_PATH", DEFAULT_MODEL))
+    parser.add_argument('--seconds', type=int, default=60)
+    parser.add_argument('--sample-fps', type=float, default=2)
+    parser.add_argument('--thresholds', default='0.005,0.01,0.03')
+    parser.add_argument('--max-skipped', type=int, default=20)
+    parser.add_argument('--dense-threshold', type=float, default=0.08)
+    args = parser.parse_args()
+
+    standin = not os.path.isfile(args.model)
+    if standin:
+        print(f"⚠️ {args.model} not found, using a randomly initialised stand-in: recall is not measured")
+        model = make_standin_model()
+    else:
+        from ultralytics import YOLO
+        model = YOLO(args.model, task='detect')
+
+    workdir = tempfile.mkdtemp(prefix='pothole_bench_')
+    try:
+        video_path = args.video or make_synthetic_video(os.path.join(workdir, 'stops.mp4'), seconds=args.seconds,
+                                                        fps=30, stop_every=20, stop_seconds=10, speed=8)
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        cap.release()
+        interval = max(1, int(fps / args.sample_fps))
+
+        reference, stats = run(video_path, model, interval, os.path.join(workdir, 'ungated'), None)
+        base_calls = stats['stages']['infer']['items']
+        base_wall = stats['wall_seconds']
+        print(f"{'gate':<20} {'calls':>6} {'avoided':>8} {'seconds':>8} {'recall':>7} {'max gap':>8}")
+        print(f"{'none':<20} {base_calls:>6} {'':>8} {base_wall:>8.2f} {'':>7} {interval:>8}")
+
+        configs = [(f"skip<={t:g}", {'skip_threshold': t}) for t in map(float, args.thresholds.split(','))]
+        configs.append((f"skip<={configs[len(configs) // 2][1]['skip_threshold']:g}+dense",
+                        dict(configs[len(configs) // 2][1], dense_threshold=args.dense_threshold)))
+        for i, (label, options) in enumerate(configs):
+            gate = RecordingGate(max_skipped=args.max_skipped, **options)
+            boxes, stats = run(video_path, model, interval, os.path.join(workdir, f'gated_{i}'), gate)
+            calls = stats['stages']['infer']['items']
+            found = 'n/a' if standin else f"{recall(reference, boxes, gate.analysed_frames):.3f}"
+            print(f"{label:<20} {calls:>6} {100 * (1 - calls / base_calls):>7.1f}% {stats['wall_seconds']:>8.2f} "
+                  f"{found:>7} {stats['gate']['max_gap_frames']:>8}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
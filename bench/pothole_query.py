@@ -0,0 +1,115 @@
+"""Viewport query latency on a synthetic pothole_boxes table
+
+Fills a temporary database with detections clustered around a few cities
+(1M+ boxes by default), then times db.query_potholes for street-, district-
+and city-sized viewports against a plain lat/lon range scan of the same
+table without the grid index.
+
+Usage (from the repository root):
+    python bench/pothole_query.py [--boxes 1000000] [--queries 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+CITIES = [(12.97, 77.59), (19.08, 72.88), (28.61, 77.21), (17.39, 78.49), (13.08, 80.27)]
+# Viewport half-sizes in degrees
+VIEWPORTS = {'street': 0.002, 'district': 0.02, 'city': 0.1}
+
+
+def fill(db_path, n_boxes, boxes_per_detection=4, batch=1000):
+    rng = random.Random(0)
+    rows = []
+    for i in range(n_boxes // boxes_per_detection):
+        city_lat, city_lon = rng.choice(CITIES)
+        lat, lon = rng.gauss(city_lat, 0.08), rng.gauss(city_lon, 0.08)
+        rows.append({
+            'user_id': 1,
+            'detection_type': 'image',
+            'location': f'Synthetic {i}',
+            'file_path': f'static/uploads/synthetic_{i}.jpg',
+            'pothole_count': boxes_per_detection,
+            'boxes': [(0, [rng.uniform(0, 600), rng.uniform(0, 400), rng.uniform(600, 640),
+                           rng.uniform(400, 480), rng.random()]) for _ in range(boxes_per_detection)],
+            'lat': lat,
+            'lon': lon,
+        })
+        if len(rows) >= batch:
+            db.insert_detections(rows, db_path=db_path)
+            rows = []
+    if rows:
+        db.insert_detections(rows, db_path=db_path)
+    conn = db.get_connection(db_path)
+    conn.execute('ANALYZE')
+    return conn.execute('SELECT COUNT(*) FROM pothole_boxes').fetchone()[0]
+
+
+def unindexed_query(conn, min_lon, min_lat, max_lon, max_lat, limit):
+    return conn.execute('''SELECT b.*, d.location, d.detected_at
+                           FROM pothole_boxes b NOT INDEXED JOIN detections d ON d.id = b.detection_id
+                           WHERE b.lat BETWEEN ? AND ? AND b.lon BETWEEN ? AND ? LIMIT ?''',
+                        (min_lat, max_lat, min_lon, max_lon, limit)).fetchall()
+
+
+def time_queries(fn, viewports):
+    samples, found = [], 0
+    for vp in viewports:
+        start = time.perf_counter()
+        found += len(fn(*vp))
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'p50_ms': 1000 * statistics.median(samples),
+        'p95_ms': 1000 * samples[int(0.95 * (len(samples) - 1))],
+        'avg_results': found / len(viewports),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--boxes', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--baseline-queries', type=int, default=10,
+                        help="full scans are slow; time only this many")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, 'potholes.db')
+        db.init_schema(db_path)
+        start = time.perf_counter()
+        total = fill(db_path, args.boxes)
+        elapsed = time.perf_counter() - start
+        print(f"Inserted {total:,} boxes in {elapsed:.1f}s ({total / elapsed:,.0f} boxes/s)")
+
+        conn = db.get_connection(db_path)
+        for name, half in VIEWPORTS.items():
+            viewports = []
+            for _ in range(args.queries):
+                lat, lon = rng.choice(CITIES)
+                lat, lon = rng.gauss(lat, 0.05), rng.gauss(lon, 0.05)
+                viewports.append((lon - half, lat - half, lon + half, lat + half))
+
+            grid = time_queries(lambda *vp: db.query_potholes(*vp, limit=args.limit, db_path=db_path),
+                                viewports)
+            scan = time_queries(lambda *vp: unindexed_query(conn, *vp, args.limit),
+                                viewports[:args.baseline_queries])
+            print(f"{name:<9} grid  p50 {grid['p50_ms']:7.2f} ms  p95 {grid['p95_ms']:7.2f} ms  "
+                  f"~{grid['avg_results']:.0f} results")
+            print(f"{'':<9} scan  p50 {scan['p50_ms']:7.2f} ms  p95 {scan['p95_ms']:7.2f} ms")
+        db.close_connections()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
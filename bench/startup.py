@@ -0,0 +1,90 @@
+"""Startup cost of the web app, checked against an import-time budget
+
+Imports ``app`` in fresh interpreters and times the import and the first
+GET /login (which includes ``init_app_runtime()``: tables, metrics
+exporter), and lists which heavy modules got loaded along the way. None of ultralytics,
+torch, cv2 or the SMTP stack should be needed to show the login page.
+
+Exits non-zero when the median import time exceeds --budget-ms or a heavy
+module was imported, so it can run as a startup regression check in CI.
+
+Usage (from the repository root):
+    python bench/startup.py [--runs 5] [--budget-ms 1000]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('ultralytics', 'torch', 'cv2', 'numpy', 'onnxruntime', 'openvino', 'smtplib', 'email.mime')
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+heavy_after_import = [m for m in {heavy!r} if m in sys.modules]
+response = app.app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({{
+    'import_ms': 1000 * (imported - start),
+    'first_request_ms': 1000 * (served - imported),
+    'status': response.status_code,
+    'heavy_after_import': heavy_after_import,
+    'heavy_after_login': [m for m in {heavy!r} if m in sys.modules],
+}}))
+'''
+
+
+def run_once(workdir):
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+               DATABASE_PATH=os.path.join(workdir, 'startup.db'),
+               ASYNC_JOBS='0')
+    out = subprocess.run([sys.executable, '-c', CHILD.format(heavy=HEAVY_MODULES)], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=1000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pothole_bench_')
+    try:
+        runs = [run_once(workdir) for _ in range(max(1, args.runs))]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    import_ms = statistics.median(r['import_ms'] for r in runs)
+    request_ms = statistics.median(r['first_request_ms'] for r in runs)
+    heavy = sorted({m for r in runs for m in r['heavy_after_login']})
+    print(f"import app          median {import_ms:8.1f} ms  max {max(r['import_ms'] for r in runs):8.1f} ms")
+    print(f"first GET /login    median {request_ms:8.1f} ms  (status {runs[-1]['status']})")
+    print(f"heavy modules       {', '.join(heavy) or 'none'}")
+
+    failed = False
+    if import_ms > args.budget_ms:
+        print(f"❌ Import took {import_ms:.0f} ms, budget is {args.budget_ms:.0f} ms")
+        failed = True
+    if heavy:
+        print(f"❌ Heavy modules imported before the login page: {', '.join(heavy)}")
+        failed = True
+    if runs[-1]['status'] != 200:
+        print(f"❌ GET /login returned {runs[-1]['status']}")
+        failed = True
+    if not failed:
+        print(f"✅ Within the {args.budget_ms:.0f} ms budget")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
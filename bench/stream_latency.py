@@ -0,0 +1,75 @@
+"""Live stream latency and drop rate at a given camera frame rate
+
+Feeds JPEG-encoded frames of a synthetic clip into a StreamSession at
+``--fps`` and reports how many frames were processed or dropped and the
+queue / inference / end-to-end latency percentiles.
+
+Usage (from the repository root):
+    python bench/stream_latency.py [--fps 30] [--seconds 10]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.pop("INFERENCE_SERVER", None)
+
+import app as pothole_app  # noqa: E402
+import streaming  # noqa: E402
+from bench.synthetic import make_synthetic_video  # noqa: E402
+
+
+def load_jpegs(path, limit=300):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    cap.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    m = pothole_app.load_model()
+    if m is None:
+        print("❌ Model could not be loaded")
+        return 1
+
+    with tempfile.TemporaryDirectory() as folder:
+        frames = load_jpegs(make_synthetic_video(os.path.join(folder, 'road.mp4'), seconds=10))
+
+    stream = streaming.create_session(user_id=0, model=m, conf=pothole_app.app.config['DETECTION_CONF'])
+    events = stream.subscribe(maxsize=100000)
+    interval = 1.0 / args.fps
+    start = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - start < args.seconds:
+        stream.submit(frames[sent % len(frames)])
+        sent += 1
+        time.sleep(max(0.0, start + sent * interval - time.perf_counter()))
+    # Let the last frame finish before reading the counters
+    time.sleep(1.0)
+    stream.close()
+
+    stats = stream.stats()
+    stats['sent_fps'] = round(sent / args.seconds, 1)
+    stats['events'] = events.qsize()
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
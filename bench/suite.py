@@ -0,0 +1,359 @@
+"""Benchmark suite for the whole detection pipeline, with JSON output
+
+Runs offline on a CPU-only box and measures:
+  - images: process_image_detection over the bundled static/uploads images,
+            once with distinct bytes (full detection) and once repeated
+            (result cache hits): images/sec and per-image latency
+  - video:  process_video over a generated clip: decoded and analysed
+            frames/sec and the pipeline's per-stage stats
+  - http:   image uploads through the Flask test client: requests/sec and
+            latency percentiles
+and, for each section, the per-stage latencies recorded in metrics.py
+(decode, infer, plot, imwrite, sqlite, ...) and the process's peak RSS.
+
+Without the trained weights a randomly initialised YOLO of the same
+architecture stands in ("model": "stand-in" in the output): the boxes are
+noise, but the compute is the same, so runs on one box stay comparable.
+
+Everything is written to a temporary working directory. Save the JSON with
+--output and pass it to --compare on a later commit to see what changed.
+
+Usage (from the repository root):
+    python bench/suite.py [--output run.json] [--compare previous.json]
+"""
+import argparse
+import importlib
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.synthetic import make_standin_model, make_synthetic_video  # noqa: E402
+
+DEFAULT_MODEL = os.path.join(ROOT, 'model', 'pothole_yolov11_best.pt')
+# Headline numbers shown by --compare; higher is better unless marked
+COMPARE_KEYS = (
+    ('images.detect.images_per_sec', True),
+    ('images.detect.p50_ms', False),
+    ('images.cached.images_per_sec', True),
+    ('video.frames_per_sec', True),
+    ('video.analysed_frames_per_sec', True),
+    ('http.requests_per_sec', True),
+    ('http.p99_ms', False),
+    ('peak_rss_mb', False),
+)
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50_ms': round(1000 * statistics.median(samples), 2),
+        'p90_ms': round(1000 * samples[int(0.90 * (len(samples) - 1))], 2),
+        'p99_ms': round(1000 * samples[int(0.99 * (len(samples) - 1))], 2),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def load_images(folder, count):
+    """JPEG bytes of the bundled uploads, or generated road images if there are none"""
+    images = []
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    images.append((name, f.read()))
+    if images:
+        return images[:count] if count else images
+
+    rng = np.random.default_rng(0)
+    for i in range(count or 20):
+        img = cv2.add(np.full((720, 1280, 3), 100, np.uint8), rng.integers(0, 50, (720, 1280, 3), dtype=np.uint8))
+        cv2.circle(img, (int(rng.integers(100, 1180)), int(rng.integers(100, 620))), 60, (30, 30, 30), -1)
+        images.append((f'synthetic_{i}.jpg', cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()))
+    return images
+
+
+def distinct(data, tag):
+    """Same JPEG pixels under a different content hash, so the result cache misses"""
+    comment = tag.encode()
+    return data[:2] + b'\xff\xfe' + (len(comment) + 2).to_bytes(2, 'big') + comment + data[2:]
+
+
+class StageDelta:
+    """Per-stage metrics recorded between construction and ``result()``"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.before = metrics.STAGE_SECONDS.snapshot()
+
+    def result(self):
+        stages = {}
+        for key, entry in sorted(self.metrics.STAGE_SECONDS.snapshot().items()):
+            old = self.before.get(key, {'count': 0, 'sum': 0.0})
+            count = entry['count'] - old['count']
+            if not count:
+                continue
+            stage, source = json.loads(key)
+            total = entry['sum'] - old['sum']
+            stages[f"{stage}/{source}" if source else stage] = {
+                'count': count,
+                'total_seconds': round(total, 4),
+                'mean_ms': round(1000 * total / count, 3),
+            }
+        return stages
+
+
+def bench_images(pa, metrics, images, passes, user_id):
+    from flask import session
+    app = pa.app
+
+    def run(payloads):
+        latencies = []
+        started = time.perf_counter()
+        for name, data in payloads:
+            with app.test_request_context():
+                session['user_id'] = user_id
+                start = time.perf_counter()
+                out = pa.process_image_detection(os.path.join(app.config['UPLOAD_FOLDER'], name),
+                                                 'Bench', 'image', image_bytes=data)
+                latencies.append(time.perf_counter() - start)
+            if not isinstance(out, str):
+                raise RuntimeError(f"Detection of {name} failed (see log)")
+        # Deferred artifacts are part of the work
+        pa.artifact_writer.flush()
+        wall = time.perf_counter() - started
+        return dict({'images': len(payloads), 'seconds': round(wall, 3),
+                     'images_per_sec': round(len(payloads) / wall, 2)}, **percentiles(latencies))
+
+    # Warm-up: first inference pays for lazy initialisation
+    run([('warmup.jpg', distinct(images[0][1], 'warmup'))])
+
+    delta = StageDelta(metrics)
+    detect = run([(name, distinct(data, f'{p}:{name}')) for p in range(passes) for name, data in images])
+    detect['stages'] = delta.result()
+
+    # The same bytes again: every lookup is a cache hit
+    delta = StageDelta(metrics)
+    cached = run([(name, distinct(data, f'0:{name}')) for name, data in images])
+    cached['stages'] = delta.result()
+    return {'detect': detect, 'cached': cached, 'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_video(pa, metrics, workdir, seconds, fps, size, user_id):
+    video_path = make_synthetic_video(os.path.join(workdir, 'synthetic.mp4'), seconds=seconds, fps=fps, size=size)
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    delta = StageDelta(metrics)
+    started = time.perf_counter()
+    detected_frames, _ = pa.process_video(video_path, 'Bench', user_id)
+    wall = time.perf_counter() - started
+    if detected_frames is None:
+        raise RuntimeError("Video processing failed (see log)")
+    pipeline = pa.last_video_stats
+    analysed = pipeline.get('stages', {}).get('infer', {}).get('items', 0)
+    return {
+        'frames': total_frames,
+        'resolution': f"{size[0]}x{size[1]}",
+        'analysed_frames': analysed,
+        'detected_entries': len(detected_frames),
+        'seconds': round(wall, 3),
+        'frames_per_sec': round(total_frames / wall, 2),
+        'analysed_frames_per_sec': round(analysed / wall, 2),
+        'pipeline': pipeline,
+        'stages': delta.result(),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_http(pa, metrics, images, requests, client):
+    delta = StageDelta(metrics)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(requests):
+        name, data = images[i % len(images)]
+        start = time.perf_counter()
+        r = client.post('/upload', data={'upload_type': 'image', 'location': 'Bench',
+                                         'file': (io.BytesIO(distinct(data, f'http:{i}')), name)},
+                        content_type='multipart/form-data')
+        latencies.append(time.perf_counter() - start)
+        if r.status_code != 200:
+            raise RuntimeError(f"Upload failed with HTTP {r.status_code}")
+    pa.artifact_writer.flush()
+    wall = time.perf_counter() - started
+    return dict({'requests': requests, 'seconds': round(wall, 3),
+                 'requests_per_sec': round(requests / wall, 2)}, **percentiles(latencies),
+                stages=delta.result(), peak_rss_mb=peak_rss_mb())
+
+
+def environment():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+    }
+    try:
+        import torch
+        info['torch'] = torch.__version__
+        info['torch_threads'] = torch.get_num_threads()
+    except ImportError:
+        pass
+    try:
+        commit = subprocess.run(['git', '-C', ROOT, 'rev-parse', 'HEAD'], capture_output=True, text=True)
+        dirty = subprocess.run(['git', '-C', ROOT, 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True)
+        if commit.returncode == 0:
+            info['git_commit'] = commit.stdout.strip()
+            info['git_dirty'] = bool(dirty.stdout.strip())
+    except OSError:
+        pass
+    return info
+
+
+def lookup(result, dotted):
+    for part in dotted.split('.'):
+        if not isinstance(result, dict) or part not in result:
+            return None
+        result = result[part]
+    return result
+
+
+def compare(previous, current):
+    log(f"\n{'metric':<34} {'before':>10} {'after':>10} {'change':>8}")
+    for key, higher_is_better in COMPARE_KEYS:
+        old, new = lookup(previous, key), lookup(current, key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        mark = '' if abs(change) < 5 else (' ✅' if better else ' ⚠️')
+        log(f"{key:<34} {old:>10} {new:>10} {change:>+7.1f}%{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    parser.add_argument('--compare', help="JSON of an earlier run to compare against")
+    parser.add_argument('--model', default=os.getenv("MODEL_PATH", DEFAULT_MODEL))
+    parser.add_argument('--standin', default='yolo11n.yaml',
+                        help="architecture for the stand-in model when --model does not exist")
+    parser.add_argument('--images', type=int, default=0, help="bundled images to use (0 = all)")
+    parser.add_argument('--image-passes', type=int, default=2)
+    parser.add_argument('--video-seconds', type=int, default=20)
+    parser.add_argument('--video-size', default='1280x720')
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--skip', default='', help="comma-separated sections to skip: images,video,http")
+    args = parser.parse_args()
+
+    skip = set(filter(None, args.skip.split(',')))
+    output = os.path.abspath(args.output) if args.output else None
+    images = load_images(os.path.join(ROOT, 'static', 'uploads'), args.images)
+    model_path = os.path.abspath(args.model)
+
+    # app reads its configuration at import, so set it up first
+    workdir = tempfile.mkdtemp(prefix='pothole_bench_')
+    for name in ('INFERENCE_SERVER', 'PROFILE_SLOW_REQUESTS_MS'):
+        os.environ.pop(name, None)
+    os.environ.update({
+        'MODEL_PATH': model_path,
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'ASYNC_JOBS': '0',
+        'NOTIFY_APP_PASSWORD': '',
+        # Segment processes would need the real weights
+        'VIDEO_SEGMENT_WORKERS': '1',
+        'DATABASE_PATH': os.path.join(workdir, 'bench.db'),
+    })
+    os.chdir(workdir)
+    try:
+        pa = importlib.import_module('app')
+        metrics = importlib.import_module('metrics')
+        pa.app.logger.setLevel(logging.WARNING)
+        # No alert emails for benchmark detections
+        pa.notify_authorities = lambda detection_data, detection_id=None: False
+        pa.init_app_runtime()
+        client = pa.app.test_client()
+        client.post('/register', data={'username': 'bench', 'password': 'bench'})
+        client.post('/login', data={'username': 'bench', 'password': 'bench'})
+        user_id = pa.find_user('bench', 'bench')['id']
+
+        if os.path.isfile(model_path):
+            model_name = os.path.relpath(model_path, ROOT)
+            load_started = time.perf_counter()
+            if pa.load_model() is None:
+                log(f"❌ Model at {model_path} could not be loaded")
+                return 1
+        else:
+            log(f"⚠️ {model_path} not found, using a randomly initialised {args.standin} stand-in")
+            model_name = 'stand-in'
+            load_started = time.perf_counter()
+            pa.model = make_standin_model(args.standin)
+
+        result = {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'model': model_name,
+            'model_load_seconds': round(time.perf_counter() - load_started, 3),
+            'environment': environment(),
+            'config': {key: pa.app.config[key] for key in (
+                'INFERENCE_BACKEND', 'DETECTION_CONF', 'DEFER_ARTIFACTS', 'VIDEO_BATCH_SIZE',
+                'VIDEO_SAMPLE_FPS', 'VIDEO_TRACKING', 'VIDEO_WRITER_THREADS')},
+        }
+        if 'images' not in skip:
+            log(f"🖼️ images: {len(images)} x {args.image_passes} passes")
+            result['images'] = bench_images(pa, metrics, images, args.image_passes, user_id)
+        if 'video' not in skip:
+            width, height = (int(v) for v in args.video_size.split('x'))
+            log(f"🎞️ video: {args.video_seconds}s at {args.video_size}")
+            result['video'] = bench_video(pa, metrics, workdir, args.video_seconds, 30, (width, height), user_id)
+        if 'http' not in skip:
+            log(f"🌐 http: {args.requests} uploads")
+            result['http'] = bench_http(pa, metrics, images, args.requests, client)
+        result['peak_rss_mb'] = peak_rss_mb()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for key, _ in COMPARE_KEYS:
+        value = lookup(result, key)
+        if value is not None:
+            log(f"{key:<34} {value:>10}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+    text = json.dumps(result, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+        log(f"💾 Results written to {output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""Synthetic road footage for offline benchmarks"""
+import os
+
+import cv2
+import numpy as np
+
+
+def make_synthetic_video(path, seconds=10, fps=30, size=(640, 480), seed=0, stop_every=0, stop_seconds=0,
+                         speed=None):
+    """Write a synthetic clip of a scrolling road with dark blobs as 'potholes'
+
+    ``speed`` is the scroll in pixels per frame (default: one pass over the
+    road texture per clip). With ``stop_every``, the road stands still for ``stop_seconds`` at the
+    end of every ``stop_every`` seconds, like a vehicle waiting at lights.
+    Returns the path of the written video.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    # One tall road texture that we scroll through to fake vehicle motion
+    road_height = height * 4
+    road = np.full((road_height, width, 3), 90, dtype=np.uint8)
+    noise = rng.integers(0, 40, size=(road_height, width, 1), dtype=np.uint8)
+    road = cv2.add(road, np.repeat(noise, 3, axis=2))
+    for _ in range(12):
+        center = (int(rng.integers(40, width - 40)), int(rng.integers(40, road_height - 40)))
+        axes = (int(rng.integers(15, 45)), int(rng.integers(10, 30)))
+        cv2.ellipse(road, center, axes, 0, 0, 360, (25, 25, 30), -1)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    total_frames = int(seconds * fps)
+    step = speed or max(1, (road_height - height) // max(1, total_frames))
+    moved = 0
+    for i in range(total_frames):
+        offset = (moved * step) % (road_height - height)
+        frame = road[offset:offset + height]
+        if stop_every:
+            # A little sensor noise, so still frames are not bit-identical
+            frame = cv2.add(frame, rng.integers(0, 3, size=frame.shape, dtype=np.uint8))
+        writer.write(frame)
+        if not (stop_every and (i / fps) % stop_every >= stop_every - stop_seconds):
+            moved += 1
+    writer.release()
+    return path
+
+
+def make_standin_model(cfg='yolo11n.yaml'):
+    """A randomly initialised YOLO built from its architecture file
+
+    Needs neither the trained weights nor network access. Its boxes are
+    meaningless, but it runs the same layers at the same cost as a trained
+    model of that size, which is what throughput numbers need.
+    """
+    from ultralytics import YOLO
+    return YOLO(cfg, task='detect')
@@ -0,0 +1,113 @@
+"""Latency and detection count: fixed imgsz vs adaptive size and tiling
+
+Runs the bundled static/uploads images (optionally upscaled with --upscale
+to stand in for 4K dashcam frames) through:
+  - standard:        one pass at the model's default imgsz
+  - adaptive:        imgsz per image, full-resolution tiles for large ones
+  - adaptive+budget: as above, with tiles coarsened to fit --budget-ms
+and reports per-image latency percentiles, boxes found and forward passes.
+
+Without the trained weights a randomly initialised stand-in is used; its
+box counts are noise, only the latencies mean anything then.
+
+Usage (from the repository root):
+    python bench/tiling.py [--upscale 1,4] [--budget-ms 400] [--tile 640]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.synthetic import make_standin_model  # noqa: E402
+from tiling import AdaptivePredictor  # noqa: E402
+
+DEFAULT_MODEL = os.path.join(ROOT, 'model', 'pothole_yolov11_best.pt')
+
+
+def load_images(folder, upscale):
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            img = cv2.imread(os.path.join(folder, name))
+            if img is not None and upscale != 1:
+                img = cv2.resize(img, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+            if img is not None:
+                images.append(img)
+    return images
+
+
+def run(predictor, images, conf):
+    # Warm-up, so lazy initialisation is not billed to the first image
+    predictor.predict(source=images[0], conf=conf, save=False, verbose=False)
+    latencies, boxes = [], 0
+    for img in images:
+        start = time.perf_counter()
+        result = predictor.predict(source=img, conf=conf, save=False, verbose=False)[0]
+        latencies.append(time.perf_counter() - start)
+        boxes += len(result.boxes)
+    latencies.sort()
+    return {
+        'p50_ms': 1000 * statistics.median(latencies),
+        'p99_ms': 1000 * latencies[int(0.99 * (len(latencies) - 1))],
+        'boxes': boxes,
+    }
+
+
+class _Standard:
+    """The model called the way the app calls it without adaptive mode"""
+
+    def __init__(self, model):
+        self.model = model
+        self.passes = 0
+
+    def predict(self, source=None, **kwargs):
+        self.passes += 1
+        return self.model.predict(source=source, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=os.getenv("MODEL_PATH", DEFAULT_MODEL))
+    parser.add_argument('--upscale', default='1,4', help="comma-separated image scale factors")
+    parser.add_argument('--tile', type=int, default=640)
+    parser.add_argument('--overlap', type=float, default=0.2)
+    parser.add_argument('--budget-ms', type=float, default=400)
+    parser.add_argument('--conf', type=float, default=0.25)
+    args = parser.parse_args()
+
+    if os.path.isfile(args.model):
+        from ultralytics import YOLO
+        model = YOLO(args.model, task='detect')
+    else:
+        print(f"⚠️ {args.model} not found, using a randomly initialised stand-in")
+        model = make_standin_model()
+
+    folder = os.path.join(ROOT, 'static', 'uploads')
+    print(f"{'scale':>5} {'mode':<16} {'p50 ms':>9} {'p99 ms':>9} {'boxes':>6} {'passes':>7}")
+    for upscale in (float(s) for s in args.upscale.split(',')):
+        images = load_images(folder, upscale)
+        if not images:
+            print(f"❌ No images in {folder}")
+            return 1
+        modes = (
+            ('standard', _Standard(model)),
+            ('adaptive', AdaptivePredictor(model, args.tile, args.overlap)),
+            (f'adaptive+{args.budget_ms:g}ms',
+             AdaptivePredictor(model, args.tile, args.overlap, latency_budget=args.budget_ms / 1000)),
+        )
+        for label, predictor in modes:
+            result = run(predictor, images, args.conf)
+            passes = predictor.passes if isinstance(predictor, _Standard) else predictor.stats()['passes']
+            print(f"{upscale:>5g} {label:<16} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                  f"{result['boxes']:>6} {passes:>7}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
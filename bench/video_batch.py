@@ -0,0 +1,52 @@
+"""Benchmark batched frame inference in process_video
+
+Usage (from the repository root):
+    python bench/video_batch.py [--seconds 20] [--sizes 1,2,4,8,16,32]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as pothole_app  # noqa: E402
+from bench.synthetic import make_synthetic_video  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--sizes', default='1,2,4,8,16,32')
+    args = parser.parse_args()
+
+    if pothole_app.load_model() is None:
+        print(f"❌ Model not found at {pothole_app.MODEL_PATH}")
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix='pothole_bench_')
+    video_path = make_synthetic_video(os.path.join(workdir, 'synthetic.mp4'),
+                                      seconds=args.seconds, fps=args.fps)
+    pothole_app.app.config['DETECTED_FRAMES_FOLDER'] = os.path.join(workdir, 'frames')
+    sampled = args.seconds * 2
+
+    # Warm up once so the first batch size does not pay for graph setup
+    pothole_app.process_video(video_path, 'bench', 0, batch_size=1)
+
+    print(f"{'batch':>6} {'seconds':>9} {'frames/sec':>11}")
+    try:
+        for batch_size in [int(s) for s in args.sizes.split(',')]:
+            start = time.perf_counter()
+            pothole_app.process_video(video_path, 'bench', 0, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            print(f"{batch_size:>6} {elapsed:>9.2f} {sampled / elapsed:>11.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Peak memory of a video run, and where its allocations come from
+
+Runs the video pipeline over a 1080p clip in a fresh process per
+configuration (so every peak RSS is that run's own), tracked and untracked,
+with the default frame pool and with a deep one that decodes far ahead like
+an unbounded queue would. Reports peak RSS over the process baseline
+(interpreter, libraries and model already loaded), frame arrays reused vs
+allocated, and wall time; with --trace, also the tracemalloc peak of each
+pipeline stage (which slows the run down).
+
+The default clip is synthetic; pass --video to use real footage. Without the
+trained weights a randomly initialised stand-in is used.
+
+Usage (from the repository root):
+    python bench/video_memory.py [--video clip.mp4] [--trace] [--deep-buffers 64]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.synthetic import make_standin_model, make_synthetic_video  # noqa: E402
+from memory import MB, current_rss  # noqa: E402
+from tracking import PotholeTracker  # noqa: E402
+from video_pipeline import run_video_pipeline  # noqa: E402
+
+DEFAULT_MODEL = os.path.join(ROOT, 'model', 'pothole_yolov11_best.pt')
+
+
+def load_model(path):
+    if os.path.isfile(path):
+        from ultralytics import YOLO
+        return YOLO(path, task='detect')
+    return make_standin_model()
+
+
+def child(args):
+    """One configuration, in this process; prints its numbers as JSON"""
+    model = load_model(args.model)
+    cap = cv2.VideoCapture(args.video)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    interval = max(1, int(fps / args.sample_fps))
+    # Load the model's lazy parts before the baseline is taken
+    _, frame = cap.read()
+    model.predict(source=[frame], verbose=False)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    del frame
+    os.makedirs(args.output, exist_ok=True)
+    baseline = current_rss()
+    try:
+        _, _, stats = run_video_pipeline(cap, model, interval, args.output, batch_size=args.batch_size,
+                                         tracker=PotholeTracker() if args.tracking else None,
+                                         frame_buffers=args.frame_buffers, trace_memory=args.trace)
+    finally:
+        cap.release()
+    stats = stats.as_dict()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    print(json.dumps({'baseline_mb': baseline / MB, 'peak_over_baseline_mb': (peak - baseline) / MB,
+                      'wall_seconds': stats['wall_seconds'], 'memory': stats['memory']}))
+
+
+def run_config(args, video_path, output, tracking, frame_buffers):
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--video', video_path, '--model', args.model,
+               '--output', output, '--sample-fps', str(args.sample_fps), '--batch-size', str(args.batch_size),
+               '--frame-buffers', str(frame_buffers)]
+    command += ['--tracking'] if tracking else []
+    command += ['--trace'] if args.trace else []
+    out = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--video', help="clip to use instead of the synthetic one")
+    parser.add_argument('--model', default=os.getenv("MODEL_PATH", DEFAULT_MODEL))
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--sample-fps', type=float, default=10)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--deep-buffers', type=int, default=64)
+    parser.add_argument('--trace', action='store_true', help="per-stage tracemalloc peaks (slow)")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--tracking', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--frame-buffers', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return 0
+    if not os.path.isfile(args.model):
+        print(f"⚠️ {args.model} not found, using a randomly initialised stand-in")
+
+    workdir = tempfile.mkdtemp(prefix='pothole_bench_')
+    try:
+        video_path = args.video or make_synthetic_video(os.path.join(workdir, 'road.mp4'), seconds=args.seconds,
+                                                        fps=30, size=(1920, 1080))
+        print(f"{'run':<22} {'buffers':>8} {'peak MB':>8} {'reused':>7} {'alloc':>6} {'seconds':>8}")
+        configs = [(tracking, buffers) for tracking in (False, True) for buffers in (0, args.deep_buffers)]
+        for i, (tracking, buffers) in enumerate(configs):
+            result = run_config(args, video_path, os.path.join(workdir, f'out_{i}'), tracking, buffers)
+            memory = result['memory']
+            label = f"{'tracked' if tracking else 'untracked'}, {'deep pool' if buffers else 'default pool'}"
+            print(f"{label:<22} {memory['initial_frame_buffers']:>8} {result['peak_over_baseline_mb']:>8.1f} "
+                  f"{memory['reused']:>7} {memory['allocated']:>6} {result['wall_seconds']:>8.2f}")
+            if args.trace:
+                stages = ', '.join(f"{stage} {mb:.1f}" for stage, mb in
+                                   memory['allocations']['stage_peak_mb'].items())
+                print(f"    tracemalloc peak {memory['allocations']['traced_peak_mb']:.1f} MB; by stage (MB): {stages}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
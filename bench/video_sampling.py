@@ -0,0 +1,74 @@
+"""Benchmark frame sampling: read-every-frame loop vs grab/seek sampling
+
+Only decoding is measured (no model needed).
+
+Usage (from the repository root):
+    python bench/video_sampling.py [--seconds 60] [--rates 2,1,0.2]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.synthetic import make_synthetic_video  # noqa: E402
+from video_pipeline import sample_frames  # noqa: E402
+
+
+def read_every_frame(cap, frame_interval):
+    """The original process_video loop: cap.read() on every frame"""
+    frame_count = 0
+    sampled = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame_count % frame_interval == 0:
+            sampled += 1
+        frame_count += 1
+    return sampled
+
+
+def timed(video_path, fn):
+    cap = cv2.VideoCapture(video_path)
+    start = time.perf_counter()
+    sampled = fn(cap)
+    elapsed = time.perf_counter() - start
+    cap.release()
+    return elapsed, sampled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=60)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--rates', default='2,1,0.2')
+    parser.add_argument('--seek-threshold', type=int, default=60)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pothole_bench_')
+    try:
+        video_path = make_synthetic_video(os.path.join(workdir, 'synthetic.mp4'),
+                                          seconds=args.seconds, fps=args.fps, size=(1280, 720))
+        print(f"{'rate':>6} {'mode':>12} {'seconds':>9} {'sampled':>8} {'saved':>7}")
+        for rate in [float(r) for r in args.rates.split(',')]:
+            interval = max(1, int(args.fps / rate))
+            base, n = timed(video_path, lambda cap: read_every_frame(cap, interval))
+            print(f"{rate:>6} {'read-all':>12} {base:>9.3f} {n:>8} {'':>7}")
+            for name, threshold in (('grab', 0), ('grab+seek', args.seek_threshold)):
+                elapsed, n = timed(video_path,
+                                   lambda cap: sum(1 for _ in sample_frames(cap, interval, threshold)))
+                saved = 100 * (1 - elapsed / base) if base else 0.0
+                print(f"{rate:>6} {name:>12} {elapsed:>9.3f} {n:>8} {saved:>6.1f}%")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Scaling of segment-parallel video processing with the number of processes
+
+Runs the full video pipeline (decode, batched inference, writes) over one
+synthetic clip with 1, 2, 4, ... segment processes and reports wall time,
+speedup and parallel efficiency against a single segment. Also checks that
+every run analysed and saved exactly the same frames.
+
+Model start-up in each process is part of the wall time, as in production;
+use a clip long enough for it to amortise.
+
+Usage (from the repository root):
+    python bench/video_segments.py [--seconds 300] [--workers 1,2,4,8,16,32]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.synthetic import make_synthetic_video  # noqa: E402
+from video_segments import run_segmented_video  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=300)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--sample-fps', type=float, default=2)
+    parser.add_argument('--workers', default=None,
+                        help="comma-separated process counts (default: powers of two up to the core count)")
+    parser.add_argument('--tracking', action='store_true')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    if args.workers:
+        counts = [int(w) for w in args.workers.split(',')]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= cores:
+            counts.append(counts[-1] * 2)
+
+    workdir = tempfile.mkdtemp(prefix='pothole_bench_')
+    try:
+        video_path = make_synthetic_video(os.path.join(workdir, 'synthetic.mp4'),
+                                          seconds=args.seconds, fps=args.fps, size=(1280, 720))
+        cap = cv2.VideoCapture(video_path)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        interval = max(1, int(args.fps / args.sample_fps))
+        tracker_options = {} if args.tracking else None
+
+        print(f"{total_frames} frames, every {interval}th analysed, {cores} cores")
+        print(f"{'procs':>6} {'seconds':>9} {'speedup':>8} {'efficiency':>11} {'saved':>6}")
+        base, reference = None, None
+        for n in counts:
+            out = os.path.join(workdir, f'out_{n}')
+            os.makedirs(out)
+            detected, _, stats = run_segmented_video(video_path, 'app:load_model', interval, out, total_frames,
+                                                     workers=n, tracker_options=tracker_options)
+            elapsed = stats['wall_seconds']
+            base = base or elapsed
+            frames = [f['frame_number'] for f in detected]
+            reference = reference if reference is not None else frames
+            check = '' if args.tracking or frames == reference else '  ❌ frames differ from 1 process'
+            print(f"{n:>6} {elapsed:>9.2f} {base / elapsed:>7.2f}x {100 * base / elapsed / n:>10.0f}% "
+                  f"{len(detected):>6}{check}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
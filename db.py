@@ -0,0 +1,616 @@
+"""SQLite data access for the pothole detection app
+
+Connections come from a small per-file pool instead of being opened (and
+their PRAGMAs rerun) per request. A thread keeps the connection it took until
+it calls ``release_connections()``; the Flask app does that when each
+request's app context ends, since the dev server runs every request on a
+fresh thread. Long-lived threads (job workers, writers) simply keep theirs.
+Connections run in WAL mode with a busy timeout, so readers never block the
+writer and concurrent uploads queue for the write lock instead of failing
+with "database is locked".
+
+Connections are in autocommit mode; group writes with ``transaction()``.
+
+The dashboard reads per-user rollups (``user_daily_stats``,
+``user_location_stats``) that triggers on ``detections`` keep current in
+the inserting transaction, so its queries touch a user's days and places
+rather than every detection they ever made.
+"""
+import math
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+DB_PATH = os.getenv("DATABASE_PATH", 'database.db')
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    # Safe with WAL: a power cut can lose the last commits but never corrupts
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 30000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',  # 16 MB page cache per connection
+    'PRAGMA mmap_size = 134217728',
+)
+
+# Idle connections kept per database file; more are opened under load and
+# closed again when returned to a full pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+
+# Spatial grid for pothole_boxes: the world is cut into GRID_CELL_DEG squares
+# (~1 km at 0.01) numbered row-major from (-90, -180)
+GRID_CELL_DEG = float(os.getenv("GRID_CELL_DEG", 0.01))
+# Viewports spanning more grid rows than this are answered with one band scan
+GRID_MAX_ROW_QUERIES = 64
+
+_local = threading.local()
+_idle = {}  # db_path -> LifoQueue of idle connections
+_idle_lock = threading.Lock()
+_idle_pid = os.getpid()
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _idle_connections(db_path):
+    global _idle, _idle_pid
+    with _idle_lock:
+        # A forked child must not reuse the parent's connections
+        if _idle_pid != os.getpid():
+            _idle, _idle_pid = {}, os.getpid()
+        return _idle.setdefault(db_path, queue.LifoQueue(DB_POOL_SIZE))
+
+
+def _held():
+    held = getattr(_local, 'held', None)
+    if held is None or _local.pid != os.getpid():
+        held = _local.held = {}
+        _local.pid = os.getpid()
+    return held
+
+
+def get_connection(db_path=DB_PATH):
+    """This thread's connection to ``db_path``, taken from the pool on first use"""
+    held = _held()
+    conn = held.get(db_path)
+    if conn is None:
+        try:
+            conn = _idle_connections(db_path).get_nowait()
+        except queue.Empty:
+            conn = _connect(db_path)
+        held[db_path] = conn
+    return conn
+
+
+def release_connections():
+    """Return this thread's connections to the pool, closing any it has no room for"""
+    held = _held()
+    for db_path, conn in held.items():
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        try:
+            _idle_connections(db_path).put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    held.clear()
+
+
+def close_connections():
+    """Close this thread's connections and every idle one in the pool"""
+    held = _held()
+    for conn in held.values():
+        conn.close()
+    held.clear()
+    with _idle_lock:
+        pools = list(_idle.values()) if _idle_pid == os.getpid() else []
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+@contextmanager
+def transaction(db_path=DB_PATH):
+    """``BEGIN IMMEDIATE`` ... ``COMMIT`` (or ``ROLLBACK`` on error)
+
+    Taking the write lock up front avoids the deadlock-prone upgrade from a
+    read to a write transaction when several writers race.
+    """
+    conn = get_connection(db_path)
+    with metrics.timed('sqlite'):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+def init_schema(db_path=DB_PATH):
+    with transaction(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                email TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS detections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                detection_type TEXT,
+                location TEXT,
+                file_path TEXT,
+                result_path TEXT,
+                pothole_count INTEGER DEFAULT 0,
+                detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                alert_sent BOOLEAN DEFAULT 0,
+                job_id TEXT,
+                alert_owner TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        # Saved images of a video run: one row per frame (or tracked pothole)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS detection_frames (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                detection_id INTEGER NOT NULL,
+                frame_number INTEGER NOT NULL,
+                pothole_count INTEGER DEFAULT 0,
+                track_id INTEGER,
+                confidence REAL,
+                result_path TEXT,
+                FOREIGN KEY (detection_id) REFERENCES detections (id)
+            )
+        ''')
+        # One row per detected box, so potholes can be queried by place
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pothole_boxes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                detection_id INTEGER NOT NULL,
+                frame_number INTEGER NOT NULL DEFAULT 0,
+                x1 REAL NOT NULL,
+                y1 REAL NOT NULL,
+                x2 REAL NOT NULL,
+                y2 REAL NOT NULL,
+                confidence REAL,
+                lat REAL,
+                lon REAL,
+                cell INTEGER,
+                FOREIGN KEY (detection_id) REFERENCES detections (id)
+            )
+        ''')
+        _add_column(conn, 'detections', 'job_id', 'TEXT')
+        _add_column(conn, 'detections', 'alert_owner', 'TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_user_time ON detections (user_id, detected_at)')
+        # Finds what an interrupted job inserted so its rerun can replace it
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_job ON detections (job_id) WHERE job_id IS NOT NULL')
+        # Alerts queued in some process's memory but not delivered yet
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_unsent_alerts ON detections (detected_at) '
+                     'WHERE NOT alert_sent AND alert_owner IS NOT NULL')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_location ON detections (location)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_detection_frames_detection '
+                     'ON detection_frames (detection_id, frame_number)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_pothole_boxes_detection ON pothole_boxes (detection_id)')
+        # Covering index for viewport queries; boxes without coordinates stay out of it
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_pothole_boxes_cell ON pothole_boxes (cell, lat, lon) '
+                     'WHERE cell IS NOT NULL')
+        _init_rollups(conn)
+
+
+def _add_column(conn, table, column, decl):
+    """Add ``column`` to a table created before it existed"""
+    if column not in {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+
+# Every detection counts once in its user's day and location; ``sign`` is
+# 1 for NEW rows and -1 for OLD ones
+_ROLLUP_UPSERTS = (
+    '''INSERT INTO user_daily_stats (user_id, day, detections, potholes, alerts)
+       VALUES ({row}.user_id, date({row}.detected_at), {sign}, {sign} * coalesce({row}.pothole_count, 0),
+               {sign} * (coalesce({row}.alert_sent, 0) != 0))
+       ON CONFLICT (user_id, day) DO UPDATE SET
+           detections = detections + excluded.detections,
+           potholes = potholes + excluded.potholes,
+           alerts = alerts + excluded.alerts;''',
+    '''INSERT INTO user_location_stats (user_id, location, detections, potholes, alerts, last_detected_at)
+       VALUES ({row}.user_id, coalesce({row}.location, ''), {sign}, {sign} * coalesce({row}.pothole_count, 0),
+               {sign} * (coalesce({row}.alert_sent, 0) != 0), {row}.detected_at)
+       ON CONFLICT (user_id, location) DO UPDATE SET
+           detections = detections + excluded.detections,
+           potholes = potholes + excluded.potholes,
+           alerts = alerts + excluded.alerts,
+           last_detected_at = max(last_detected_at, excluded.last_detected_at);''',
+)
+
+
+def _rollup_statements(row, sign):
+    return '\n'.join(sql.format(row=row, sign=sign) for sql in _ROLLUP_UPSERTS)
+
+
+def _init_rollups(conn):
+    """Create the dashboard rollup tables and their triggers, backfilling new tables"""
+    backfill = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_daily_stats'").fetchone() is None
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            detections INTEGER NOT NULL DEFAULT 0,
+            potholes INTEGER NOT NULL DEFAULT 0,
+            alerts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_location_stats (
+            user_id INTEGER NOT NULL,
+            location TEXT NOT NULL,
+            detections INTEGER NOT NULL DEFAULT 0,
+            potholes INTEGER NOT NULL DEFAULT 0,
+            alerts INTEGER NOT NULL DEFAULT 0,
+            last_detected_at TIMESTAMP,
+            PRIMARY KEY (user_id, location)
+        ) WITHOUT ROWID
+    ''')
+    # Top locations of a user without sorting all of them
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_location_stats_potholes '
+                 'ON user_location_stats (user_id, potholes)')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS detections_rollup_insert AFTER INSERT ON detections BEGIN
+            {_rollup_statements('NEW', 1)}
+        END
+    ''')
+    # result_path is rewritten by cache eviction and is not counted, so it does not fire this
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS detections_rollup_update
+        AFTER UPDATE OF user_id, location, pothole_count, detected_at, alert_sent ON detections BEGIN
+            {_rollup_statements('OLD', -1)}
+            {_rollup_statements('NEW', 1)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS detections_rollup_delete AFTER DELETE ON detections BEGIN
+            {_rollup_statements('OLD', -1)}
+        END
+    ''')
+    if backfill:
+        rebuild_rollups(conn)
+
+
+def rebuild_rollups(conn):
+    """Recompute both rollup tables from ``detections`` (inside a transaction)"""
+    conn.execute('DELETE FROM user_daily_stats')
+    conn.execute('DELETE FROM user_location_stats')
+    conn.execute('''
+        INSERT INTO user_daily_stats (user_id, day, detections, potholes, alerts)
+        SELECT user_id, date(detected_at), COUNT(*), SUM(coalesce(pothole_count, 0)),
+               SUM(coalesce(alert_sent, 0) != 0)
+        FROM detections GROUP BY user_id, date(detected_at)
+    ''')
+    conn.execute('''
+        INSERT INTO user_location_stats (user_id, location, detections, potholes, alerts, last_detected_at)
+        SELECT user_id, coalesce(location, ''), COUNT(*), SUM(coalesce(pothole_count, 0)),
+               SUM(coalesce(alert_sent, 0) != 0), MAX(detected_at)
+        FROM detections GROUP BY user_id, coalesce(location, '')
+    ''')
+
+
+# ========================
+# Users
+# ========================
+def create_user(username, password, email='', db_path=DB_PATH):
+    """Insert a user; raises sqlite3.IntegrityError if the name is taken"""
+    with transaction(db_path) as conn:
+        return conn.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
+                            (username, password, email)).lastrowid
+
+
+def find_user(username, password, db_path=DB_PATH):
+    return get_connection(db_path).execute(
+        'SELECT * FROM users WHERE username = ? AND password = ?', (username, password)).fetchone()
+
+
+# ========================
+# Detections
+# ========================
+def insert_detection(user_id, detection_type, location, file_path, result_path=None,
+                     pothole_count=0, alert_sent=False, frames=None, boxes=None,
+                     lat=None, lon=None, job_id=None, db_path=DB_PATH):
+    """Insert one detection with its saved frames and boxes in one transaction
+
+    ``frames`` is an iterable of dicts shaped like ``process_video``'s
+    ``detected_frames`` entries. ``boxes`` is an iterable of
+    ``(frame_number, [x1, y1, x2, y2, conf, ...])``; video frames carry their
+    own under ``frames[i]['boxes']``. ``lat``/``lon`` place every box on the
+    map. ``job_id`` ties the detection to the job that made it (see
+    ``delete_job_detections``). Returns the new detection id.
+    """
+    with transaction(db_path) as conn:
+        detection_id = conn.execute(
+            '''INSERT INTO detections
+               (user_id, detection_type, location, file_path, result_path, pothole_count, alert_sent, job_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (user_id, detection_type, location, file_path, result_path, pothole_count, alert_sent,
+             job_id)).lastrowid
+        if frames:
+            _insert_frames(conn, detection_id, frames)
+        _insert_boxes(conn, detection_id, _all_boxes(frames, boxes), lat, lon)
+    return detection_id
+
+
+def insert_detections(rows, db_path=DB_PATH, conn=None):
+    """Bulk-insert detections in a single transaction; returns their ids
+
+    Each row is a dict with the ``insert_detection`` keyword arguments.
+    ``conn`` is an open ``transaction()`` to join instead of starting one.
+    """
+    if conn is None:
+        with transaction(db_path) as conn:
+            return insert_detections(rows, conn=conn)
+    ids = []
+    for row in rows:
+        ids.append(conn.execute(
+            '''INSERT INTO detections
+               (user_id, detection_type, location, file_path, result_path, pothole_count, alert_sent, job_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (row['user_id'], row.get('detection_type'), row.get('location'), row.get('file_path'),
+             row.get('result_path'), row.get('pothole_count', 0), row.get('alert_sent', False),
+             row.get('job_id'))).lastrowid)
+        if row.get('frames'):
+            _insert_frames(conn, ids[-1], row['frames'])
+        _insert_boxes(conn, ids[-1], _all_boxes(row.get('frames'), row.get('boxes')),
+                      row.get('lat'), row.get('lon'))
+    return ids
+
+
+def _insert_frames(conn, detection_id, frames):
+    conn.executemany(
+        '''INSERT INTO detection_frames
+           (detection_id, frame_number, pothole_count, track_id, confidence, result_path)
+           VALUES (?, ?, ?, ?, ?, ?)''',
+        [(detection_id, f['frame_number'], f.get('pothole_count', 0), f.get('track_id'),
+          f.get('confidence'), f.get('path')) for f in frames])
+
+
+def _all_boxes(frames, boxes):
+    for frame in frames or ():
+        for box in frame.get('boxes', ()):
+            yield frame['frame_number'], box
+    yield from boxes or ()
+
+
+def _insert_boxes(conn, detection_id, boxes, lat=None, lon=None):
+    cell = grid_cell(lat, lon)
+    conn.executemany(
+        '''INSERT INTO pothole_boxes
+           (detection_id, frame_number, x1, y1, x2, y2, confidence, lat, lon, cell)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        [(detection_id, frame_number, box[0], box[1], box[2], box[3],
+          box[4] if len(box) > 4 else None, lat, lon, cell) for frame_number, box in boxes])
+
+
+def delete_job_detections(job_id, db_path=DB_PATH):
+    """Delete what an interrupted run of ``job_id`` inserted, before it reruns
+
+    Returns True if an alert had already gone out for any of them, so the
+    rerun records the alert as sent instead of sending it again.
+    """
+    with transaction(db_path) as conn:
+        rows = conn.execute('SELECT id, alert_sent FROM detections WHERE job_id = ?', (job_id,)).fetchall()
+        ids = [(row['id'],) for row in rows]
+        conn.executemany('DELETE FROM pothole_boxes WHERE detection_id = ?', ids)
+        conn.executemany('DELETE FROM detection_frames WHERE detection_id = ?', ids)
+        conn.executemany('DELETE FROM detections WHERE id = ?', ids)
+    return any(row['alert_sent'] for row in rows)
+
+
+def get_detection(detection_id, db_path=DB_PATH):
+    return get_connection(db_path).execute('SELECT * FROM detections WHERE id = ?', (detection_id,)).fetchone()
+
+
+def list_detection_frames(detection_id, after=None, limit=24, db_path=DB_PATH):
+    """One page of a video run's saved frames, in frame order
+
+    ``after`` is the ``(frame_number, id)`` of the last frame of the previous
+    page, so every page is one range scan of the detection's index entries
+    however deep into the run it is. Returns ``(frames, next_after)``, where
+    ``next_after`` is None on the last page.
+    """
+    frame_number, frame_id = after if after is not None else (-1, -1)
+    rows = get_connection(db_path).execute(
+        '''SELECT id, frame_number, pothole_count, track_id, confidence, result_path
+           FROM detection_frames
+           WHERE detection_id = ? AND (frame_number, id) > (?, ?)
+           ORDER BY frame_number, id
+           LIMIT ?''',
+        (detection_id, frame_number, frame_id, limit + 1)).fetchall()
+    frames = [dict(r) for r in rows[:limit]]
+    next_after = (frames[-1]['frame_number'], frames[-1]['id']) if len(rows) > limit else None
+    return frames, next_after
+
+
+def list_user_detections(user_id, before=None, limit=20, db_path=DB_PATH):
+    """One page of a user's detections, newest first
+
+    ``before`` is the ``(detected_at, id)`` of the last detection of the
+    previous page, which ``idx_detections_user_time`` holds in order for
+    each user, so a page is one range scan of that index however deep into
+    the history it is. The cursor carries both values, so paging goes on
+    when that detection has since been deleted. Returns ``(detections,
+    next_before)``, where ``next_before`` is None on the last page.
+    """
+    conn = get_connection(db_path)
+    if before is None:
+        rows = conn.execute(
+            '''SELECT id, detection_type, location, result_path, pothole_count, detected_at, alert_sent
+               FROM detections
+               WHERE user_id = ?
+               ORDER BY detected_at DESC, id DESC
+               LIMIT ?''',
+            (user_id, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(
+            '''SELECT id, detection_type, location, result_path, pothole_count, detected_at, alert_sent
+               FROM detections
+               WHERE user_id = ? AND (detected_at, id) < (?, ?)
+               ORDER BY detected_at DESC, id DESC
+               LIMIT ?''',
+            (user_id, before[0], before[1], limit + 1)).fetchall()
+    detections = [dict(r) for r in rows[:limit]]
+    next_before = (detections[-1]['detected_at'], detections[-1]['id']) if len(rows) > limit else None
+    return detections, next_before
+
+
+def user_daily_stats(user_id, since=None, db_path=DB_PATH):
+    """A user's rollup rows from day ``since`` ('YYYY-MM-DD', default all) on, oldest first"""
+    return [dict(r) for r in get_connection(db_path).execute(
+        '''SELECT day, detections, potholes, alerts FROM user_daily_stats
+           WHERE user_id = ? AND day >= ? ORDER BY day''',
+        (user_id, since or '')).fetchall()]
+
+
+def user_totals(user_id, db_path=DB_PATH):
+    """All-time detection, pothole and alert counts of a user (one row per active day is summed)
+
+    Deleting detections leaves their rollup rows behind at zero, so only
+    rows that still count something are active days or top locations.
+    """
+    row = get_connection(db_path).execute(
+        '''SELECT coalesce(SUM(detections > 0), 0) AS days, coalesce(SUM(detections), 0) AS detections,
+                  coalesce(SUM(potholes), 0) AS potholes, coalesce(SUM(alerts), 0) AS alerts
+           FROM user_daily_stats WHERE user_id = ?''',
+        (user_id,)).fetchone()
+    return dict(row)
+
+
+def user_top_locations(user_id, limit=10, db_path=DB_PATH):
+    """A user's locations with the most potholes"""
+    return [dict(r) for r in get_connection(db_path).execute(
+        '''SELECT location, detections, potholes, alerts, last_detected_at FROM user_location_stats
+           WHERE user_id = ? AND detections > 0 ORDER BY potholes DESC LIMIT ?''',
+        (user_id, limit)).fetchall()]
+
+
+def mark_alerts_sent(detection_ids, db_path=DB_PATH):
+    detection_ids = list(detection_ids)
+    if not detection_ids:
+        return
+    with transaction(db_path) as conn:
+        conn.executemany('UPDATE detections SET alert_sent = 1 WHERE id = ? AND NOT alert_sent',
+                         [(i,) for i in detection_ids])
+
+
+def queue_alerts(detection_ids, owner, db_path=DB_PATH):
+    """Record that process ``owner`` (``host:pid``) holds these detections' alerts in memory"""
+    detection_ids = list(detection_ids)
+    if not detection_ids:
+        return
+    with transaction(db_path) as conn:
+        conn.executemany('UPDATE detections SET alert_owner = ? WHERE id = ? AND NOT alert_sent',
+                         [(owner, i) for i in detection_ids])
+
+
+def abandon_alerts(detection_ids, db_path=DB_PATH):
+    """Release undelivered alerts that were given up on, so ``unsent_alerts`` no longer returns them"""
+    detection_ids = list(detection_ids)
+    if not detection_ids:
+        return
+    with transaction(db_path) as conn:
+        conn.executemany('UPDATE detections SET alert_owner = NULL WHERE id = ? AND NOT alert_sent',
+                         [(i,) for i in detection_ids])
+
+
+def unsent_alerts(max_age_seconds, db_path=DB_PATH):
+    """Queued but undelivered alerts of the last ``max_age_seconds``, oldest first"""
+    return get_connection(db_path).execute(
+        '''SELECT id, detection_type, location, result_path, pothole_count, detected_at, alert_owner
+           FROM detections
+           WHERE NOT alert_sent AND alert_owner IS NOT NULL AND detected_at >= datetime('now', ?)
+           ORDER BY detected_at''', (f'-{int(max_age_seconds)} seconds',)).fetchall()
+
+
+def claim_alert(detection_id, previous_owner, owner, db_path=DB_PATH):
+    """Take over an undelivered alert from ``previous_owner``; False if someone else did"""
+    with transaction(db_path) as conn:
+        return conn.execute('''UPDATE detections SET alert_owner = ?
+                               WHERE id = ? AND alert_owner = ? AND NOT alert_sent''',
+                            (owner, detection_id, previous_owner)).rowcount == 1
+
+
+# ========================
+# Spatial queries
+# ========================
+_GRID_COLS = int(math.ceil(360 / GRID_CELL_DEG))
+
+
+def _grid_xy(lat, lon):
+    row = int((min(max(lat, -90.0), 90.0) + 90) // GRID_CELL_DEG)
+    col = int((min(max(lon, -180.0), 180.0) + 180) // GRID_CELL_DEG)
+    return row, min(col, _GRID_COLS - 1)
+
+
+def grid_cell(lat, lon):
+    """Grid cell id of a coordinate, or None without one"""
+    if lat is None or lon is None:
+        return None
+    row, col = _grid_xy(lat, lon)
+    return row * _GRID_COLS + col
+
+
+def query_potholes(min_lon, min_lat, max_lon, max_lat, limit=1000, user_id=None, db_path=DB_PATH):
+    """Boxes whose coordinates fall inside the viewport, of ``user_id``'s detections if given
+
+    Each grid row the viewport covers is one contiguous range of cell ids, so
+    a small viewport is a handful of index range scans however many rows the
+    table holds. Returns at most ``limit`` dicts.
+    """
+    row0, col0 = _grid_xy(min_lat, min_lon)
+    row1, col1 = _grid_xy(max_lat, max_lon)
+    if row1 - row0 + 1 > GRID_MAX_ROW_QUERIES:
+        ranges = [(row0 * _GRID_COLS + col0, row1 * _GRID_COLS + col1)]
+    else:
+        ranges = [(r * _GRID_COLS + col0, r * _GRID_COLS + col1) for r in range(row0, row1 + 1)]
+
+    conn = get_connection(db_path)
+    potholes = []
+    for lo, hi in ranges:
+        rows = conn.execute(
+            '''SELECT b.id, b.detection_id, b.frame_number, b.x1, b.y1, b.x2, b.y2,
+                      b.confidence, b.lat, b.lon, d.location, d.detected_at
+               FROM pothole_boxes b JOIN detections d ON d.id = b.detection_id
+               WHERE b.cell BETWEEN ? AND ?
+                 AND b.lat BETWEEN ? AND ? AND b.lon BETWEEN ? AND ?
+                 AND (? IS NULL OR d.user_id = ?)
+               LIMIT ?''',
+            (lo, hi, min_lat, max_lat, min_lon, max_lon, user_id, user_id, limit - len(potholes))).fetchall()
+        potholes.extend({
+            'id': r['id'],
+            'detection_id': r['detection_id'],
+            'frame_number': r['frame_number'],
+            'bbox': [r['x1'], r['y1'], r['x2'], r['y2']],
+            'confidence': r['confidence'],
+            'lat': r['lat'],
+            'lon': r['lon'],
+            'location': r['location'],
+            'detected_at': r['detected_at'],
+        } for r in rows)
+        if len(potholes) >= limit:
+            break
+    return potholes
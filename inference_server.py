@@ -0,0 +1,287 @@
+"""Shared model server for Flask / job worker processes
+
+One process loads the YOLO weights once, runs a warm-up pass and then serves
+predictions over a local socket, so every web or job worker can share a
+single copy of the model instead of loading its own.
+
+Start it with:
+    INFERENCE_AUTHKEY=... python inference_server.py [--address /path/to/inference.sock]
+
+and point the app at the address it logs with INFERENCE_SERVER=... (and the
+same INFERENCE_AUTHKEY); ``load_model()`` then returns an ``InferenceClient``
+whose ``predict`` has the same call shape as ``YOLO.predict``. The server
+always runs the plain model; INFERENCE_MODE=adaptive tiling happens in the
+clients.
+
+Requests are pickled, so only processes holding the key may connect: both
+sides refuse to run without a real secret (INFERENCE_AUTHKEY, or a
+FLASK_SECRET_KEY other than the development placeholder), and the socket is
+created owner-only (0600), by default in a private 0700 directory.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import cv2
+import numpy as np
+
+# The development default of app.secret_key; never good enough as an authkey
+PLACEHOLDER_SECRET = "fallback_secret_key"
+
+logger = logging.getLogger(__name__)
+
+
+def _default_address():
+    owner = os.getuid() if hasattr(os, 'getuid') else os.getenv("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f'pothole_inference-{owner}', 'inference.sock')
+
+
+DEFAULT_ADDRESS = _default_address()
+
+
+def _authkey():
+    key = os.getenv("INFERENCE_AUTHKEY") or os.getenv("FLASK_SECRET_KEY")
+    if not key or key == PLACEHOLDER_SECRET:
+        raise RuntimeError("Set INFERENCE_AUTHKEY (or a real FLASK_SECRET_KEY) to use the inference server")
+    return key.encode()
+
+
+# ========================
+# Client side
+# ========================
+class RemoteBoxes:
+    """The subset of ultralytics ``Boxes`` the app uses, as numpy arrays"""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.conf)
+
+
+class RemoteResult:
+    """Detection result returned by the inference server
+
+    Mirrors the parts of ultralytics ``Results`` used by the app: ``boxes``,
+    ``names``, ``orig_img`` and ``plot()``.
+    """
+
+    def __init__(self, boxes, names, orig_img=None, path=None):
+        self.boxes = boxes
+        self.names = names
+        self.path = path
+        self._orig_img = orig_img
+
+    @property
+    def orig_img(self):
+        if self._orig_img is None and self.path is not None:
+            self._orig_img = cv2.imread(self.path)
+        return self._orig_img
+
+    def plot(self, line_width=None):
+        """Draw boxes and labels on a copy of the original image"""
+        img = self.orig_img.copy()
+        lw = line_width or max(round(sum(img.shape[:2]) / 2 * 0.003), 2)
+        for (x1, y1, x2, y2), conf, cls in zip(self.boxes.xyxy.astype(int), self.boxes.conf, self.boxes.cls):
+            color = (56, 56, 255)
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, lw, cv2.LINE_AA)
+            label = f"{self.names.get(int(cls), int(cls))} {conf:.2f}"
+            scale = lw / 3
+            (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, scale, max(lw - 1, 1))
+            top = y1 - h - 3 if y1 - h - 3 >= 0 else y1 + h + 3
+            cv2.rectangle(img, (x1, y1), (x1 + w, top), color, -1, cv2.LINE_AA)
+            cv2.putText(img, label, (x1, y1 - 2 if top < y1 else y1 + h + 2), cv2.FONT_HERSHEY_SIMPLEX,
+                        scale, (255, 255, 255), max(lw - 1, 1), cv2.LINE_AA)
+        return img
+
+
+class InferenceClient:
+    """Drop-in stand-in for a loaded YOLO model backed by the inference server"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, connect_timeout=30.0):
+        self.address = address
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+        self.names = self._call({'op': 'info'})['names']
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    conn = Client(self.address, authkey=_authkey())
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() >= deadline:
+                        raise
+                    time.sleep(0.2)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, request):
+        try:
+            conn = self._connection()
+            conn.send(request)
+            response = conn.recv()
+        except (EOFError, OSError):
+            # Server restarted; reconnect once
+            self._local.conn = None
+            conn = self._connection()
+            conn.send(request)
+            response = conn.recv()
+        if not response['ok']:
+            raise RuntimeError(f"Inference server error: {response['error']}")
+        return response
+
+    def info(self):
+        return self._call({'op': 'info'})
+
+    def predict(self, source=None, **kwargs):
+        sources = source if isinstance(source, list) else [source]
+        kwargs.pop('save', None)
+        kwargs.pop('verbose', None)
+        response = self._call({'op': 'predict', 'source': sources, 'kwargs': kwargs})
+        results = []
+        for src, r in zip(sources, response['results']):
+            boxes = RemoteBoxes(r['xyxy'], r['conf'], r['cls'])
+            if isinstance(src, str):
+                results.append(RemoteResult(boxes, self.names, path=src))
+            else:
+                results.append(RemoteResult(boxes, self.names, orig_img=src))
+        return results
+
+    def __call__(self, *args, **kwargs):
+        return self.predict(*args, **kwargs)
+
+
+# ========================
+# Server side
+# ========================
+def _serialize(result):
+    boxes = result.boxes
+    return {
+        'xyxy': boxes.xyxy.cpu().numpy() if hasattr(boxes.xyxy, 'cpu') else np.asarray(boxes.xyxy),
+        'conf': boxes.conf.cpu().numpy() if hasattr(boxes.conf, 'cpu') else np.asarray(boxes.conf),
+        'cls': boxes.cls.cpu().numpy() if hasattr(boxes.cls, 'cpu') else np.asarray(boxes.cls),
+    }
+
+
+def warm_up(m, imgsz=640, runs=2):
+    """Run a few dummy predictions so the first real request is not the slow one"""
+    blank = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    start = time.perf_counter()
+    for _ in range(runs):
+        m.predict(source=blank, save=False, verbose=False)
+    return time.perf_counter() - start
+
+
+class InferenceServer:
+    def __init__(self, m, address=DEFAULT_ADDRESS, stats=None):
+        self.model = m
+        self.address = address
+        self.stats = stats or {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if request['op'] == 'info':
+                        response = {'ok': True, 'names': dict(self.model.names), **self.stats}
+                    elif request['op'] == 'predict':
+                        start = time.perf_counter()
+                        # One forward pass at a time; batching happens on the client side
+                        with self._lock:
+                            results = self.model.predict(source=request['source'], save=False,
+                                                         verbose=False, **request.get('kwargs', {}))
+                        response = {'ok': True, 'results': [_serialize(r) for r in results],
+                                    'seconds': time.perf_counter() - start}
+                    else:
+                        response = {'ok': False, 'error': f"Unknown op {request['op']!r}"}
+                except Exception as e:
+                    logger.exception(f"Prediction failed: {e}")
+                    response = {'ok': False, 'error': str(e)}
+                try:
+                    conn.send(response)
+                except (EOFError, OSError):
+                    return
+
+    def _listen(self):
+        authkey = _authkey()
+        if not isinstance(self.address, str):
+            return Listener(self.address, authkey=authkey)
+        folder = os.path.dirname(os.path.abspath(self.address))
+        if not os.path.isdir(folder):
+            os.makedirs(folder, mode=0o700)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # Bind under a umask so the socket is never reachable by other users,
+        # not even between bind() and a later chmod
+        umask = os.umask(0o177)
+        try:
+            return Listener(self.address, authkey=authkey)
+        finally:
+            os.umask(umask)
+
+    def serve_forever(self):
+        self._listener = self._listen()
+        logger.info(f"✅ Inference server listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = self._listener.accept()
+                except Exception as e:  # bad authkey etc.
+                    logger.warning(f"Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self._listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve pothole model predictions over a local socket')
+    parser.add_argument('--address', default=os.getenv("INFERENCE_SERVER", DEFAULT_ADDRESS))
+    parser.add_argument('--warmup-runs', type=int, default=2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        _authkey()
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    # Make sure this process loads the real model rather than a client to itself,
+    # and the plain one: with INFERENCE_MODE=adaptive the clients plan, tile and
+    # merge, and send the server single passes
+    os.environ.pop("INFERENCE_SERVER", None)
+    os.environ["INFERENCE_MODE"] = "standard"
+    from app import load_model
+
+    start = time.perf_counter()
+    m = load_model()
+    if m is None:
+        raise SystemExit("Model could not be loaded")
+    load_seconds = time.perf_counter() - start
+    warmup_seconds = warm_up(m, runs=args.warmup_runs)
+    logger.info(f"⏱️ Model loaded in {load_seconds:.2f}s, warm-up took {warmup_seconds:.2f}s")
+
+    InferenceServer(m, args.address, stats={
+        'load_seconds': load_seconds,
+        'warmup_seconds': warmup_seconds,
+        'pid': os.getpid(),
+    }).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
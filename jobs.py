@@ -0,0 +1,276 @@
+"""Persistent detection job queue backed by the SQLite database
+
+Uploads are stored as rows in the ``jobs`` table and picked up by a pool of
+worker processes, so a long video never blocks a Flask request and queued or
+interrupted jobs are picked up again after a restart. A running job counts
+as interrupted once its heartbeat is older than JOB_STALE_SECONDS or the
+worker process that claimed it (``host:pid``) is gone. Progress and the
+outcome are only recorded by the worker holding the job: one that stalled
+and had its job requeued and claimed again stops at its next heartbeat.
+
+Run standalone workers with:
+    python jobs.py --workers 2
+"""
+import argparse
+import atexit
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+import uuid
+
+from db import DB_PATH, get_connection, transaction
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+# A running job whose heartbeat is older than this is assumed to be orphaned
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 300))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+logger = logging.getLogger(__name__)
+
+
+class JobLost(Exception):
+    """The job was requeued and claimed again while this worker was running it"""
+
+
+def init_jobs_table(db_path=DB_PATH):
+    with transaction(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                job_type TEXT NOT NULL,
+                location TEXT,
+                file_path TEXT NOT NULL,
+                params TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                progress REAL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                worker TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def enqueue_job(user_id, job_type, file_path, location, params=None, db_path=DB_PATH):
+    """Queue a detection job and return its id"""
+    job_id = uuid.uuid4().hex
+    get_connection(db_path).execute(
+        '''INSERT INTO jobs (id, user_id, job_type, location, file_path, params)
+           VALUES (?, ?, ?, ?, ?, ?)''',
+        (job_id, user_id, job_type, location, file_path, json.dumps(params or {})))
+    return job_id
+
+
+def get_job(job_id, db_path=DB_PATH):
+    row = get_connection(db_path).execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return _row_to_job(row)
+
+
+def worker_name():
+    """``host:pid`` of this process, as recorded in ``jobs.worker``"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def worker_alive(worker):
+    """False only if ``worker`` is a process on this host that no longer exists"""
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        # Another machine (or an old-style name): only the heartbeat can tell
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def requeue_stale_jobs(db_path=DB_PATH, stale_seconds=JOB_STALE_SECONDS):
+    """Put orphaned running jobs back in the queue, failing those out of attempts
+
+    A running job is orphaned when its heartbeat is older than
+    ``stale_seconds`` or its worker process has exited; jobs held by live
+    workers (including standalone ``python jobs.py`` ones) are left alone.
+    Returns how many jobs were requeued.
+    """
+    cutoff = f'-{int(stale_seconds)} seconds'
+    with transaction(db_path) as conn:
+        rows = conn.execute('''SELECT id, worker, attempts, updated_at <= datetime('now', ?) AS stale
+                              FROM jobs WHERE status = 'running' ''', (cutoff,)).fetchall()
+        orphaned = [row for row in rows if row['stale'] or not worker_alive(row['worker'])]
+        conn.executemany('''UPDATE jobs SET status = 'failed', error = 'Worker died too many times',
+                            updated_at = CURRENT_TIMESTAMP WHERE id = ?''',
+                         [(row['id'],) for row in orphaned if row['attempts'] >= JOB_MAX_ATTEMPTS])
+        requeue = [(row['id'],) for row in orphaned if row['attempts'] < JOB_MAX_ATTEMPTS]
+        conn.executemany('''UPDATE jobs SET status = 'queued', worker = NULL,
+                            updated_at = CURRENT_TIMESTAMP WHERE id = ?''', requeue)
+    return len(requeue)
+
+
+def claim_next_job(worker_id, db_path=DB_PATH):
+    """Atomically move the oldest queued job to running and return it"""
+    with transaction(db_path) as conn:
+        row = conn.execute('''SELECT id FROM jobs WHERE status = 'queued'
+                              ORDER BY created_at, rowid LIMIT 1''').fetchone()
+        if row is None:
+            return None
+        conn.execute('''UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                        updated_at = CURRENT_TIMESTAMP WHERE id = ?''', (worker_id, row['id']))
+        job = conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+    return _row_to_job(job)
+
+
+def update_progress(job_id, worker_id, progress, db_path=DB_PATH):
+    """Record progress (0..1); doubles as the worker heartbeat
+
+    ``progress=None`` only beats the heartbeat, for jobs that cannot tell how
+    far along they are (e.g. a video still being uploaded). Returns False if
+    ``worker_id`` no longer holds the running job.
+    """
+    if progress is not None:
+        progress = min(1.0, max(0.0, progress))
+    return get_connection(db_path).execute(
+        '''UPDATE jobs SET progress = coalesce(?, progress), updated_at = CURRENT_TIMESTAMP
+           WHERE id = ? AND worker = ? AND status = 'running' ''', (progress, job_id, worker_id)).rowcount == 1
+
+
+def finish_job(job_id, worker_id, result, db_path=DB_PATH):
+    """Mark the job done; False if ``worker_id`` no longer holds it"""
+    return get_connection(db_path).execute(
+        '''UPDATE jobs SET status = 'done', progress = 1, result = ?, error = NULL,
+           updated_at = CURRENT_TIMESTAMP WHERE id = ? AND worker = ? AND status = 'running' ''',
+        (json.dumps(result), job_id, worker_id)).rowcount == 1
+
+
+def fail_job(job_id, worker_id, error, db_path=DB_PATH):
+    """Mark the job failed; False if ``worker_id`` no longer holds it"""
+    return get_connection(db_path).execute(
+        '''UPDATE jobs SET status = 'failed', error = ?,
+           updated_at = CURRENT_TIMESTAMP WHERE id = ? AND worker = ? AND status = 'running' ''',
+        (str(error), job_id, worker_id)).rowcount == 1
+
+
+def _load_handler(handler):
+    module_name, func_name = handler.split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def worker_loop(handler, worker_id, db_path=DB_PATH, poll_interval=JOB_POLL_INTERVAL, stop_event=None):
+    """Claim and run jobs until ``stop_event`` is set
+
+    ``handler`` is a ``"module:function"`` string so it can be imported in a
+    spawned process; it is called as ``handler(job, progress)`` and returns a
+    JSON-serialisable result. ``job['attempts']`` above 1 means an earlier
+    run of the job was interrupted; the handler is expected to discard what
+    that run left behind.
+    """
+    run = _load_handler(handler)
+    logger.info(f"Job worker {worker_id} started")
+    while stop_event is None or not stop_event.is_set():
+        job = claim_next_job(worker_id, db_path)
+        if job is None:
+            # Idle: pick up jobs orphaned by a worker that crashed mid-run
+            requeue_stale_jobs(db_path)
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+
+        logger.info(f"Job {job['id']} ({job['job_type']}) claimed by {worker_id}")
+
+        def progress(p, job_id=job['id']):
+            if not update_progress(job_id, worker_id, p, db_path):
+                raise JobLost(f"Job {job_id} was claimed by another worker")
+
+        try:
+            result = run(job, progress)
+            if finish_job(job['id'], worker_id, result, db_path):
+                logger.info(f"Job {job['id']} done")
+            else:
+                logger.warning(f"Job {job['id']} was claimed by another worker, dropping this run's result")
+        except JobLost as e:
+            logger.warning(f"⚠️ {e}, stopping this run")
+        except Exception as e:
+            logger.exception(f"Job {job['id']} failed: {e}")
+            fail_job(job['id'], worker_id, e, db_path)
+
+
+def _worker_main(handler, db_path, poll_interval, stop_event):
+    logging.basicConfig(level=logging.INFO)
+    # stop_workers terminates workers still busy after its timeout: exit
+    # through SystemExit so atexit handlers (queued alerts) still run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        worker_loop(handler, worker_name(), db_path, poll_interval, stop_event)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(handler, count, db_path=DB_PATH, poll_interval=JOB_POLL_INTERVAL):
+    """Start ``count`` worker processes; returns ``(processes, stop_event)``
+
+    Jobs left running by workers that are gone are requeued first. Workers are
+    not daemonic, so a job can start processes of its own (see
+    video_segments.py); they are stopped when the interpreter exits.
+    """
+    init_jobs_table(db_path)
+    requeued = requeue_stale_jobs(db_path)
+    if requeued:
+        logger.info(f"Requeued {requeued} interrupted job(s)")
+
+    # Spawn rather than fork: the parent may already hold model threads
+    ctx = multiprocessing.get_context('spawn')
+    stop_event = ctx.Event()
+    processes = []
+    for i in range(count):
+        p = ctx.Process(target=_worker_main, name=f'job-worker-{i}',
+                        args=(handler, db_path, poll_interval, stop_event))
+        p.start()
+        processes.append(p)
+    atexit.register(stop_workers, processes, stop_event)
+    return processes, stop_event
+
+
+def stop_workers(processes, stop_event, timeout=10):
+    stop_event.set()
+    for p in processes:
+        p.join(timeout)
+        if p.is_alive():
+            p.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run detection job workers')
+    parser.add_argument('--workers', type=int, default=int(os.getenv("JOB_WORKERS", 2)))
+    parser.add_argument('--handler', default='app:execute_job')
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    workers, stop = start_workers(args.handler, args.workers, args.db)
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        stop_workers(workers, stop)
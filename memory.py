@@ -0,0 +1,226 @@
+"""Bounded memory for video jobs: frame buffer pool, RSS budget, stage allocations
+
+Every decoded 1080p frame is a fresh 6 MB array, and with a decoder, a model
+batch and writers all holding frames, a job's footprint grows with the queue
+sizes rather than with what it actually needs. ``FramePool`` caps how many
+decoded frames exist at once and hands their arrays back to the decoder,
+which decodes into them in place (``cap.read(buffer)``), so steady-state
+decoding allocates nothing. When a job's resident set grows past its
+budget, the pipeline shrinks the pool (less decode-ahead) and only fails
+the job with ``MemoryBudgetExceeded`` once it cannot shrink any further.
+
+``StageAllocationTracer`` is the diagnostic side: it samples ``tracemalloc``
+while a job runs and attributes live allocations to pipeline stages by
+the innermost pipeline function on each allocation's traceback. It slows
+Python allocations down noticeably, so it is opt-in.
+"""
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+import types
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def current_rss():
+    """Resident set size of this process in bytes, 0 if it cannot be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # No /proc (macOS): fall back to the peak, in bytes there and KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryBudgetExceeded(MemoryError):
+    pass
+
+
+class FramePool:
+    """At most ``capacity`` decoded frames alive at once, their arrays reused
+
+    ``acquire()`` blocks while ``capacity`` frames are out and returns a
+    spare array to decode into (None while there is none yet, in which case
+    the capture allocates one). Every acquired slot must be given back with
+    ``release(frame)`` once nothing refers to the frame any more.
+    ``close()`` stops ``acquire()`` from blocking, for tearing a run down.
+    """
+
+    def __init__(self, capacity, min_capacity=1):
+        self.min_capacity = max(1, min_capacity)
+        self.capacity = max(capacity, self.min_capacity)
+        self.initial_capacity = self.capacity
+        self.in_use = 0
+        self.reused = 0
+        self.allocated = 0
+        self._free = []
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_use >= self.capacity and not self._closed:
+                self._cond.wait()
+            self.in_use += 1
+            return self._free.pop() if self._free else None
+
+    def note(self, buffer, frame):
+        """Count whether the capture decoded into ``buffer`` or allocated ``frame``"""
+        with self._cond:
+            if buffer is not None and frame is buffer:
+                self.reused += 1
+            else:
+                self.allocated += 1
+
+    def release(self, frame=None):
+        with self._cond:
+            self.in_use -= 1
+            if frame is not None and not self._closed and len(self._free) + self.in_use < self.capacity:
+                self._free.append(frame)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._free.clear()
+            self._cond.notify_all()
+
+    def shrink(self):
+        """Halve the capacity, down to ``min_capacity``; False if already there"""
+        with self._cond:
+            if self.capacity <= self.min_capacity:
+                return False
+            self.capacity = max(self.min_capacity, self.capacity // 2)
+            del self._free[max(0, self.capacity - self.in_use):]
+            return True
+
+    def as_dict(self):
+        with self._cond:
+            return {
+                'frame_buffers': self.capacity,
+                'initial_frame_buffers': self.initial_capacity,
+                'reused': self.reused,
+                'allocated': self.allocated,
+            }
+
+
+def _code_objects(code):
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _code_objects(const)
+
+
+def _function_lines(module, stages):
+    """``{(filename, line): stage}`` for the functions of ``module`` named in ``stages``
+
+    ``stages`` maps function and method names (nested functions included)
+    to stage names.
+    """
+    codes = []
+    for obj in vars(module).values():
+        if isinstance(obj, type) and obj.__module__ == module.__name__:
+            codes.extend(getattr(attr, '__code__', None) for attr in vars(obj).values())
+        else:
+            codes.append(getattr(obj, '__code__', None))
+    lines = {}
+    for code in codes:
+        if code is None or code.co_filename != module.__file__:
+            continue
+        for inner in _code_objects(code):
+            stage = stages.get(inner.co_name)
+            if stage is None:
+                continue
+            for _, _, line in inner.co_lines():
+                if line is not None:
+                    lines.setdefault((inner.co_filename, line), stage)
+    return lines
+
+
+class StageAllocationTracer:
+    """Peak live ``tracemalloc`` bytes per pipeline stage over one run
+
+    ``stages`` maps modules to either one stage name for all their code or
+    a dict of function name -> stage name. Every ``interval`` seconds the
+    live allocations are grouped by the innermost traceback frame that falls
+    in one of those functions; allocations made outside of them are counted
+    under 'other'.
+    """
+
+    def __init__(self, stages, interval=0.25, frames=32):
+        self.interval = interval
+        self.frames = frames
+        self._modules = {}
+        self._lines = {}
+        for module, stage in stages.items():
+            if isinstance(stage, str):
+                self._modules[module.__file__] = stage
+            else:
+                self._lines.update(_function_lines(module, stage))
+        self.peaks = {}
+        self.traced_peak = 0
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_tracing = False
+
+    def _stage(self, traceback):
+        # Tracebacks run from the oldest to the most recent frame
+        for frame in reversed(traceback):
+            stage = self._lines.get((frame.filename, frame.lineno)) or self._modules.get(frame.filename)
+            if stage is not None:
+                return stage
+        return 'other'
+
+    def sample(self):
+        snapshot = tracemalloc.take_snapshot()
+        totals = {}
+        for stat in snapshot.statistics('traceback'):
+            stage = self._stage(stat.traceback)
+            totals[stage] = totals.get(stage, 0) + stat.size
+        for stage, size in totals.items():
+            self.peaks[stage] = max(self.peaks.get(stage, 0), size)
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Allocation sample failed")
+                return
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+        self._thread = threading.Thread(target=self._run, name='alloc-tracer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()
+        self.traced_peak = tracemalloc.get_traced_memory()[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def as_dict(self):
+        return {
+            'traced_peak_mb': round(self.traced_peak / MB, 2),
+            'stage_peak_mb': {stage: round(size / MB, 2)
+                              for stage, size in sorted(self.peaks.items(), key=lambda kv: -kv[1])},
+            'samples': self.samples,
+        }
@@ -0,0 +1,297 @@
+"""Prometheus-style metrics without extra dependencies
+
+Counters, gauges and histograms are kept in process memory and rendered in
+the Prometheus text exposition format by ``render()`` (served at /metrics).
+
+Detection work mostly happens in job worker and segment processes. Every
+process that calls ``start_exporter()`` writes a snapshot of its metrics to
+``METRICS_DIR/<pid>.json`` every few seconds and at exit (METRICS_DIR
+defaults to a per-user directory under the temp dir; give each deployment
+its own). ``render()`` adds up the counters and histograms of all of them.
+Gauges are per process: each series gets a ``pid`` label, except gauges
+registered with ``merge='max'`` (the same value seen from every process,
+e.g. read from the database), which report the largest. Gauges of
+processes that stopped exporting are left out.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _default_dir():
+    owner = os.getuid() if hasattr(os, 'getuid') else os.getenv("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f'pothole_metrics-{owner}')
+
+
+METRICS_DIR = os.getenv("METRICS_DIR") or _default_dir()
+EXPORT_INTERVAL = 5.0
+# A process whose snapshot is older than this is gone; its gauges are dropped
+GAUGE_MAX_AGE = 6 * EXPORT_INTERVAL
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter(_Metric):
+    """Monotonic count; by convention the name ends in ``_total``"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(into, snapshot):
+        for key, value in snapshot.items():
+            into[key] = into.get(key, 0) + value
+
+    def lines(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{self._labels(json.loads(key))} {value}"
+
+
+class Gauge(_Metric):
+    """Current value per process; ``merge`` is 'pid' (a series per process) or 'max'"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), merge='pid'):
+        super().__init__(name, documentation, labels)
+        if merge not in ('pid', 'max'):
+            raise ValueError(f"Unknown gauge merge {merge!r}")
+        self.merge = merge
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Compute the value(s) at scrape time
+
+        ``function`` returns a number, or a list of ``(labels_dict, value)``.
+        """
+        self._function = function
+
+    def snapshot(self):
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                return {}
+            if not isinstance(value, list):
+                return {json.dumps([]): value}
+            return {json.dumps(list(self._key(labels))): v for labels, v in value}
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+    def lines(self, values):
+        """``values`` maps each live process's pid to its snapshot"""
+        if self.merge == 'max':
+            combined = {}
+            for snapshot in values.values():
+                for key, value in snapshot.items():
+                    combined[key] = max(combined.get(key, value), value)
+            for key, value in sorted(combined.items()):
+                yield f"{self.name}{self._labels(json.loads(key))} {value}"
+            return
+        for pid, snapshot in sorted(values.items()):
+            for key, value in sorted(snapshot.items()):
+                yield f"{self.name}{self._labels(json.loads(key), [('pid', pid)])} {value}"
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']}
+                    for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(into, snapshot):
+        for key, value in snapshot.items():
+            entry = into.setdefault(key, {'buckets': [0] * len(value['buckets']), 'sum': 0.0, 'count': 0})
+            entry['buckets'] = [a + b for a, b in zip(entry['buckets'], value['buckets'])]
+            entry['sum'] += value['sum']
+            entry['count'] += value['count']
+
+    def lines(self, values):
+        for key, entry in sorted(values.items()):
+            labels = json.loads(key)
+            cumulative = 0
+            for bound, n in zip(self.buckets, entry['buckets']):
+                cumulative += n
+                yield f"{self.name}_bucket{self._labels(labels, [('le', repr(float(bound)))])} {cumulative}"
+            yield f"{self.name}_bucket{self._labels(labels, [('le', '+Inf')])} {entry['count']}"
+            yield f"{self.name}_sum{self._labels(labels)} {round(entry['sum'], 6)}"
+            yield f"{self.name}_count{self._labels(labels)} {entry['count']}"
+
+
+def _register(cls, name, documentation, labels=(), **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, labels, **kwargs)
+        return metric
+
+
+def counter(name, documentation, labels=()):
+    return _register(Counter, name, documentation, labels)
+
+
+def gauge(name, documentation, labels=(), merge='pid'):
+    return _register(Gauge, name, documentation, labels, merge=merge)
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labels, buckets=buckets)
+
+
+# ========================
+# Shared metrics
+# ========================
+STAGE_SECONDS = histogram('pothole_stage_seconds', 'Time spent in each processing stage',
+                          ('stage', 'source'))
+HTTP_REQUEST_SECONDS = histogram('pothole_http_request_seconds', 'Flask request latency',
+                                 ('endpoint', 'method', 'status'))
+
+
+def observe_stage(stage, seconds, source=''):
+    STAGE_SECONDS.observe(seconds, stage=stage, source=source)
+
+
+def timed(stage, source=''):
+    """``with timed('inference', 'image'): ...``"""
+    return STAGE_SECONDS.time(stage=stage, source=source)
+
+
+# ========================
+# Exposition
+# ========================
+def snapshot():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {m.name: m.snapshot() for m in metrics}
+
+
+def _write_snapshot(folder):
+    path = os.path.join(folder, f"{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def start_exporter(folder=METRICS_DIR, interval=EXPORT_INTERVAL):
+    """Periodically share this process's metrics through ``folder`` (no-op if unset)"""
+    if not folder:
+        return None
+    os.makedirs(folder, exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                _write_snapshot(folder)
+            except OSError:
+                pass
+
+    atexit.register(_write_snapshot, folder)
+    thread = threading.Thread(target=run, name='metrics-exporter', daemon=True)
+    thread.start()
+    return thread
+
+
+def render(folder=METRICS_DIR):
+    """All metrics in the Prometheus text format"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    own = str(os.getpid())
+    merged = {m.name: {own: m.snapshot()} if m.kind == 'gauge' else m.snapshot() for m in metrics}
+
+    if folder and os.path.isdir(folder):
+        now = time.time()
+        for filename in os.listdir(folder):
+            pid = filename[:-len('.json')]
+            if not filename.endswith('.json') or pid == own:
+                continue
+            path = os.path.join(folder, filename)
+            try:
+                live = now - os.path.getmtime(path) <= GAUGE_MAX_AGE
+                with open(path) as f:
+                    other = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for m in metrics:
+                if m.name not in other:
+                    continue
+                if m.kind != 'gauge':
+                    m.merge(merged[m.name], other[m.name])
+                elif live:
+                    merged[m.name][pid] = other[m.name]
+
+    out = []
+    for m in metrics:
+        out.append(f"# HELP {m.name} {m.documentation}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        out.extend(m.lines(merged[m.name]))
+    return '\n'.join(out) + '\n'
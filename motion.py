@@ -0,0 +1,90 @@
+"""Skip inference on sampled frames that show nothing new
+
+Stopped at a light, a dashcam records the same scene for a minute and every
+sampled frame of it goes through the model for the same boxes. ``MotionGate``
+compares a small blurred greyscale thumbnail of each sampled frame with the
+one of the last frame that was analysed, and lets a frame through only when
+the share of thumbnail pixels that changed by more than ``PIXEL_DELTA`` grey
+levels exceeds ``skip_threshold``. Counting changed pixels rather than
+averaging the difference keeps sensor noise out while a pothole moving
+through one corner of the view still counts. At most ``max_skipped``
+frames in a row are skipped, so a long stop is still re-checked now and
+then.
+
+With ``dense_threshold`` set, high motion between consecutive sampled frames
+also shortens the sampling interval by ``dense_factor`` until it calms down,
+so fast stretches are covered more densely; the regular samples are still
+all taken, the extra ones fall in between.
+"""
+import cv2
+import numpy as np
+
+THUMBNAIL_SIZE = (96, 54)
+PIXEL_DELTA = 12
+
+
+def thumbnail(frame, size=THUMBNAIL_SIZE):
+    small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    # Blur away compression noise and sensor grain
+    return cv2.GaussianBlur(small, (3, 3), 0).astype(np.int16)
+
+
+def difference(a, b):
+    """Share of thumbnail pixels that changed, 0..1"""
+    return float(np.count_nonzero(np.abs(a - b) > PIXEL_DELTA)) / a.size
+
+
+class MotionGate:
+    def __init__(self, skip_threshold=0.01, max_skipped=20, dense_threshold=0.0, dense_factor=2):
+        self.skip_threshold = skip_threshold
+        self.max_skipped = max_skipped
+        self.dense_threshold = dense_threshold
+        self.dense_factor = max(1, dense_factor)
+        self.motion = 0.0
+        self._previous = None
+        self._analysed = None
+        self._last_analysed_frame = None
+        self._skipped_in_a_row = 0
+        self.checked = 0
+        self.skipped = 0
+        self.densified = 0
+        self.max_gap_frames = 0
+
+    def check(self, frame_number, frame):
+        """True if ``frame`` should be analysed"""
+        current = thumbnail(frame)
+        self.motion = difference(current, self._previous) if self._previous is not None else 0.0
+        self._previous = current
+        self.checked += 1
+
+        if self._analysed is not None and self._skipped_in_a_row < self.max_skipped \
+                and difference(current, self._analysed) <= self.skip_threshold:
+            self._skipped_in_a_row += 1
+            self.skipped += 1
+            return False
+
+        if self._last_analysed_frame is not None:
+            self.max_gap_frames = max(self.max_gap_frames, frame_number - self._last_analysed_frame)
+        self._analysed = current
+        self._last_analysed_frame = frame_number
+        self._skipped_in_a_row = 0
+        return True
+
+    def interval(self, frame_interval):
+        """Frames until the next sample, given the configured ``frame_interval``"""
+        if self.dense_threshold and self.motion > self.dense_threshold and frame_interval > 1:
+            self.densified += 1
+            return max(1, frame_interval // self.dense_factor)
+        return frame_interval
+
+    def as_dict(self):
+        return {
+            'checked': self.checked,
+            'analysed': self.checked - self.skipped,
+            'skipped': self.skipped,
+            'skipped_fraction': round(self.skipped / self.checked, 4) if self.checked else 0.0,
+            'densified': self.densified,
+            'max_gap_frames': self.max_gap_frames,
+        }
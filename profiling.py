@@ -0,0 +1,89 @@
+"""Opt-in sampling profiler for slow requests
+
+While a request runs, one background thread samples the request thread's
+Python stack every ``interval`` seconds. If the request turns out slower than
+the threshold, the samples are written as collapsed stacks
+("frame;frame;frame count" lines, the input format of flamegraph.pl and
+speedscope) to the profile folder; fast requests are simply discarded. The
+cost is a stack walk per active request per interval, so it can stay on under
+production load.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class SamplingProfiler:
+    def __init__(self, folder, threshold_seconds, interval=0.005):
+        self.folder = folder
+        self.threshold_seconds = threshold_seconds
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        os.makedirs(folder, exist_ok=True)
+
+    def start(self, ident=None):
+        """Begin sampling thread ``ident`` (default: the calling thread)"""
+        ident = ident or threading.get_ident()
+        with self._lock:
+            self._active[ident] = (time.perf_counter(), Counter())
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self, label, ident=None):
+        """Stop sampling; returns the dump path if the run was slow enough to keep"""
+        ident = ident or threading.get_ident()
+        with self._lock:
+            entry = self._active.pop(ident, None)
+        if entry is None:
+            return None
+        started, samples = entry
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold_seconds or not samples:
+            return None
+        return self._dump(label, elapsed, samples)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                idents = list(self._active)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                stack = _collapse(frame)
+                with self._lock:
+                    entry = self._active.get(ident)
+                    if entry is not None:
+                        entry[1][stack] += 1
+
+    def _dump(self, label, elapsed, samples):
+        safe_label = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in label)[:80]
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        path = os.path.join(self.folder, f"{stamp}_{safe_label}_{int(elapsed * 1000)}ms.folded")
+        with open(path, 'w') as f:
+            f.write(f"# {label} took {elapsed * 1000:.1f} ms, {sum(samples.values())} samples "
+                    f"every {self.interval * 1000:g} ms\n")
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
@@ -0,0 +1,138 @@
+"""Content-addressed cache of image detection results
+
+Keyed on a hash of the uploaded image bytes plus the model version and
+confidence threshold, so re-uploading the same photo (or the camera sending an
+identical frame) returns the stored boxes and annotated image without running
+the model again. Annotated images written by the cache are evicted
+least-recently-used first once together they exceed ``max_bytes``. Entries and
+hit/miss counters are kept in SQLite so every worker process shares them.
+"""
+import hashlib
+import json
+import os
+
+import thumbnails
+from db import get_connection, transaction
+
+
+class ResultCache:
+    def __init__(self, db_path, folder, max_bytes=512 * 1024 * 1024):
+        self.db_path = db_path
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def init_tables(self):
+        with transaction(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    key TEXT PRIMARY KEY,
+                    result_path TEXT NOT NULL,
+                    boxes TEXT NOT NULL,
+                    pothole_count INTEGER NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_result_cache_last_used ON result_cache (last_used)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS result_cache_stats (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    hits INTEGER DEFAULT 0,
+                    misses INTEGER DEFAULT 0,
+                    evictions INTEGER DEFAULT 0
+                )
+            ''')
+            conn.execute('INSERT OR IGNORE INTO result_cache_stats (id) VALUES (1)')
+
+    @staticmethod
+    def make_key(image_bytes, model_version, conf):
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return hashlib.sha256(f"{digest}|{model_version}|{conf}".encode()).hexdigest()
+
+    def _count(self, conn, column, n=1):
+        conn.execute(f'UPDATE result_cache_stats SET {column} = {column} + ? WHERE id = 1', (n,))
+
+    def get(self, key):
+        """Cached ``{'result_path', 'boxes', 'pothole_count'}`` or None"""
+        with transaction(self.db_path) as conn:
+            row = conn.execute('SELECT * FROM result_cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and not os.path.exists(row['result_path']):
+                # Artifact removed behind our back; treat as a miss
+                conn.execute('DELETE FROM result_cache WHERE key = ?', (key,))
+                row = None
+            if row is None:
+                self._count(conn, 'misses')
+                return None
+            conn.execute('UPDATE result_cache SET last_used = CURRENT_TIMESTAMP WHERE key = ?', (key,))
+            self._count(conn, 'hits')
+        return {
+            'result_path': row['result_path'],
+            'boxes': json.loads(row['boxes']),
+            'pothole_count': row['pothole_count'],
+        }
+
+    def path_for(self, key):
+        return os.path.join(self.folder, f"detected_{key[:32]}.jpg")
+
+    def put(self, key, annotated_image, boxes):
+        """Write the annotated image and record it; returns its path
+
+        ``boxes`` is a list of ``[x1, y1, x2, y2, conf, cls]``.
+        """
+        import cv2
+
+        result_path = self.path_for(key)
+        cv2.imwrite(result_path, annotated_image)
+        thumbnails.write_variants(result_path, annotated_image)
+        self.record(key, boxes)
+        return result_path
+
+    def record(self, key, boxes):
+        """Record an annotated image already written to ``path_for(key)``"""
+        result_path = self.path_for(key)
+        size = os.path.getsize(result_path)
+        with transaction(self.db_path) as conn:
+            conn.execute('''INSERT OR REPLACE INTO result_cache
+                            (key, result_path, boxes, pothole_count, size_bytes)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         (key, result_path, json.dumps(boxes), len(boxes), size))
+            self._evict(conn, keep=key)
+
+    def _evict(self, conn, keep=None):
+        total = conn.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM result_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        # Never evict the entry we were just asked to store
+        for row in conn.execute('SELECT key, result_path, size_bytes FROM result_cache WHERE key != ? '
+                                'ORDER BY last_used, created_at', (keep,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(row['result_path'])
+            except FileNotFoundError:
+                pass
+            thumbnails.remove_variants(row['result_path'])
+            conn.execute('UPDATE detections SET result_path = NULL WHERE result_path = ?', (row['result_path'],))
+            conn.execute('DELETE FROM result_cache WHERE key = ?', (row['key'],))
+            total -= row['size_bytes']
+            evicted += 1
+        self._count(conn, 'evictions', evicted)
+
+    def stats(self):
+        conn = get_connection(self.db_path)
+        counters = conn.execute('SELECT hits, misses, evictions FROM result_cache_stats WHERE id = 1').fetchone()
+        entries, size = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM result_cache').fetchone()
+        lookups = counters['hits'] + counters['misses']
+        return {
+            'hits': counters['hits'],
+            'misses': counters['misses'],
+            'hit_rate': round(counters['hits'] / lookups, 4) if lookups else 0.0,
+            'evictions': counters['evictions'],
+            'entries': entries,
+            'size_bytes': size,
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,388 @@
+"""Naming, retention and disk quota for uploaded and generated files
+
+Uploads, raw videos and annotated frames used to be kept forever under
+timestamp names that collide when two requests land in the same second.
+
+Naming: uploaded images and videos are stored content-addressed, under the
+SHA-256 of their bytes (``store_bytes`` / ``store_stream``), so identical
+uploads share one file; everything else that needs a fresh name gets a
+random suffix from ``unique_name``.
+
+Lifecycle: ``StorageManager.sweep`` walks each storage class (raw videos,
+uploaded images, batch archives, annotated results) and deletes
+
+  - files nothing in the database refers to, once older than ``grace``
+    (leftovers of crashed requests, temporary files);
+  - referenced files older than their class's ``retain_days`` (0 = as soon
+    as processing is done, negative = keep);
+  - the oldest remaining files, while all classes together exceed the
+    quota.
+
+Nothing younger than ``grace`` is deleted, whatever its class or the quota:
+an upload is written (or an identical file claimed, which refreshes its
+mtime) before the job that refers to it is committed, and must survive a
+sweep that runs in between.
+
+Files of queued or running jobs, unfinished chunked uploads and batches not
+yet done are never touched. Nullable columns that pointed at a deleted file
+(``detections.file_path``/``result_path``, ``detection_frames.result_path``,
+``batch_files.result_path``) are set to NULL in the same pass, so rows never
+point at missing files; thumbnails go with their image. The result cache
+folder manages its own size and is left alone.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import thumbnails
+from db import DB_PATH, get_connection, transaction
+
+# (table, column, nullable): every column that stores a managed path
+REFERENCES = (
+    ('detections', 'file_path', True),
+    ('detections', 'result_path', True),
+    ('detection_frames', 'result_path', True),
+    ('batch_files', 'result_path', True),
+    ('jobs', 'file_path', False),
+    ('uploads', 'file_path', False),
+    ('batches', 'source', False),
+)
+# Rows whose files are still being worked on
+ACTIVE_QUERIES = (
+    ('jobs', "SELECT file_path FROM jobs WHERE status IN ('queued', 'running')"),
+    ('uploads', "SELECT file_path FROM uploads WHERE received < size"),
+    ('batches', "SELECT source FROM batches WHERE status != 'done'"),
+)
+CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+# ========================
+# Naming
+# ========================
+def unique_name(filename=None):
+    """``<timestamp>_<random>[_<filename>]``, unique even within one second"""
+    prefix = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    return f"{prefix}_{filename}" if filename else prefix
+
+
+def content_path(folder, digest, ext):
+    return os.path.join(folder, digest[:2], f"{digest[:32]}{ext}")
+
+
+def bytes_path(folder, data, ext):
+    """Where ``data`` is (or would be) stored in the content-addressed ``folder``"""
+    return content_path(folder, hashlib.sha256(data).hexdigest(), ext)
+
+
+def claim(path):
+    """True if ``path`` already exists; its mtime is refreshed so a sweep in progress sees it as new"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def store_bytes(folder, data, ext):
+    """Path of ``data`` in the content-addressed ``folder``, writing it if new"""
+    path = bytes_path(folder, data, ext)
+    if claim(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{threading.get_ident()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def store_stream(folder, stream, ext):
+    """Like ``store_bytes`` for a file object, hashed while it is copied to disk"""
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        path = content_path(folder, digest.hexdigest(), ext)
+        if claim(path):
+            os.remove(tmp_path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ========================
+# Lifecycle
+# ========================
+class StorageClass:
+    def __init__(self, name, folders, retain_days=-1):
+        self.name = name
+        self.folders = [folders] if isinstance(folders, str) else list(folders)
+        self.retain_days = retain_days
+
+    def files(self):
+        """``(path, size, mtime)`` of every file except thumbnails"""
+        for folder in self.folders:
+            for root, dirs, names in os.walk(folder):
+                dirs[:] = [d for d in dirs if d != 'thumbs']
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+
+class StorageManager:
+    def __init__(self, classes, quota_bytes=0, grace=86400.0, db_path=DB_PATH):
+        self.classes = list(classes)
+        self.quota_bytes = quota_bytes
+        self.grace = grace
+        self.db_path = db_path
+        self.last_report = None
+        self._reported_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._report_thread = None
+        self._report_lock = threading.Lock()
+
+    # ---------- database ----------
+    def _tables(self, conn):
+        return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def _references(self):
+        """abspath -> stored values, and the set of abspaths still being worked on"""
+        conn = get_connection(self.db_path)
+        tables = self._tables(conn)
+        referenced = {}
+        for table, column, _ in REFERENCES:
+            if table in tables:
+                for (value,) in conn.execute(f'SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL'):
+                    referenced.setdefault(os.path.abspath(value), set()).add(value)
+        active = set()
+        for table, query in ACTIVE_QUERIES:
+            if table in tables:
+                active.update(os.path.abspath(value) for (value,) in conn.execute(query) if value)
+        return referenced, active
+
+    def _clear_references(self, stored_values):
+        stored_values = list(stored_values)
+        if not stored_values:
+            return
+        with transaction(self.db_path) as conn:
+            tables = self._tables(conn)
+            for table, column, nullable in REFERENCES:
+                if not nullable or table not in tables:
+                    continue
+                for i in range(0, len(stored_values), 500):
+                    chunk = stored_values[i:i + 500]
+                    conn.execute(f'UPDATE {table} SET {column} = NULL WHERE {column} IN '
+                                 f'({",".join("?" * len(chunk))})', chunk)
+
+    # ---------- sweeping ----------
+    def _delete(self, path, min_age, now, dry_run):
+        # Re-check the age: the file may have been claimed by a new upload since it was listed
+        try:
+            if now - os.stat(path).st_mtime < min_age:
+                return False
+            if not dry_run:
+                os.remove(path)
+                thumbnails.remove_variants(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _compact(self, storage_class, now):
+        """Drop thumbnails whose image is gone and empty folders"""
+        for folder in storage_class.folders:
+            for root, dirs, names in os.walk(folder, topdown=False):
+                if os.path.basename(root) == 'thumbs':
+                    parent = os.path.dirname(root)
+                    stems = {os.path.splitext(n)[0] for n in os.listdir(parent)
+                             if os.path.isfile(os.path.join(parent, n))}
+                    for name in names:
+                        path = os.path.join(root, name)
+                        try:
+                            old = now - os.stat(path).st_mtime > self.grace
+                        except FileNotFoundError:
+                            continue
+                        # <stem>.<size>.<fmt>
+                        if old and name.rsplit('.', 2)[0] not in stems:
+                            os.remove(path)
+                if root != folder and not os.listdir(root):
+                    try:
+                        os.rmdir(root)
+                    except OSError:
+                        pass
+
+    def sweep(self, dry_run=False):
+        """Apply retention and quota once; returns a per-class report"""
+        with self._lock:
+            start = time.perf_counter()
+            now = time.time()
+            referenced, active = self._references()
+            report = {c.name: {'files': 0, 'bytes': 0, 'deleted': 0, 'freed_bytes': 0} for c in self.classes}
+            deleted_values = set()
+            remaining = []  # (mtime, path, size, class name) of files kept so far
+
+            def delete(path, size, name, min_age):
+                if self._delete(path, min_age, now, dry_run):
+                    report[name]['deleted'] += 1
+                    report[name]['freed_bytes'] += size
+                    deleted_values.update(referenced.get(os.path.abspath(path), ()))
+                    return True
+                return False
+
+            for storage_class in self.classes:
+                name = storage_class.name
+                for path, size, mtime in storage_class.files():
+                    key = os.path.abspath(path)
+                    age = now - mtime
+                    if key not in active:
+                        if key not in referenced:
+                            if age > self.grace and delete(path, size, name, self.grace):
+                                continue
+                        elif storage_class.retain_days >= 0 and age > max(storage_class.retain_days * 86400,
+                                                                          self.grace):
+                            if delete(path, size, name, max(storage_class.retain_days * 86400, self.grace)):
+                                continue
+                    report[name]['files'] += 1
+                    report[name]['bytes'] += size
+                    if key not in active:
+                        remaining.append((mtime, path, size, name))
+
+            total = sum(r['bytes'] for r in report.values())
+            if self.quota_bytes and total > self.quota_bytes:
+                for mtime, path, size, name in sorted(remaining):
+                    if total <= self.quota_bytes:
+                        break
+                    if now - mtime > self.grace and delete(path, size, name, self.grace):
+                        report[name]['files'] -= 1
+                        report[name]['bytes'] -= size
+                        total -= size
+
+            if not dry_run:
+                self._clear_references(deleted_values)
+                for storage_class in self.classes:
+                    self._compact(storage_class, now)
+
+            deleted = sum(r['deleted'] for r in report.values())
+            self.last_report = {
+                'classes': report,
+                'total_bytes': total,
+                'quota_bytes': self.quota_bytes,
+                'dry_run': dry_run,
+                'swept_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'seconds': round(time.perf_counter() - start, 3),
+            }
+            self._reported_at = time.monotonic()
+        if deleted:
+            logger.info(f"🧹 Storage sweep removed {deleted} files "
+                        f"({sum(r['freed_bytes'] for r in report.values()) / 1e6:.1f} MB)")
+        return self.last_report
+
+    def request_report(self, max_age):
+        """The last report, refreshed by a background dry run once older than ``max_age`` seconds
+
+        Returns None until the first sweep has finished. Never sweeps in the
+        caller's thread, and runs at most one refresh at a time.
+        """
+        with self._report_lock:
+            stale = self._reported_at is None or time.monotonic() - self._reported_at > max_age
+            if stale and (self._report_thread is None or not self._report_thread.is_alive()):
+                self._report_thread = threading.Thread(target=self._refresh_report, name='storage-report',
+                                                       daemon=True)
+                self._report_thread.start()
+        return self.last_report
+
+    def _refresh_report(self):
+        try:
+            self.sweep(dry_run=True)
+        except Exception:
+            logger.exception("Storage report failed")
+
+    def usage(self):
+        """``{class: bytes}`` as of the last sweep"""
+        report = self.last_report
+        if report is None:
+            return {}
+        return {name: r['bytes'] for name, r in report['classes'].items()}
+
+    # ---------- background thread ----------
+    def start(self, interval=600.0):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='storage-sweeper', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Storage sweep failed")
+            self._stop.wait(interval)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def _days(name, default):
+    return float(os.getenv(name, default))
+
+
+def manager_from_env(static_folder='static', batch_folder='batches', db_path=DB_PATH):
+    """Build a manager from the STORAGE_* environment variables"""
+    classes = [
+        StorageClass('videos', os.path.join(static_folder, 'videos'), _days("STORAGE_RETAIN_VIDEOS_DAYS", 0)),
+        StorageClass('uploads', os.path.join(static_folder, 'uploads'), _days("STORAGE_RETAIN_UPLOADS_DAYS", 30)),
+        StorageClass('archives', batch_folder, _days("STORAGE_RETAIN_ARCHIVES_DAYS", 0)),
+        StorageClass('results', [os.path.join(static_folder, 'detected_frames'),
+                                 os.path.join(static_folder, 'results', 'batches')],
+                     _days("STORAGE_RETAIN_RESULTS_DAYS", 90)),
+    ]
+    return StorageManager(classes,
+                          quota_bytes=int(float(os.getenv("STORAGE_QUOTA_MB", 0)) * 1024 * 1024),
+                          grace=float(os.getenv("STORAGE_GRACE_SECONDS", 86400)),
+                          db_path=db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the STORAGE_* retention policies and quota once")
+    parser.add_argument('--dry-run', action='store_true', help="report what would be deleted")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    report = manager_from_env().sweep(dry_run=args.dry_run)
+    print(f"{'class':<10} {'files':>7} {'MB':>9} {'deleted':>8} {'freed MB':>9}")
+    for name, r in report['classes'].items():
+        print(f"{name:<10} {r['files']:>7} {r['bytes'] / 1e6:>9.1f} {r['deleted']:>8} {r['freed_bytes'] / 1e6:>9.1f}")
+    if args.dry_run:
+        print("(dry run: nothing was deleted)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
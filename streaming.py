@@ -0,0 +1,241 @@
+"""Live camera streaming detection
+
+A vehicle-mounted camera posts a continuous stream of JPEG frames to a
+``StreamSession``. Frames are decoded and run through the model in memory,
+never touching the filesystem, and every result is pushed to the session's
+subscribers (Server-Sent Events, the MJPEG preview or a WebSocket).
+
+Latency stays bounded by keeping only the newest unprocessed frame: when a
+frame arrives before the previous one was picked up by the inference thread,
+the older one is dropped. The session also tells the sender what frame rate
+inference is currently keeping up with, so well-behaved clients can slow down
+instead of having frames dropped.
+
+Sessions live in the memory of the process that created them, so a
+deployment with several web processes needs sticky routing per stream.
+"""
+import logging
+import os
+import queue
+import statistics
+import threading
+import time
+import uuid
+from collections import deque
+
+import metrics
+
+# Close a session that has received no frames for this long
+STREAM_IDLE_SECONDS = int(os.getenv("STREAM_IDLE_SECONDS", 60))
+# How many recent frames the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def percentiles(samples):
+    """p50/p90/p99 (in ms) of a sequence of durations in seconds"""
+    if not samples:
+        return {'p50_ms': None, 'p90_ms': None, 'p99_ms': None}
+    samples = sorted(samples)
+    last = len(samples) - 1
+    return {
+        'p50_ms': round(1000 * statistics.median(samples), 2),
+        'p90_ms': round(1000 * samples[int(0.90 * last)], 2),
+        'p99_ms': round(1000 * samples[int(0.99 * last)], 2),
+    }
+
+
+class StreamSession:
+    def __init__(self, stream_id, user_id, model, conf=0.25, idle_seconds=STREAM_IDLE_SECONDS):
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.model = model
+        self.conf = conf
+        self.idle_seconds = idle_seconds
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.last_jpeg = None
+        self.closed = False
+        self._slot = None
+        self._cond = threading.Condition()
+        self._subscribers = []
+        self._mjpeg_viewers = 0
+        self._last_frame_at = time.monotonic()
+        self._infer_ewma = None
+        self._latency = {name: deque(maxlen=LATENCY_WINDOW) for name in ('queue', 'infer', 'end_to_end')}
+        self._thread = threading.Thread(target=self._run, name=f'stream-{stream_id[:8]}', daemon=True)
+        self._thread.start()
+
+    # ---- producer side ----
+    def submit(self, jpeg_bytes):
+        """Offer one encoded frame; returns flow-control hints for the sender"""
+        with self._cond:
+            if self.closed:
+                raise RuntimeError("Stream is closed")
+            self.received += 1
+            if self._slot is not None:
+                # Inference is behind: the newer frame replaces the waiting one
+                self.dropped += 1
+            self._slot = (self.received, jpeg_bytes, time.perf_counter())
+            self._last_frame_at = time.monotonic()
+            self._cond.notify()
+        return {'seq': self.received, 'dropped': self.dropped, 'target_fps': self.target_fps()}
+
+    def target_fps(self):
+        """Frame rate the inference thread is currently sustaining"""
+        if not self._infer_ewma:
+            return None
+        return round(1.0 / self._infer_ewma, 1)
+
+    # ---- consumer side ----
+    def subscribe(self, maxsize=32):
+        q = queue.Queue(maxsize=maxsize)
+        with self._cond:
+            self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._cond:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    def mjpeg_frames(self, poll_interval=0.05):
+        """Yield each new annotated JPEG until the session closes"""
+        with self._cond:
+            self._mjpeg_viewers += 1
+        try:
+            last = None
+            while not self.closed:
+                jpeg = self.last_jpeg
+                if jpeg is not None and jpeg is not last:
+                    last = jpeg
+                    yield jpeg
+                time.sleep(poll_interval)
+        finally:
+            with self._cond:
+                self._mjpeg_viewers -= 1
+
+    def _publish(self, event):
+        with self._cond:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Slow reader: make room for the freshest result
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait(event)
+
+    # ---- inference thread ----
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._slot is None and not self.closed:
+                    if time.monotonic() - self._last_frame_at > self.idle_seconds:
+                        logger.info(f"Closing idle stream {self.stream_id}")
+                        self.closed = True
+                        break
+                    self._cond.wait(timeout=1.0)
+                if self.closed:
+                    break
+                seq, jpeg_bytes, received_at = self._slot
+                self._slot = None
+                want_preview = self._mjpeg_viewers > 0
+            try:
+                self._process(seq, jpeg_bytes, received_at, want_preview)
+            except Exception as e:
+                logger.exception(f"Stream {self.stream_id} frame {seq} failed: {e}")
+                self._publish({'seq': seq, 'error': str(e)})
+        self._publish(None)
+        _forget(self.stream_id)
+
+    def _process(self, seq, jpeg_bytes, received_at, want_preview):
+        import cv2
+        import numpy as np
+
+        picked_at = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Frame is not a decodable image")
+        metrics.observe_stage('decode', time.perf_counter() - picked_at, 'stream')
+        # The app's model serializes predict across sessions, uploads and jobs
+        start = time.perf_counter()
+        result = self.model.predict(source=frame, conf=self.conf, save=False, verbose=False)[0]
+        infer = time.perf_counter() - start
+        metrics.observe_stage('infer', infer, 'stream')
+        boxes = result.boxes
+        box_rows = [[round(v, 1) for v in xyxy] + [round(c, 3)]
+                    for xyxy, c in zip(boxes.xyxy.tolist(), boxes.conf.tolist())]
+        if want_preview:
+            ok, encoded = cv2.imencode('.jpg', result.plot(), [cv2.IMWRITE_JPEG_QUALITY, 80])
+            if ok:
+                self.last_jpeg = encoded.tobytes()
+
+        done = time.perf_counter()
+        self.processed += 1
+        self._latency['queue'].append(picked_at - received_at)
+        self._latency['infer'].append(infer)
+        self._latency['end_to_end'].append(done - received_at)
+        # Whole per-frame cost (decode + inference + plotting) drives the rate hint
+        cost = done - picked_at
+        self._infer_ewma = cost if self._infer_ewma is None else 0.8 * self._infer_ewma + 0.2 * cost
+        self._publish({
+            'seq': seq,
+            'pothole_count': len(box_rows),
+            'boxes': box_rows,
+            'latency_ms': round(1000 * (done - received_at), 2),
+            'target_fps': self.target_fps(),
+        })
+
+    def stats(self):
+        return {
+            'stream_id': self.stream_id,
+            'received': self.received,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'target_fps': self.target_fps(),
+            'latency': {name: percentiles(list(samples)) for name, samples in self._latency.items()},
+        }
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def create_session(user_id, model, conf=0.25):
+    stream_id = uuid.uuid4().hex
+    session = StreamSession(stream_id, user_id, model, conf)
+    with _sessions_lock:
+        _sessions[stream_id] = session
+    return session
+
+
+def get_session(stream_id):
+    with _sessions_lock:
+        return _sessions.get(stream_id)
+
+
+def _forget(stream_id):
+    with _sessions_lock:
+        _sessions.pop(stream_id, None)
+
+
+def session_count():
+    with _sessions_lock:
+        return len(_sessions)
+
+
+def close_session(stream_id):
+    session = get_session(stream_id)
+    if session is not None:
+        session.close()
+    return session
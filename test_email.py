@@ -13,6 +13,9 @@ def test_email_connection():
     sender = os.getenv("NOTIFY_SENDER_EMAIL")
     app_password = os.getenv("NOTIFY_APP_PASSWORD")
     recipient = os.getenv("NOTIFY_RECIPIENT")
+    smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
+    smtp_port = int(os.getenv("SMTP_PORT", 587))
+    starttls = os.getenv("SMTP_STARTTLS", "1") == "1"
     
     print("=" * 60)
     print("TESTING EMAIL CONFIGURATION")
@@ -48,13 +51,13 @@ def test_email_connection():
         Configuration Details:
         - Sender: {}
         - Recipient: {}
-        - SMTP Server: smtp.gmail.com:587
+        - SMTP Server: {}:{}
         
         Next Step: Upload an image with potholes to test automatic alerts.
         
         ---
         Automated Pothole Detection System
-        """.format(sender, recipient)
+        """.format(sender, recipient, smtp_host, smtp_port)
         
         msg.attach(MIMEText(body, 'plain'))
         
@@ -71,10 +74,11 @@ def test_email_connection():
                     msg.attach(image)
         
         # Connect and send
-        print("🔌 Connecting to Gmail SMTP server...")
-        with smtplib.SMTP("smtp.gmail.com", 587, timeout=10) as server:
-            print("🔐 Starting TLS encryption...")
-            server.starttls()
+        print(f"🔌 Connecting to SMTP server {smtp_host}:{smtp_port}...")
+        with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
+            if starttls:
+                print("🔐 Starting TLS encryption...")
+                server.starttls()
             
             print("🔑 Logging in...")
             server.login(sender, app_password)
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh database with the detections schema; its connections are closed afterwards"""
+    path = str(tmp_path / 'test.db')
+    db.init_schema(path)
+    yield path
+    db.close_connections()
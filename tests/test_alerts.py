@@ -0,0 +1,181 @@
+import email
+import email.policy
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import time
+
+import pytest
+
+import db
+from alerts import AlertDispatcher
+
+controller = pytest.importorskip('aiosmtpd.controller')
+smtp_server = pytest.importorskip('aiosmtpd.smtp')
+
+PASSWORD = 'app-password'
+
+
+class Mailbox:
+    """aiosmtpd handler and authenticator recording logins and delivered messages"""
+
+    def __init__(self):
+        self.logins = 0
+        self.messages = []
+
+    def __call__(self, server, session, envelope, mechanism, auth_data):
+        ok = isinstance(auth_data, smtp_server.LoginPassword) and auth_data.password == PASSWORD.encode()
+        self.logins += ok
+        return smtp_server.AuthResult(success=ok, handled=False)
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(email.message_from_bytes(envelope.content, policy=email.policy.default))
+        return '250 OK'
+
+
+@pytest.fixture(scope='module')
+def tls_context(tmp_path_factory):
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl is needed to make a certificate for STARTTLS')
+    folder = tmp_path_factory.mktemp('tls')
+    cert, key = str(folder / 'cert.pem'), str(folder / 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-keyout', key, '-out', cert], check=True, capture_output=True)
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+@pytest.fixture
+def server(tls_context):
+    """A local STARTTLS + AUTH SMTP server; ``server.restart()`` drops every connection"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    mailbox = Mailbox()
+
+    def start():
+        running = controller.Controller(mailbox, hostname='127.0.0.1', port=port, tls_context=tls_context,
+                                        require_starttls=True, authenticator=mailbox)
+        running.start()
+        return running
+
+    class Server:
+        def stop(self):
+            self.controller.stop()
+
+        def start(self):
+            self.controller = start()
+
+        def restart(self):
+            self.stop()
+            self.start()
+
+    running = Server()
+    running.port, running.mailbox = port, mailbox
+    running.start()
+    yield running
+    running.stop()
+
+
+def dispatcher_for(server, db_path, **kwargs):
+    options = dict(host='127.0.0.1', port=server.port, window=0, backoff=0.05, timeout=5, db_path=db_path)
+    options.update(kwargs)
+    return AlertDispatcher('sender@example.com', options.pop('password', PASSWORD), 'roads@example.com', **options)
+
+
+def detection(db_path, location):
+    return db.insert_detection(1, 'image', location, 'in.jpg', None, 2, db_path=db_path)
+
+
+def alert(location, count=2):
+    return {'images': [], 'location': location, 'count': count, 'timestamp': '2025-01-01 12:00:00'}
+
+
+def alert_sent(db_path, detection_id):
+    return bool(db.get_detection(detection_id, db_path)['alert_sent'])
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_alerts_for_one_location_are_coalesced(server, db_path):
+    dispatcher = dispatcher_for(server, db_path, window=60)
+    ids = [detection(db_path, 'Main St') for _ in range(3)] + [detection(db_path, 'Side St')]
+    for detection_id in ids[:3]:
+        dispatcher.submit(alert('Main St'), detection_id)
+    dispatcher.submit(alert('Side St', count=1), ids[3])
+    assert dispatcher.pending_count() == 4
+    assert not any(alert_sent(db_path, i) for i in ids)
+
+    dispatcher.stop()
+    assert len(server.mailbox.messages) == 2
+    assert any(m['Subject'].endswith('Main St (3 reports)') for m in server.mailbox.messages)
+    assert all(alert_sent(db_path, i) for i in ids)
+    # Both emails went over one authenticated STARTTLS connection
+    assert server.mailbox.logins == 1 and dispatcher.sent == 4
+
+
+def test_connection_is_reused_and_reopened_after_the_server_drops_it(server, db_path):
+    dispatcher = dispatcher_for(server, db_path)
+    first, second, third = (detection(db_path, location) for location in ('A', 'B', 'C'))
+    dispatcher.submit(alert('A'), first)
+    assert wait_for(lambda: alert_sent(db_path, first))
+    dispatcher.submit(alert('B'), second)
+    assert wait_for(lambda: alert_sent(db_path, second))
+    assert server.mailbox.logins == 1
+
+    server.restart()
+    dispatcher.submit(alert('C'), third)
+    assert wait_for(lambda: alert_sent(db_path, third))
+    dispatcher.stop()
+    assert len(server.mailbox.messages) == 3
+    assert server.mailbox.logins == 2
+
+
+def test_failed_delivery_is_retried(server, db_path):
+    server.stop()
+    dispatcher = dispatcher_for(server, db_path)
+    detection_id = detection(db_path, 'Main St')
+    dispatcher.submit(alert('Main St'), detection_id)
+    time.sleep(0.1)
+    server.start()
+    # Stopping gives up on failing batches, so let the retries run first
+    assert wait_for(lambda: alert_sent(db_path, detection_id))
+    dispatcher.stop()
+    assert len(server.mailbox.messages) == 1
+
+
+@pytest.fixture
+def dead_owner():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}"
+
+
+def test_recover_resubmits_alerts_of_dead_processes(server, db_path, dead_owner):
+    orphaned = detection(db_path, 'Main St')
+    held = detection(db_path, 'Side St')
+    db.queue_alerts([orphaned], dead_owner, db_path)
+    db.queue_alerts([held], 'elsewhere:1', db_path)
+    dispatcher = dispatcher_for(server, db_path, window=60)
+    assert dispatcher.recover() == 1
+    dispatcher.stop()
+    assert len(server.mailbox.messages) == 1
+    assert alert_sent(db_path, orphaned) and not alert_sent(db_path, held)
+
+
+def test_dropped_alerts_are_not_recovered(server, db_path):
+    dispatcher = dispatcher_for(server, db_path, password='wrong')
+    detection_id = detection(db_path, 'Main St')
+    dispatcher.submit(alert('Main St'), detection_id)
+    assert wait_for(lambda: dispatcher.failed == 1)
+    dispatcher.stop()
+    assert not alert_sent(db_path, detection_id)
+    assert db.unsent_alerts(3600, db_path) == []
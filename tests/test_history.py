@@ -0,0 +1,63 @@
+import db
+
+
+def fill(db_path, rows):
+    """Insert ``(user_id, location, pothole_count, detected_at, alert_sent)`` rows through the triggers"""
+    with db.transaction(db_path) as conn:
+        conn.executemany('''INSERT INTO detections
+                            (user_id, detection_type, location, file_path, pothole_count, detected_at, alert_sent)
+                            VALUES (?, 'image', ?, 'in.jpg', ?, ?, ?)''', rows)
+
+
+def test_keyset_pages_cover_the_history_once(db_path):
+    # Several detections share a timestamp, so pages must break ties on id
+    fill(db_path, [(1, 'L', 1, f'2025-01-{1 + i // 3:02d} 12:00:00', False) for i in range(25)])
+    fill(db_path, [(2, 'L', 1, '2025-01-05 12:00:00', False)])
+    expected = [r['id'] for r in db.get_connection(db_path).execute(
+        'SELECT id FROM detections WHERE user_id = 1 ORDER BY detected_at DESC, id DESC')]
+
+    seen, before, pages = [], None, 0
+    while True:
+        page, before = db.list_user_detections(1, before=before, limit=4, db_path=db_path)
+        seen += [d['id'] for d in page]
+        pages += 1
+        if before is None:
+            break
+    assert seen == expected
+    assert pages == 7
+
+
+def test_paging_survives_a_deleted_cursor_row(db_path):
+    fill(db_path, [(1, 'L', 1, f'2025-01-{1 + i:02d} 12:00:00', False) for i in range(6)])
+    page, before = db.list_user_detections(1, limit=3, db_path=db_path)
+    assert before == (page[-1]['detected_at'], page[-1]['id'])
+    # Retention or a storage sweep deletes the last row of the page meanwhile
+    db.get_connection(db_path).execute('DELETE FROM detections WHERE id = ?', (before[1],))
+    rest, after = db.list_user_detections(1, before=before, limit=3, db_path=db_path)
+    assert [d['detected_at'] for d in rest] == ['2025-01-03 12:00:00', '2025-01-02 12:00:00', '2025-01-01 12:00:00']
+    assert after is None
+
+
+def test_last_full_page_has_no_cursor(db_path):
+    fill(db_path, [(1, 'L', 1, '2025-01-01 12:00:00', False)] * 4)
+    page, before = db.list_user_detections(1, limit=4, db_path=db_path)
+    assert len(page) == 4 and before is None
+    assert db.list_user_detections(3, db_path=db_path) == ([], None)
+
+
+def test_rollups_follow_inserts_and_deletes(db_path):
+    fill(db_path, [
+        (1, 'Main St', 2, '2025-01-01 08:00:00', True),
+        (1, 'Main St', 3, '2025-01-01 09:00:00', False),
+        (1, 'Side St', 1, '2025-01-02 10:00:00', False),
+        (2, 'Main St', 9, '2025-01-02 10:00:00', True),
+    ])
+    assert db.user_totals(1, db_path=db_path) == {'days': 2, 'detections': 3, 'potholes': 6, 'alerts': 1}
+    assert db.user_daily_stats(1, since='2025-01-02', db_path=db_path) == [
+        {'day': '2025-01-02', 'detections': 1, 'potholes': 1, 'alerts': 0}]
+    assert [(p['location'], p['potholes']) for p in db.user_top_locations(1, db_path=db_path)] == [
+        ('Main St', 5), ('Side St', 1)]
+
+    db.get_connection(db_path).execute("DELETE FROM detections WHERE location = 'Side St'")
+    assert db.user_totals(1, db_path=db_path) == {'days': 1, 'detections': 2, 'potholes': 5, 'alerts': 1}
+    assert [p['location'] for p in db.user_top_locations(1, db_path=db_path)] == ['Main St']
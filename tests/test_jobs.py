@@ -0,0 +1,114 @@
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import db
+import jobs
+
+
+@pytest.fixture
+def jobs_db(db_path):
+    jobs.init_jobs_table(db_path)
+    return db_path
+
+
+@pytest.fixture
+def dead_worker():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}"
+
+
+def backdate(db_path, job_id, seconds):
+    db.get_connection(db_path).execute(
+        "UPDATE jobs SET updated_at = datetime('now', ?) WHERE id = ?", (f'-{seconds} seconds', job_id))
+
+
+def test_claim_takes_the_oldest_job_once(jobs_db):
+    first = jobs.enqueue_job(1, 'image', 'a.jpg', 'L', db_path=jobs_db)
+    second = jobs.enqueue_job(1, 'image', 'b.jpg', 'L', db_path=jobs_db)
+    job = jobs.claim_next_job('w1', db_path=jobs_db)
+    assert job['id'] == first and job['status'] == 'running'
+    assert job['worker'] == 'w1' and job['attempts'] == 1
+    assert jobs.claim_next_job('w2', db_path=jobs_db)['id'] == second
+    assert jobs.claim_next_job('w3', db_path=jobs_db) is None
+
+
+def test_worker_alive():
+    assert jobs.worker_alive(jobs.worker_name())
+    assert jobs.worker_alive('elsewhere:1')
+    assert jobs.worker_alive('worker-1')
+
+
+def test_requeue_leaves_live_workers_alone(jobs_db):
+    job_id = jobs.enqueue_job(1, 'video', 'v.mp4', 'L', db_path=jobs_db)
+    jobs.claim_next_job(jobs.worker_name(), db_path=jobs_db)
+    assert jobs.requeue_stale_jobs(jobs_db) == 0
+    assert jobs.get_job(job_id, jobs_db)['status'] == 'running'
+
+
+def test_requeue_takes_back_jobs_of_dead_workers(jobs_db, dead_worker):
+    job_id = jobs.enqueue_job(1, 'video', 'v.mp4', 'L', db_path=jobs_db)
+    jobs.claim_next_job(dead_worker, db_path=jobs_db)
+    assert jobs.requeue_stale_jobs(jobs_db) == 1
+    job = jobs.get_job(job_id, jobs_db)
+    assert job['status'] == 'queued' and job['worker'] is None
+
+
+def test_requeue_takes_back_jobs_with_a_stale_heartbeat(jobs_db):
+    job_id = jobs.enqueue_job(1, 'video', 'v.mp4', 'L', db_path=jobs_db)
+    jobs.claim_next_job('elsewhere:1', db_path=jobs_db)
+    backdate(jobs_db, job_id, 600)
+    # A heartbeat without progress keeps the job
+    assert jobs.update_progress(job_id, 'elsewhere:1', None, db_path=jobs_db)
+    assert jobs.requeue_stale_jobs(jobs_db, stale_seconds=120) == 0
+    backdate(jobs_db, job_id, 600)
+    assert jobs.requeue_stale_jobs(jobs_db, stale_seconds=120) == 1
+    assert jobs.get_job(job_id, jobs_db)['status'] == 'queued'
+
+
+def test_requeue_fails_jobs_out_of_attempts(jobs_db, dead_worker):
+    job_id = jobs.enqueue_job(1, 'video', 'v.mp4', 'L', db_path=jobs_db)
+    for _ in range(jobs.JOB_MAX_ATTEMPTS):
+        assert jobs.claim_next_job(dead_worker, db_path=jobs_db)['id'] == job_id
+        jobs.requeue_stale_jobs(jobs_db)
+    job = jobs.get_job(job_id, jobs_db)
+    assert job['status'] == 'failed' and job['attempts'] == jobs.JOB_MAX_ATTEMPTS
+
+
+def test_only_the_claiming_worker_records_progress_and_outcome(jobs_db, dead_worker):
+    job_id = jobs.enqueue_job(1, 'video', 'v.mp4', 'L', db_path=jobs_db)
+    jobs.claim_next_job(dead_worker, db_path=jobs_db)
+    jobs.requeue_stale_jobs(jobs_db)
+    jobs.claim_next_job('w2', db_path=jobs_db)
+    assert not jobs.update_progress(job_id, dead_worker, 0.5, db_path=jobs_db)
+    assert not jobs.finish_job(job_id, dead_worker, {}, db_path=jobs_db)
+    assert not jobs.fail_job(job_id, dead_worker, 'boom', db_path=jobs_db)
+    job = jobs.get_job(job_id, jobs_db)
+    assert job['status'] == 'running' and job['worker'] == 'w2' and job['progress'] == 0
+    assert jobs.finish_job(job_id, 'w2', {'ok': True}, db_path=jobs_db)
+    assert jobs.get_job(job_id, jobs_db)['result'] == {'ok': True}
+
+
+STOP = threading.Event()
+
+
+def taken_over_handler(job, progress):
+    """Loses the job to another worker halfway through"""
+    STOP.set()
+    progress(0.25)
+    db.get_connection(job['params']['db_path']).execute("UPDATE jobs SET worker = 'w2' WHERE id = ?", (job['id'],))
+    progress(0.5)
+    raise AssertionError('the worker should have stopped at the heartbeat')
+
+
+def test_worker_stops_a_job_claimed_by_another_worker(jobs_db):
+    job_id = jobs.enqueue_job(1, 'video', 'v.mp4', 'L', params={'db_path': jobs_db}, db_path=jobs_db)
+    STOP.clear()
+    jobs.worker_loop(f'{__name__}:taken_over_handler', 'w1', db_path=jobs_db, stop_event=STOP)
+    job = jobs.get_job(job_id, jobs_db)
+    assert job['status'] == 'running' and job['worker'] == 'w2'
+    assert job['progress'] == 0.25 and job['error'] is None
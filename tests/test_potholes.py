@@ -0,0 +1,17 @@
+import db
+
+VIEWPORT = (13.0, 52.0, 14.0, 53.0)
+
+
+def test_viewport_query_is_limited_to_the_user(db_path):
+    mine = db.insert_detection(1, 'image', 'Main St', 'a.jpg', None, 1, boxes=[(0, [1, 2, 3, 4, 0.9])],
+                               lat=52.5, lon=13.4, db_path=db_path)
+    db.insert_detection(2, 'image', 'Side St', 'b.jpg', None, 1, boxes=[(0, [5, 6, 7, 8, 0.8])],
+                        lat=52.51, lon=13.41, db_path=db_path)
+    db.insert_detection(1, 'image', 'Far away', 'c.jpg', None, 1, boxes=[(0, [1, 2, 3, 4, 0.7])],
+                        lat=48.1, lon=11.5, db_path=db_path)
+
+    assert len(db.query_potholes(*VIEWPORT, db_path=db_path)) == 2
+    potholes = db.query_potholes(*VIEWPORT, user_id=1, db_path=db_path)
+    assert [(p['detection_id'], p['location']) for p in potholes] == [(mine, 'Main St')]
+    assert db.query_potholes(*VIEWPORT, user_id=3, db_path=db_path) == []
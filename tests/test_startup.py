@@ -0,0 +1,13 @@
+import statistics
+
+from bench.startup import run_once
+
+BUDGET_MS = 1000
+RUNS = 3
+
+
+def test_app_import_stays_light_and_within_budget(tmp_path):
+    runs = [run_once(str(tmp_path)) for _ in range(RUNS)]
+    assert runs[-1]['status'] == 200
+    assert [m for r in runs for m in r['heavy_after_login']] == []
+    assert statistics.median(r['import_ms'] for r in runs) <= BUDGET_MS
@@ -0,0 +1,104 @@
+import os
+import time
+
+import pytest
+
+import db
+import jobs
+import storage
+
+DAY = 86400
+
+
+def age(path, days):
+    then = time.time() - days * DAY
+    os.utime(path, (then, then))
+
+
+@pytest.fixture
+def setup(tmp_path, db_path):
+    jobs.init_jobs_table(db_path)
+    videos = tmp_path / 'videos'
+    results = tmp_path / 'results'
+    manager = storage.StorageManager([
+        storage.StorageClass('videos', str(videos), retain_days=0),
+        storage.StorageClass('results', str(results), retain_days=30),
+    ], grace=3600, db_path=db_path)
+    return manager, videos, results, db_path
+
+
+def write(folder, name, size=10):
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / name
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def test_sweep_deletes_old_orphans_and_keeps_new_ones(setup):
+    manager, videos, _, _ = setup
+    old = write(videos, 'old.mp4')
+    new = write(videos, 'new.mp4')
+    age(old, 2)
+    report = manager.sweep()
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+    assert report['classes']['videos']['deleted'] == 1
+
+
+def test_sweep_applies_retention_and_clears_references(setup):
+    manager, _, results, db_path = setup
+    kept = write(results, 'kept.jpg')
+    expired = write(results, 'expired.jpg')
+    age(kept, 10)
+    age(expired, 31)
+    detection_id = db.insert_detection(1, 'image', 'L', 'in.jpg', expired, 1, db_path=db_path)
+    db.insert_detection(1, 'image', 'L', 'in.jpg', kept, 1, db_path=db_path)
+    manager.sweep()
+    assert os.path.exists(kept) and not os.path.exists(expired)
+    assert db.get_detection(detection_id, db_path)['result_path'] is None
+
+
+def test_fresh_upload_survives_zero_day_retention(setup):
+    # A content-addressed upload identical to an old, processed one is
+    # claimed (mtime refreshed) before its job is committed
+    manager, videos, _, db_path = setup
+    path = write(videos, 'same.mp4')
+    age(path, 5)
+    db.insert_detection(1, 'video', 'L', path, None, 0, db_path=db_path)
+    assert storage.claim(path)
+    manager.sweep()
+    assert os.path.exists(path)
+    age(path, 1)
+    manager.sweep()
+    assert not os.path.exists(path)
+
+
+def test_sweep_never_touches_files_of_active_jobs(setup):
+    manager, videos, _, db_path = setup
+    path = write(videos, 'queued.mp4')
+    age(path, 5)
+    jobs.enqueue_job(1, 'video', path, 'L', db_path=db_path)
+    manager.quota_bytes = 1
+    manager.sweep()
+    assert os.path.exists(path)
+
+
+def test_quota_deletes_oldest_first(setup):
+    manager, _, results, db_path = setup
+    paths = [write(results, f'{i}.jpg', size=100) for i in range(3)]
+    for i, path in enumerate(paths):
+        age(path, 5 - i)
+        db.insert_detection(1, 'image', 'L', 'in.jpg', path, 1, db_path=db_path)
+    manager.quota_bytes = 250
+    report = manager.sweep()
+    assert [os.path.exists(p) for p in paths] == [False, True, True]
+    assert report['total_bytes'] == 200
+
+
+def test_dry_run_deletes_nothing(setup):
+    manager, videos, _, _ = setup
+    path = write(videos, 'orphan.mp4')
+    age(path, 2)
+    report = manager.sweep(dry_run=True)
+    assert os.path.exists(path)
+    assert report['dry_run'] and report['classes']['videos']['deleted'] == 1
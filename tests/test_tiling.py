@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from tiling import AdaptivePredictor, merge_boxes, pick_imgsz, plan_tiles
+
+
+def test_pick_imgsz_is_stride_aligned_and_bounded():
+    assert pick_imgsz((100, 200)) == 320
+    assert pick_imgsz((480, 500)) == 512
+    assert pick_imgsz((1080, 1920)) == 640
+    assert pick_imgsz((1080, 1920), max_imgsz=1280) == 1280
+
+
+@pytest.mark.parametrize('shape', [(600, 500), (480, 640), (2000, 3000), (641, 641), (37, 1500)])
+def test_plan_tiles_covers_the_image(shape):
+    tile = 640
+    windows = plan_tiles(shape, tile, overlap=0.2)
+    covered = np.zeros(shape, dtype=bool)
+    for x1, y1, x2, y2 in windows:
+        assert 0 <= x1 < x2 <= shape[1] and 0 <= y1 < y2 <= shape[0]
+        assert x2 - x1 <= tile and y2 - y1 <= tile
+        covered[y1:y2, x1:x2] = True
+    assert covered.all()
+
+
+def test_plan_tiles_overlaps_neighbours():
+    windows = plan_tiles((640, 2000), 640, overlap=0.25)
+    starts = sorted(x1 for x1, _, _, _ in windows)
+    assert starts[0] == 0 and windows[-1][2] == 2000
+    for (_, _, prev_end, _), (start, _, _, _) in zip(sorted(windows), sorted(windows)[1:]):
+        assert prev_end - start >= 160
+
+
+def test_merge_boxes_drops_cross_tile_duplicates():
+    xyxy = np.array([
+        [100, 100, 200, 200],   # seen by one tile
+        [102, 101, 201, 199],   # the same pothole seen by the neighbouring tile
+        [150, 100, 200, 200],   # the part of it a tile edge cut off, more confident
+        [400, 400, 450, 450],   # another pothole
+        [100, 100, 200, 200],   # same place, other class
+    ], dtype=np.float32)
+    conf = np.array([0.9, 0.8, 0.95, 0.5, 0.6])
+    cls = np.array([0, 0, 0, 0, 1])
+    keep = merge_boxes(xyxy, conf, cls)
+    assert sorted(keep.tolist()) == [0, 3, 4]
+
+
+def test_merge_boxes_keeps_the_whole_pothole_over_a_cut_fragment():
+    xyxy = np.array([[300, 0, 340, 60], [260, 0, 340, 60]], dtype=np.float32)
+    assert merge_boxes(xyxy, np.array([0.9, 0.7]), np.zeros(2)).tolist() == [1]
+
+
+def test_merge_boxes_empty():
+    assert len(merge_boxes(np.zeros((0, 4)), np.zeros(0), np.zeros(0))) == 0
+
+
+@pytest.mark.parametrize('side', [641, 700, 800, 960])
+def test_mid_size_images_are_not_downscaled_to_the_tile(side):
+    predictor = AdaptivePredictor(model=None, tile_size=640)
+    scale, windows, imgsz = predictor.plan((side, side, 3))
+    assert windows is None and scale == 1.0
+    assert imgsz >= side and imgsz % 32 == 0
+
+
+def test_latency_budget_caps_mid_size_images():
+    predictor = AdaptivePredictor(model=None, tile_size=640, latency_budget=0.1)
+    predictor._pass_seconds[640] = 0.08
+    # 800 px would cost ~0.08 * (800/640)^2 = 0.125 s; 704 px (~0.097 s) still fits
+    assert predictor.plan((800, 800, 3)) == (1.0, None, 704)
+    predictor._pass_seconds[640] = 0.2
+    assert predictor.plan((800, 800, 3)) == (1.0, None, 640)
@@ -0,0 +1,99 @@
+"""Downscaled JPEG and WebP variants of saved result images
+
+A video run can save hundreds of full-resolution annotated frames, and the
+result pages used to load every one of them. ``write_variants`` stores each
+image once more at the ``SIZES`` long sides, as JPEG and WebP, in a
+``thumbs/`` folder next to it while the full-size image is still in memory;
+the gallery then loads a few tens of kilobytes per card and the full image
+only when it is opened. Images saved before variants existed get theirs on
+first request through ``ensure_variant``.
+"""
+import logging
+import os
+import threading
+
+import metrics
+
+# Long side in pixels; images already smaller are stored as they are
+SIZES = {'sm': 320, 'md': 960}
+FORMATS = {'jpg': 'image/jpeg', 'webp': 'image/webp'}
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+
+logger = logging.getLogger(__name__)
+
+
+def variant_path(path, size, fmt='jpg'):
+    folder, name = os.path.split(path)
+    return os.path.join(folder, 'thumbs', f"{os.path.splitext(name)[0]}.{size}.{fmt}")
+
+
+def _encode(image, fmt):
+    import cv2
+
+    params = [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY] if fmt == 'webp' else [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    ok, buf = cv2.imencode(f'.{fmt}', image, params)
+    if not ok:
+        raise ValueError(f"Could not encode {fmt}")
+    return buf.tobytes()
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp{threading.get_ident()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_variants(path, image=None):
+    """Write every size/format variant of the image saved at ``path``
+
+    ``image`` is the BGR array that was written there, if still at hand;
+    otherwise the file is read back. Returns the variant paths.
+    """
+    import cv2
+
+    if image is None:
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"Could not read {path}")
+    os.makedirs(os.path.join(os.path.dirname(path), 'thumbs'), exist_ok=True)
+    height, width = image.shape[:2]
+    written = []
+    with metrics.timed('thumbnail'):
+        for size, long_side in SIZES.items():
+            scale = long_side / max(height, width)
+            resized = image if scale >= 1 else cv2.resize(
+                image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+            for fmt in FORMATS:
+                target = variant_path(path, size, fmt)
+                _write_atomic(target, _encode(resized, fmt))
+                written.append(target)
+    return written
+
+
+def ensure_variant(path, size, fmt='jpg'):
+    """Path of the variant, generating all variants first if it is missing
+
+    Returns None if neither the variant nor the source image exist.
+    """
+    target = variant_path(path, size, fmt)
+    if os.path.exists(target):
+        return target
+    if not os.path.exists(path):
+        return None
+    try:
+        write_variants(path)
+    except Exception:
+        logger.exception(f"Generating variants of {path} failed")
+        return None
+    return target
+
+
+def remove_variants(path):
+    for size in SIZES:
+        for fmt in FORMATS:
+            try:
+                os.remove(variant_path(path, size, fmt))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,234 @@
+"""Adaptive input size and tiled inference for high-resolution images
+
+``YOLO.predict`` letterboxes every source to one ``imgsz`` (640): a 4K
+dashcam frame is shrunk six-fold, so potholes a few dozen pixels across
+vanish, while a 300 px phone snapshot is blown up and pays for pixels it does
+not have. ``AdaptivePredictor`` wraps the model with the same ``predict``
+call shape and plans each image on its own:
+
+  - images up to ~1.5 tiles wide run once, at the smallest ``imgsz`` (a
+    multiple of 32) that holds them, or the largest the latency budget
+    allows if that is smaller (never below ``tile_size``);
+  - larger images are cut into overlapping ``tile_size`` tiles, plus one
+    whole-image pass for potholes bigger than a tile; the tiles of all images
+    in a call go through the model in batches, and the boxes are mapped back
+    and merged across tiles.
+
+With a latency budget, the predictor keeps a running per-pass cost for each
+input size and picks, per image, the most detailed plan (full-resolution
+tiles, then tiles of a 2x, 4x, ... downscaled image, then a single pass)
+whose estimated cost fits.
+"""
+import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from inference_server import RemoteBoxes, RemoteResult
+
+STRIDE = 32
+MIN_IMGSZ = 320
+# Boxes of one class overlapping more than this (IoU) are the same pothole
+MERGE_IOU = 0.5
+# ...as is a box mostly inside another one: the part of a pothole a tile edge cut off
+MERGE_IOS = 0.7
+
+
+def pick_imgsz(shape, max_imgsz=640):
+    """Smallest stride-aligned input size holding the image's long side, up to ``max_imgsz``"""
+    long_side = max(shape[:2])
+    return int(min(max_imgsz, max(MIN_IMGSZ, math.ceil(long_side / STRIDE) * STRIDE)))
+
+
+def _positions(length, tile, step):
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile, step))
+    return positions + [length - tile]
+
+
+def plan_tiles(shape, tile, overlap=0.2):
+    """``(x1, y1, x2, y2)`` windows of at most ``tile`` px covering the image with overlap"""
+    height, width = shape[:2]
+    step = max(1, int(tile * (1 - overlap)))
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in _positions(height, tile, step) for x in _positions(width, tile, step)]
+
+
+def merge_boxes(xyxy, conf, cls, iou_threshold=MERGE_IOU, ios_threshold=MERGE_IOS):
+    """Indices of the boxes to keep after cross-tile non-maximum suppression
+
+    Greedy per class, highest confidence first; a box is dropped if it
+    overlaps a kept one by IoU or by intersection over the smaller box. In
+    the second case the two are a pothole and the part of it a tile edge
+    cut off, and the larger box is the one kept, whichever is more confident.
+    """
+    if len(conf) == 0:
+        return np.zeros(0, dtype=int)
+    areas = (xyxy[:, 2] - xyxy[:, 0]).clip(0) * (xyxy[:, 3] - xyxy[:, 1]).clip(0)
+    keep = []
+    for c in np.unique(cls):
+        order = np.where(cls == c)[0]
+        order = order[np.argsort(-conf[order])]
+        while len(order):
+            i, rest = order[0], order[1:]
+            ix1 = np.maximum(xyxy[i, 0], xyxy[rest, 0])
+            iy1 = np.maximum(xyxy[i, 1], xyxy[rest, 1])
+            ix2 = np.minimum(xyxy[i, 2], xyxy[rest, 2])
+            iy2 = np.minimum(xyxy[i, 3], xyxy[rest, 3])
+            inter = (ix2 - ix1).clip(0) * (iy2 - iy1).clip(0)
+            iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+            ios = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-9)
+            duplicate = iou > iou_threshold
+            cut = ~duplicate & (ios > ios_threshold)
+            larger = rest[cut][areas[rest[cut]] > areas[i]]
+            keep.append(larger[np.argmax(areas[larger])] if len(larger) else i)
+            order = rest[~duplicate & ~cut]
+    return np.array(sorted(keep), dtype=int)
+
+
+def _to_numpy(values):
+    return values.cpu().numpy() if hasattr(values, 'cpu') else np.asarray(values)
+
+
+class AdaptivePredictor:
+    """Drop-in wrapper for a loaded model (or ``InferenceClient``)
+
+    ``latency_budget`` is in seconds per image (0 = no limit: always tile
+    large images at full resolution).
+    """
+
+    def __init__(self, model, tile_size=640, overlap=0.2, latency_budget=0.0, batch_size=8):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.latency_budget = latency_budget
+        self.batch_size = max(1, batch_size)
+        self._pass_seconds = {}
+        self._lock = threading.Lock()
+        self.counts = {'images': 0, 'tiled': 0, 'passes': 0}
+
+    @property
+    def names(self):
+        return self.model.names
+
+    @names.setter
+    def names(self, value):
+        self.model.names = value
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, pass_ms={size: round(1000 * s, 2) for size, s in self._pass_seconds.items()})
+
+    # ---------- planning ----------
+    def _estimate(self, imgsz, passes):
+        with self._lock:
+            per_pass = self._pass_seconds.get(imgsz)
+            if per_pass is None and self._pass_seconds:
+                # Not run at this size yet: scale the nearest measured size by input area
+                known = min(self._pass_seconds, key=lambda size: abs(size - imgsz))
+                per_pass = self._pass_seconds[known] * (imgsz / known) ** 2
+        return None if per_pass is None else per_pass * passes
+
+    def _single_pass_imgsz(self, shape):
+        """The image's own input size, or the largest the budget allows down to the tile size"""
+        tile = self.tile_size
+        native = pick_imgsz(shape, max_imgsz=math.ceil(1.5 * tile / STRIDE) * STRIDE)
+        if native <= tile or not self.latency_budget:
+            return native
+        for imgsz in range(native, tile, -STRIDE):
+            estimate = self._estimate(imgsz, 1)
+            if estimate is not None and estimate <= self.latency_budget:
+                return imgsz
+        return tile
+
+    def plan(self, shape):
+        """``(scale, windows, imgsz)``: run ``windows`` of the image resized by ``scale``
+
+        ``windows`` is None for a single whole-image pass.
+        """
+        tile = self.tile_size
+        if max(shape[:2]) <= 1.5 * tile:
+            return 1.0, None, self._single_pass_imgsz(shape)
+
+        scale = 1.0
+        while max(shape[:2]) * scale > 1.5 * tile:
+            h, w = int(round(shape[0] * scale)), int(round(shape[1] * scale))
+            windows = plan_tiles((h, w), tile, self.overlap)
+            if not self.latency_budget:
+                return scale, windows, tile
+            # Tiles plus the whole-image pass
+            estimate = self._estimate(tile, len(windows) + 1)
+            if estimate is not None and estimate <= self.latency_budget:
+                return scale, windows, tile
+            scale /= 2
+        return 1.0, None, tile
+
+    # ---------- inference ----------
+    def _run(self, images, imgsz, kwargs):
+        results = []
+        for i in range(0, len(images), self.batch_size):
+            chunk = images[i:i + self.batch_size]
+            start = time.perf_counter()
+            results.extend(self.model.predict(source=chunk, imgsz=imgsz, **kwargs))
+            per_pass = (time.perf_counter() - start) / len(chunk)
+            with self._lock:
+                previous = self._pass_seconds.get(imgsz)
+                self._pass_seconds[imgsz] = per_pass if previous is None else 0.8 * previous + 0.2 * per_pass
+                self.counts['passes'] += len(chunk)
+        return results
+
+    def predict(self, source=None, **kwargs):
+        sources = source if isinstance(source, list) else [source]
+        images = [cv2.imread(s) if isinstance(s, str) else s for s in sources]
+        kwargs.pop('imgsz', None)
+
+        # (image index, crop, x offset, y offset, scale) per forward pass, grouped by imgsz
+        passes = {}
+        tiled = set()
+        for index, image in enumerate(images):
+            scale, windows, imgsz = self.plan(image.shape)
+            if windows is None:
+                passes.setdefault(imgsz, []).append((index, image, 0, 0, 1.0))
+                continue
+            tiled.add(index)
+            scaled = image if scale == 1.0 else cv2.resize(
+                image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            group = passes.setdefault(imgsz, [])
+            group.append((index, image, 0, 0, 1.0))
+            for x1, y1, x2, y2 in windows:
+                group.append((index, scaled[y1:y2, x1:x2], x1, y1, scale))
+
+        detections = [[] for _ in images]
+        native = [None] * len(images)
+        for imgsz, group in passes.items():
+            results = self._run([crop for _, crop, _, _, _ in group], imgsz, kwargs)
+            for (index, _, x, y, scale), result in zip(group, results):
+                if index not in tiled:
+                    native[index] = result
+                    continue
+                boxes = result.boxes
+                xyxy = _to_numpy(boxes.xyxy).reshape(-1, 4).astype(np.float32)
+                xyxy = (xyxy + np.array([x, y, x, y], dtype=np.float32)) / scale
+                detections[index].append((xyxy, _to_numpy(boxes.conf).reshape(-1), _to_numpy(boxes.cls).reshape(-1)))
+
+        with self._lock:
+            self.counts['images'] += len(images)
+            self.counts['tiled'] += len(tiled)
+
+        merged = []
+        for index, image in enumerate(images):
+            if native[index] is not None:
+                merged.append(native[index])
+                continue
+            xyxy = np.concatenate([d[0] for d in detections[index]]) if detections[index] else np.zeros((0, 4))
+            conf = np.concatenate([d[1] for d in detections[index]]) if detections[index] else np.zeros(0)
+            cls = np.concatenate([d[2] for d in detections[index]]) if detections[index] else np.zeros(0)
+            keep = merge_boxes(xyxy, conf, cls)
+            merged.append(RemoteResult(RemoteBoxes(xyxy[keep], conf[keep], cls[keep]), self.names, orig_img=image))
+        return merged
+
+    def __call__(self, *args, **kwargs):
+        return self.predict(*args, **kwargs)
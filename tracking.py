@@ -0,0 +1,175 @@
+"""Lightweight pothole tracking across sampled video frames
+
+A pothole stays in view for several seconds of dashcam footage, so without
+tracking the same pothole is counted (and saved, and emailed) once per
+sampled frame. ``PotholeTracker`` links detections in consecutive sampled
+frames by IoU, falling back to centroid distance because the road moves
+towards the camera between samples, and gives each physical pothole a
+stable id. For every track we only keep the highest-confidence sighting,
+as a padded crop copied out of the frame, so a track never keeps a whole
+decoded frame (or the frame buffer it came from) alive.
+"""
+import math
+
+import cv2
+
+# Road kept around a pothole in its crop: a share of the box size, at least MIN_PAD pixels
+CROP_PAD = 0.5
+CROP_MIN_PAD = 32
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _centroid_distance(a, b):
+    """Centroid distance relative to the larger box's diagonal"""
+    ca = ((a[0] + a[2]) / 2, (a[1] + a[3]) / 2)
+    cb = ((b[0] + b[2]) / 2, (b[1] + b[3]) / 2)
+    diag = max(math.hypot(a[2] - a[0], a[3] - a[1]), math.hypot(b[2] - b[0], b[3] - b[1]), 1.0)
+    return math.hypot(ca[0] - cb[0], ca[1] - cb[1]) / diag
+
+
+def match_boxes(boxes_a, boxes_b, iou_threshold=0.3, centroid_threshold=1.0):
+    """Greedy one-to-one ``(i, j)`` matches between two lists of boxes
+
+    Pairs overlapping by at least ``iou_threshold`` rank first, by IoU; the
+    rest may still match on centroid distance (see ``_centroid_distance``).
+    """
+    candidates = []
+    for i, a in enumerate(boxes_a):
+        for j, b in enumerate(boxes_b):
+            overlap = iou(a, b)
+            if overlap >= iou_threshold:
+                candidates.append((1.0 + overlap, i, j))
+            else:
+                dist = _centroid_distance(a, b)
+                if dist <= centroid_threshold:
+                    candidates.append((1.0 - dist / (centroid_threshold + 1e-9), i, j))
+    candidates.sort(reverse=True)
+
+    matches, matched_a, matched_b = [], set(), set()
+    for _, i, j in candidates:
+        if i in matched_a or j in matched_b:
+            continue
+        matches.append((i, j))
+        matched_a.add(i)
+        matched_b.add(j)
+    return matches
+
+
+def _crop(frame, box):
+    """Copy of ``box`` in ``frame`` with padding, and the crop's top-left corner"""
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = (int(round(v)) for v in box)
+    px = max(CROP_MIN_PAD, int((x2 - x1) * CROP_PAD))
+    py = max(CROP_MIN_PAD, int((y2 - y1) * CROP_PAD))
+    cx1, cy1 = max(0, x1 - px), max(0, y1 - py)
+    cx2, cy2 = min(w, x2 + px), min(h, y2 + py)
+    return frame[cy1:cy2, cx1:cx2].copy(), (cx1, cy1)
+
+
+class Track:
+    __slots__ = ('track_id', 'box', 'first_box', 'first_frame', 'last_frame', 'hits', 'misses',
+                 'best_conf', 'best_box', 'best_frame_number', 'best_crop', 'best_origin')
+
+    def __init__(self, track_id, frame_number, frame, box, conf):
+        self.track_id = track_id
+        self.box = box
+        self.first_box = box
+        self.first_frame = frame_number
+        self.last_frame = frame_number
+        self.hits = 1
+        self.misses = 0
+        self.best_conf = conf
+        self.best_box = box
+        self.best_frame_number = frame_number
+        self.best_crop, self.best_origin = _crop(frame, box)
+
+    def update(self, frame_number, frame, box, conf):
+        self.box = box
+        self.last_frame = frame_number
+        self.hits += 1
+        self.misses = 0
+        if conf > self.best_conf:
+            self.best_conf = conf
+            self.best_box = box
+            self.best_frame_number = frame_number
+            self.best_crop, self.best_origin = _crop(frame, box)
+
+
+class PotholeTracker:
+    """Greedy IoU / centroid tracker over sampled frames
+
+    ``max_age`` is how many consecutive sampled frames a track may go unseen
+    before it is closed; ``min_hits`` drops tracks seen fewer times than that
+    (single-frame false positives).
+    """
+
+    def __init__(self, iou_threshold=0.3, centroid_threshold=1.0, max_age=2, min_hits=1):
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.active = []
+        self.next_id = 1
+        self.unique_count = 0
+
+    def update(self, frame_number, frame, boxes, confs):
+        """Feed one sampled frame's detections; returns tracks that just closed"""
+        matched_tracks, matched_dets = set(), set()
+        for ti, di in match_boxes([track.box for track in self.active], boxes,
+                                  self.iou_threshold, self.centroid_threshold):
+            self.active[ti].update(frame_number, frame, boxes[di], confs[di])
+            matched_tracks.add(ti)
+            matched_dets.add(di)
+
+        still_active, closed = [], []
+        for ti, track in enumerate(self.active):
+            if ti not in matched_tracks:
+                track.misses += 1
+            (closed if track.misses > self.max_age else still_active).append(track)
+
+        for di, box in enumerate(boxes):
+            if di not in matched_dets:
+                still_active.append(Track(self.next_id, frame_number, frame, box, confs[di]))
+                self.next_id += 1
+
+        self.active = still_active
+        return self._accept(closed)
+
+    def flush(self):
+        """Close every remaining track (end of video)"""
+        closed, self.active = self.active, []
+        return self._accept(closed)
+
+    def _accept(self, closed):
+        kept = [t for t in closed if t.hits >= self.min_hits]
+        self.unique_count += len(kept)
+        return kept
+
+
+def crop_track(track):
+    """Annotated crop of a track's best sighting with some road around it
+
+    Draws on the track's own crop rather than a copy; call it once the
+    track is closed.
+    """
+    crop = track.best_crop
+    ox, oy = track.best_origin
+    x1, y1, x2, y2 = (int(round(v)) for v in track.best_box)
+    label = f"pothole #{track.track_id} {track.best_conf:.2f}"
+    draw_box(crop, (x1 - ox, y1 - oy, x2 - ox, y2 - oy), label)
+    return crop
+
+
+def draw_box(image, box, label):
+    """Draw one labelled detection box onto ``image`` in place"""
+    x1, y1, x2, y2 = (int(round(v)) for v in box)
+    cv2.rectangle(image, (x1, y1), (x2, y2), (56, 56, 255), 2, cv2.LINE_AA)
+    cv2.putText(image, label, (max(0, x1), max(12, y1 - 4)), cv2.FONT_HERSHEY_SIMPLEX,
+                0.5, (56, 56, 255), 1, cv2.LINE_AA)
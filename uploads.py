@@ -0,0 +1,260 @@
+"""Resumable chunked video uploads
+
+Large videos are sent as a series of ``PUT`` requests, each carrying a
+``Content-Range: bytes <start>-<end>/<total>`` slice of the file. Chunks are
+streamed straight to the destination file, so nothing is buffered in memory
+or in Werkzeug temp files, and the byte count received so far is kept in the
+``uploads`` table: after a dropped connection the client asks for it and
+carries on from there instead of starting over.
+
+Detection starts as soon as a usable prefix has arrived. ``GrowingCapture``
+reads the partial file like an ordinary ``cv2.VideoCapture`` and, when it
+hits the end of what has been received, waits for the next chunk, reopens the
+file and seeks back to where it was. Containers that keep their index at the
+end (MP4 without "faststart") cannot be opened from a prefix; those are
+simply processed once the last chunk is in.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+
+from db import DB_PATH, get_connection, transaction
+
+# Read request bodies in pieces of this size while writing a chunk to disk
+COPY_BUFFER_BYTES = 1024 * 1024
+# A growing capture gives up when no new bytes arrive for this long
+UPLOAD_STALL_SECONDS = int(os.getenv("UPLOAD_STALL_SECONDS", 600))
+
+logger = logging.getLogger(__name__)
+
+
+class UploadConflict(Exception):
+    """A chunk does not start where the upload currently ends"""
+
+    def __init__(self, received):
+        super().__init__(f"Expected a chunk starting at byte {received}")
+        self.received = received
+
+
+def init_uploads_table(db_path=DB_PATH):
+    with transaction(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                received INTEGER NOT NULL DEFAULT 0,
+                location TEXT,
+                params TEXT,
+                job_id TEXT,
+                frames TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+
+def _row_to_upload(row):
+    if row is None:
+        return None
+    upload = dict(row)
+    upload['params'] = json.loads(upload['params']) if upload['params'] else {}
+    upload['frames'] = json.loads(upload['frames']) if upload['frames'] else []
+    upload['complete'] = upload['received'] >= upload['size']
+    return upload
+
+
+def create_upload(user_id, filename, file_path, size, location, params=None, db_path=DB_PATH):
+    """Register an upload and create its (empty) destination file; returns its id"""
+    upload_id = uuid.uuid4().hex
+    open(file_path, 'wb').close()
+    get_connection(db_path).execute(
+        '''INSERT INTO uploads (id, user_id, filename, file_path, size, location, params)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        (upload_id, user_id, filename, file_path, size, location, json.dumps(params or {})))
+    return upload_id
+
+
+def get_upload(upload_id, db_path=DB_PATH):
+    row = get_connection(db_path).execute('SELECT * FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+    return _row_to_upload(row)
+
+
+def parse_content_range(header):
+    """``(start, end, total)`` from ``bytes start-end/total``; end is inclusive"""
+    try:
+        unit, _, spec = header.strip().partition(' ')
+        span, _, total = spec.partition('/')
+        start, _, end = span.partition('-')
+        start, end, total = int(start), int(end), int(total)
+    except (AttributeError, ValueError):
+        raise ValueError("Content-Range must look like 'bytes <start>-<end>/<total>'")
+    if unit != 'bytes' or start < 0 or end < start or end >= total:
+        raise ValueError("Content-Range is out of bounds")
+    return start, end, total
+
+
+def write_chunk(upload, start, end, stream, db_path=DB_PATH):
+    """Copy ``stream`` into the upload at ``start``; returns bytes received so far
+
+    Raises UploadConflict unless the chunk continues exactly where the upload
+    ends, and ValueError if the stream is shorter than the declared range.
+    """
+    if start != upload['received']:
+        raise UploadConflict(upload['received'])
+    expected = end - start + 1
+    written = 0
+    with open(upload['file_path'], 'r+b') as f:
+        f.seek(start)
+        while written < expected:
+            piece = stream.read(min(COPY_BUFFER_BYTES, expected - written))
+            if not piece:
+                break
+            f.write(piece)
+            written += len(piece)
+    # A cut-off chunk still counts for what arrived; the client resumes from there
+    received = start + written
+    cur = get_connection(db_path).execute(
+        '''UPDATE uploads SET received = ?, updated_at = CURRENT_TIMESTAMP
+           WHERE id = ? AND received = ?''', (received, upload['id'], start))
+    if cur.rowcount == 0:
+        # Another request for the same range won the race
+        raise UploadConflict(get_upload(upload['id'], db_path)['received'])
+    if written != expected:
+        raise ValueError(f"Chunk ended after {written} of {expected} bytes")
+    return received
+
+
+def set_upload_job(upload_id, job_id, db_path=DB_PATH):
+    """Attach the detection job, dropping partial results of any earlier run"""
+    get_connection(db_path).execute('UPDATE uploads SET job_id = ?, frames = NULL WHERE id = ?',
+                                    (job_id, upload_id))
+
+
+def record_frame(upload_id, entry, db_path=DB_PATH):
+    """Append one saved detection to the upload's partial results"""
+    with transaction(db_path) as conn:
+        row = conn.execute('SELECT frames FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+        frames = json.loads(row['frames']) if row and row['frames'] else []
+        frames.append({k: entry[k] for k in ('frame_number', 'pothole_count', 'track_id', 'rel_path')
+                       if k in entry})
+        conn.execute('UPDATE uploads SET frames = ? WHERE id = ?', (json.dumps(frames), upload_id))
+
+
+class GrowingCapture:
+    """``cv2.VideoCapture`` look-alike over a file that is still being uploaded
+
+    Implements the subset of the capture API used by video_pipeline.py. The
+    frame count is reported as 0 until the upload is complete, which keeps
+    the pipeline on sequential reads instead of seeking. ``heartbeat`` is
+    called every ``heartbeat_interval`` seconds while waiting for the next
+    chunk, so a job blocked on a slow client is not taken for a dead one.
+    """
+
+    def __init__(self, upload_id, poll_interval=1.0, stall_seconds=UPLOAD_STALL_SECONDS, db_path=DB_PATH,
+                 heartbeat=None, heartbeat_interval=30.0):
+        self.upload_id = upload_id
+        self.poll_interval = poll_interval
+        self.stall_seconds = stall_seconds
+        self.db_path = db_path
+        self.heartbeat = heartbeat
+        self.heartbeat_interval = heartbeat_interval
+        self.cap = None
+        self.position = 0
+        self.complete = False
+        self._received = 0
+        self._opened_at = -1
+        self._opened_complete = False
+        self._refresh()
+
+    def _refresh(self):
+        upload = get_upload(self.upload_id, self.db_path)
+        self.path = upload['file_path']
+        self._received = upload['received']
+        self.complete = upload['complete']
+
+    def _wait_for_data(self):
+        """Block until bytes beyond the open prefix arrive; False if none ever will"""
+        deadline = time.monotonic() + self.stall_seconds
+        last_beat = time.monotonic()
+        while True:
+            if self.heartbeat is not None and time.monotonic() - last_beat >= self.heartbeat_interval:
+                self.heartbeat()
+                last_beat = time.monotonic()
+            self._refresh()
+            if self._received > self._opened_at:
+                return True
+            if self.complete:
+                return False
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Upload {self.upload_id} stalled at {self._received} bytes")
+            time.sleep(self.poll_interval)
+
+    def _reopen(self):
+        import cv2
+
+        if self.cap is not None:
+            self.cap.release()
+        self._opened_at = self._received
+        self._opened_complete = self.complete
+        self.cap = cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            return False
+        if self.position:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.position)
+        return True
+
+    def isOpened(self):
+        if self.cap is not None and self.cap.isOpened():
+            return True
+        # The container header may not have arrived yet
+        while not self._reopen():
+            if not self._wait_for_data():
+                return False
+        return True
+
+    def _next(self, op):
+        while True:
+            result = op()
+            ok = result[0] if isinstance(result, tuple) else result
+            if ok:
+                self.position += 1
+                return result
+            if self._opened_complete or not self._wait_for_data():
+                return result
+            logger.info(f"Upload {self.upload_id}: resuming at frame {self.position} "
+                        f"({self._received} bytes received)")
+            self._reopen()
+
+    def read(self, image=None):
+        return self._next(lambda: self.cap.read(image))
+
+    def grab(self):
+        return self._next(lambda: self.cap.grab())
+
+    def retrieve(self):
+        return self.cap.retrieve()
+
+    def get(self, prop):
+        import cv2
+
+        if prop == cv2.CAP_PROP_FRAME_COUNT and not self._opened_complete:
+            return 0
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        import cv2
+
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = int(value)
+        return self.cap.set(prop, value)
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
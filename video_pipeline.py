@@ -0,0 +1,416 @@
+"""Pipelined video detection: decoder thread -> inference -> annotate/write pool
+
+The decoder, the model and the JPEG encoder each get their own stage connected
+by bounded queues, so a slow stage applies backpressure to the one before it
+instead of letting decoded frames pile up in memory. Decoded frames come
+from a ``FramePool`` (see memory.py) and are decoded into reused arrays;
+frames without detections go back to the pool right after inference, and
+only frames that will be saved are annotated, in place.
+"""
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+
+import metrics
+import motion
+import thumbnails
+import tracking
+from memory import MB, FramePool, MemoryBudgetExceeded, StageAllocationTracer, current_rss
+from tracking import crop_track, draw_box
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class PipelineStats:
+    """Per-stage busy time, item counts and queue depths for one video run"""
+
+    def __init__(self, stages=('decode', 'infer', 'write'), queues=('frames', 'results')):
+        self._lock = threading.Lock()
+        self.stages = {name: {'items': 0, 'busy_seconds': 0.0} for name in stages}
+        self.queues = {name: {'max_depth': 0, 'depth_total': 0, 'samples': 0} for name in queues}
+        self.started_at = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.gate = None
+        self.memory = None
+
+    def record(self, stage, seconds, items=1):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'items': 0, 'busy_seconds': 0.0})
+            entry['items'] += items
+            entry['busy_seconds'] += seconds
+        metrics.observe_stage(stage, seconds, 'video')
+
+    def sample_queue(self, name, q):
+        depth = q.qsize()
+        with self._lock:
+            entry = self.queues.setdefault(name, {'max_depth': 0, 'depth_total': 0, 'samples': 0})
+            entry['max_depth'] = max(entry['max_depth'], depth)
+            entry['depth_total'] += depth
+            entry['samples'] += 1
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self.started_at
+
+    def as_dict(self):
+        with self._lock:
+            stages = {}
+            for name, entry in self.stages.items():
+                stages[name] = {
+                    'items': entry['items'],
+                    'busy_seconds': round(entry['busy_seconds'], 4),
+                    'avg_ms': round(1000 * entry['busy_seconds'] / entry['items'], 3) if entry['items'] else 0.0,
+                }
+            queues = {}
+            for name, entry in self.queues.items():
+                queues[name] = {
+                    'max_depth': entry['max_depth'],
+                    'avg_depth': round(entry['depth_total'] / entry['samples'], 2) if entry['samples'] else 0.0,
+                }
+            busiest = max(stages, key=lambda s: stages[s]['busy_seconds']) if stages else None
+            result = {
+                'wall_seconds': round(self.wall_seconds, 4),
+                'stages': stages,
+                'queues': queues,
+                'bottleneck': busiest,
+            }
+            if self.gate is not None:
+                result['gate'] = self.gate
+            if self.memory is not None:
+                result['memory'] = self.memory
+            return result
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once the pipeline is being torn down"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def sample_frames(cap, frame_interval, seek_threshold=0, gate=None, pool=None):
+    """Yield ``(frame_number, frame)`` for every ``frame_interval``-th frame
+
+    Skipped frames are only grabbed (demuxed and decoded, but never converted
+    to BGR by ``retrieve``). When the interval is at least ``seek_threshold``
+    frames, the capture seeks straight to the next sampled frame instead, which
+    lets the backend jump to the preceding keyframe rather than decode the
+    whole gap. A ``seek_threshold`` of 0 disables seeking.
+
+    With a ``gate`` (see motion.py), the step to the next sample is asked from
+    ``gate.interval()`` once the consumer is done with the current frame;
+    shorter steps add samples between the regular ones, never skip those.
+
+    With a ``pool`` (see memory.py), every yielded frame holds one of its
+    slots, decoded into a recycled array when there is one, and must be
+    released by the consumer.
+    """
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    use_seek = seek_threshold > 0 and frame_interval >= seek_threshold and total > 0
+    frame_count = 0
+    next_sample = 0
+
+    def read():
+        if pool is None:
+            return cap.read()
+        buffer = pool.acquire()
+        ret, frame = cap.read(buffer)
+        if not ret:
+            pool.release()
+            return ret, None
+        pool.note(buffer, frame)
+        return ret, frame
+
+    def step(current):
+        if gate is None:
+            return current + frame_interval
+        return min(current + gate.interval(frame_interval), (current // frame_interval + 1) * frame_interval)
+
+    while True:
+        if use_seek:
+            if frame_count >= total:
+                return
+            if frame_count and not cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count):
+                # Backend cannot seek; grab our way through the rest
+                use_seek = False
+                next_sample = frame_count
+                continue
+            ret, frame = read()
+            if not ret:
+                return
+            yield frame_count, frame
+            frame_count = step(frame_count)
+            continue
+
+        if frame_count == next_sample:
+            ret, frame = read()
+            if not ret:
+                return
+            yield frame_count, frame
+            next_sample = step(next_sample)
+        elif not cap.grab():
+            return
+        frame_count += 1
+
+
+def _decode(cap, frame_interval, seek_threshold, frames_q, stop, stats, errors, frame_offset=0, gate=None,
+            pool=None):
+    try:
+        frames = sample_frames(cap, frame_interval, seek_threshold, gate, pool)
+        while not stop.is_set():
+            start = time.perf_counter()
+            item = next(frames, None)
+            if item is None:
+                break
+            if frame_offset:
+                item = (item[0] + frame_offset, item[1])
+            # Includes the grabs/seeks of the skipped frames before this one
+            stats.record('decode', time.perf_counter() - start)
+            if gate is not None:
+                start = time.perf_counter()
+                analyse = gate.check(item[0], item[1])
+                stats.record('gate', time.perf_counter() - start)
+                if not analyse:
+                    if pool is not None:
+                        pool.release(item[1])
+                    continue
+            if not _put(frames_q, item, stop):
+                break
+            stats.sample_queue('frames', frames_q)
+    except Exception as e:  # surfaced to the caller after join
+        errors.append(e)
+    finally:
+        _put(frames_q, _DONE, stop)
+
+
+def _save_frame(output_folder, frame_number, frame, boxes, confs, labels):
+    """Annotate the frame in place and write it (untracked mode)"""
+    with metrics.timed('plot', 'video'):
+        for box, label in zip(boxes, labels):
+            draw_box(frame, box, label)
+    frame_filename = f"frame_{frame_number}_potholes_{len(boxes)}.jpg"
+    frame_path = os.path.join(output_folder, frame_filename)
+    with metrics.timed('imwrite', 'video'):
+        cv2.imwrite(frame_path, frame)
+    thumbnails.write_variants(frame_path, frame)
+    return {
+        'frame_number': frame_number,
+        'pothole_count': len(boxes),
+        'boxes': [[round(v, 1) for v in xyxy] + [round(c, 3)] for xyxy, c in zip(boxes, confs)],
+        'path': frame_path,
+    }
+
+
+def _save_track(output_folder, track):
+    """Write the best-confidence crop of one tracked pothole"""
+    frame_filename = f"pothole_{track.track_id}_frame_{track.best_frame_number}.jpg"
+    frame_path = os.path.join(output_folder, frame_filename)
+    crop = crop_track(track)
+    with metrics.timed('imwrite', 'video'):
+        cv2.imwrite(frame_path, crop)
+    thumbnails.write_variants(frame_path, crop)
+    return {
+        'frame_number': track.best_frame_number,
+        'pothole_count': 1,
+        'track_id': track.track_id,
+        'confidence': round(float(track.best_conf), 3),
+        'first_frame': track.first_frame,
+        'last_frame': track.last_frame,
+        # Where the track entered and left view, for joining video segments
+        'first_box': [round(float(v), 1) for v in track.first_box],
+        'last_box': [round(float(v), 1) for v in track.box],
+        'boxes': [[round(float(v), 1) for v in track.best_box] + [round(float(track.best_conf), 3)]],
+        'path': frame_path,
+    }
+
+
+def _write(results_q, output_folder, detected_frames, lock, stop, stats, errors, on_result=None, pool=None):
+    while True:
+        item = results_q.get()
+        if item is _DONE:
+            break
+        try:
+            if stop.is_set():
+                continue
+            start = time.perf_counter()
+            if item[0] == 'track':
+                entry = _save_track(output_folder, item[1])
+            else:
+                entry = _save_frame(output_folder, *item[1:])
+            stats.record('write', time.perf_counter() - start)
+
+            # FIX: Convert path to forward slashes
+            entry['rel_path'] = entry['path'].replace('\\', '/').replace('static/', '')
+            with lock:
+                detected_frames.append(entry)
+            if on_result is not None:
+                on_result(entry)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            if item[0] == 'frame' and pool is not None:
+                pool.release(item[2])
+
+
+# Where allocations are attributed in the stats' 'memory' section
+MEMORY_STAGES = {
+    sys.modules[__name__]: {'sample_frames': 'decode', '_decode': 'decode', 'infer': 'infer',
+                            'flush_tracks': 'track', '_save_frame': 'write', '_save_track': 'write'},
+    tracking: 'track',
+    motion: 'gate',
+    thumbnails: 'write',
+}
+
+
+def run_video_pipeline(cap, m, frame_interval, output_folder, batch_size=8,
+                       writer_threads=2, queue_size=32, seek_threshold=0, stats=None,
+                       progress=None, conf=0.25, tracker=None, on_result=None, frame_offset=0,
+                       gate=None, frame_buffers=0, max_rss_mb=0, trace_memory=False):
+    """Run detection over an opened capture and save frames with potholes
+
+    ``progress``, if given, is called with the last inferred frame number
+    after every batch. With a ``tracker`` (see tracking.py) each physical
+    pothole is saved once, as a crop of its best-confidence sighting, instead
+    of saving every frame it appears in. ``on_result``, if given, is called
+    from a writer thread with each saved entry as soon as it is on disk.
+    ``frame_offset`` is added to every frame number, for captures that start
+    part-way into a video (see video_segments.py). A ``gate`` (see motion.py)
+    drops sampled frames that look like the last analysed one before they
+    reach the model, and may sample fast stretches more densely.
+
+    At most ``frame_buffers`` decoded frames exist at once (0: two batches
+    plus one per writer, never fewer than one batch). With ``max_rss_mb``,
+    the process's resident set is checked after every batch; over budget,
+    the frame buffers are halved down to one batch, and past that the run
+    fails with ``MemoryBudgetExceeded``. ``trace_memory`` adds per-stage
+    ``tracemalloc`` peaks to the stats (slow; for diagnosis).
+    Returns ``(detected_frames,
+    pothole_images, stats)`` with entries in frame-number order.
+    """
+    stats = stats or PipelineStats()
+    writer_threads = max(1, writer_threads)
+    pool = FramePool(frame_buffers or 2 * batch_size + writer_threads, min_capacity=batch_size)
+    frames_q = queue.Queue(maxsize=max(batch_size, queue_size))
+    results_q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    lock = threading.Lock()
+    errors = []
+    detected_frames = []
+    max_rss = max_rss_mb * MB
+    peak_rss = current_rss()
+    tracer = StageAllocationTracer(MEMORY_STAGES) if trace_memory else None
+    if tracer is not None:
+        tracer.start()
+
+    decoder = threading.Thread(target=_decode, name='video-decode', daemon=True,
+                               args=(cap, frame_interval, seek_threshold, frames_q, stop, stats, errors,
+                                     frame_offset, gate, pool))
+    writers = [
+        threading.Thread(target=_write, name=f'video-write-{i}', daemon=True,
+                         args=(results_q, output_folder, detected_frames, lock, stop, stats, errors, on_result,
+                               pool))
+        for i in range(writer_threads)
+    ]
+    decoder.start()
+    for w in writers:
+        w.start()
+
+    def infer(batch):
+        start = time.perf_counter()
+        results = m.predict(source=[frame for _, frame in batch], conf=conf, save=False, verbose=False)
+        stats.record('infer', time.perf_counter() - start, items=len(batch))
+        if progress is not None:
+            progress(batch[-1][0])
+        # Only plain box lists leave this function; the Results (and the
+        # references they hold to the frames) are dropped with it
+        detections = [(r.boxes.xyxy.tolist(), r.boxes.conf.tolist(), r.boxes.cls.tolist()) for r in results]
+        del results
+        names = getattr(m, 'names', None) or {}
+        for (frame_number, frame), (boxes, confs, classes) in zip(batch, detections):
+            if tracker is not None:
+                # The tracker keeps crops, not frames
+                items = [('track', t) for t in tracker.update(frame_number, frame, boxes, confs)]
+                pool.release(frame)
+            elif boxes:
+                labels = [f"{names.get(int(c), 'pothole')} {p:.2f}" for c, p in zip(classes, confs)]
+                items = [('frame', frame_number, frame, boxes, confs, labels)]
+            else:
+                items = []
+                pool.release(frame)
+            for item in items:
+                if not _put(results_q, item, stop):
+                    return
+                stats.sample_queue('results', results_q)
+
+    def check_memory():
+        nonlocal peak_rss
+        rss = current_rss()
+        peak_rss = max(peak_rss, rss)
+        if not max_rss or rss <= max_rss:
+            return
+        if not pool.shrink():
+            raise MemoryBudgetExceeded(f"Resident set {rss / MB:.0f} MB is over the {max_rss_mb} MB budget")
+        logger.warning(f"🧠 Resident set {rss / MB:.0f} MB is over the {max_rss_mb} MB budget, "
+                       f"down to {pool.capacity} frame buffers")
+
+    def flush_tracks():
+        for track in tracker.flush():
+            if not _put(results_q, ('track', track), stop):
+                return
+
+    try:
+        batch = []
+        while not stop.is_set():
+            try:
+                item = frames_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                break
+            batch.append(item)
+            if len(batch) >= batch_size:
+                infer(batch)
+                batch = []
+                check_memory()
+        if batch and not stop.is_set():
+            infer(batch)
+            check_memory()
+        if tracker is not None and not stop.is_set():
+            flush_tracks()
+    except Exception:
+        stop.set()
+        raise
+    finally:
+        pool.close()
+        decoder.join()
+        for _ in writers:
+            results_q.put(_DONE)
+        for w in writers:
+            w.join()
+        stats.finish()
+        if gate is not None:
+            stats.gate = gate.as_dict()
+        stats.memory = dict(pool.as_dict(), peak_rss_mb=round(max(peak_rss, current_rss()) / MB, 1))
+        if max_rss_mb:
+            stats.memory['max_rss_mb'] = max_rss_mb
+        if tracer is not None:
+            tracer.stop()
+            stats.memory['allocations'] = tracer.as_dict()
+
+    if errors:
+        raise errors[0]
+
+    detected_frames.sort(key=lambda f: (f['frame_number'], f.get('track_id', 0)))
+    pothole_images = [f['path'] for f in detected_frames]
+    return detected_frames, pothole_images, stats
@@ -0,0 +1,258 @@
+"""Parallel processing of one long video by time segments
+
+A single ``cv2.VideoCapture`` decodes on one core, so a multi-hour survey
+video is split into contiguous frame ranges, each handled by its own spawned
+process with its own capture and model (or a client of the shared inference
+server when INFERENCE_SERVER is set). Segment boundaries are multiples of the
+sampling interval, so exactly the same frames are analysed as in a
+single-process run and the merged ``detected_frames`` carry global frame
+numbers.
+
+With tracking on, each segment tracks on its own and ``stitch_tracks`` then
+joins tracks that run across a boundary: a track that leaves view at the end
+of one segment and one that enters at the start of the next, at about the
+same place, are one pothole and are counted (and saved) once.
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+import cv2
+
+import metrics
+import thumbnails
+from tracking import PotholeTracker, match_boxes
+from video_pipeline import run_video_pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentCapture:
+    """Frames ``[start, end)`` of a capture, numbered from 0
+
+    Implements the subset of the capture API used by video_pipeline.py.
+    """
+
+    def __init__(self, cap, start, end):
+        self.cap = cap
+        self.start = start
+        self.end = end
+        self.position = 0
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self, image=None):
+        if self.start + self.position >= self.end:
+            return False, None
+        ret, frame = self.cap.read(image)
+        if ret:
+            self.position += 1
+        return ret, frame
+
+    def grab(self):
+        if self.start + self.position >= self.end:
+            return False
+        ret = self.cap.grab()
+        if ret:
+            self.position += 1
+        return ret
+
+    def retrieve(self):
+        return self.cap.retrieve()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.end - self.start
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = int(value)
+            return self.cap.set(prop, self.start + int(value))
+        return self.cap.set(prop, value)
+
+    def release(self):
+        self.cap.release()
+
+
+def plan_segments(total_frames, frame_interval, count):
+    """Split ``[0, total_frames)`` into ``count`` ranges starting on sampled frames"""
+    samples = -(-total_frames // frame_interval)
+    count = max(1, min(count, samples))
+    bounds = [round(i * samples / count) * frame_interval for i in range(count)] + [total_frames]
+    return [(bounds[i], bounds[i + 1]) for i in range(count) if bounds[i] < bounds[i + 1]]
+
+
+def stitch_tracks(segment_frames, segments, frame_interval, tracker):
+    """Join tracked potholes that continue across segment boundaries
+
+    ``segment_frames`` holds each segment's ``detected_frames``. Tracks that
+    end within ``tracker.max_age`` samples before a boundary are matched to
+    tracks starting as soon after it, box against box, the way ``tracker``
+    links consecutive frames. Each joined pothole keeps its best sighting,
+    spanning all of its pieces. Returns ``(segment_frames, duplicates)``,
+    where ``duplicates`` are the entries dropped in favour of another.
+    """
+    reach = frame_interval * (tracker.max_age + 1)
+    tracks = {(index, entry['track_id']): entry for index, frames in enumerate(segment_frames)
+              for entry in frames if 'track_id' in entry}
+    parent = {}
+
+    def root(key):
+        while parent.get(key, key) != key:
+            key = parent[key]
+        return key
+
+    for index in range(len(segments) - 1):
+        boundary = segments[index + 1][0]
+        tail = [key for key, e in tracks.items() if key[0] == index and e['last_frame'] >= boundary - reach]
+        head = [key for key, e in tracks.items() if key[0] == index + 1 and e['first_frame'] < boundary + reach]
+        for i, j in match_boxes([tracks[key]['last_box'] for key in tail], [tracks[key]['first_box'] for key in head],
+                                tracker.iou_threshold, tracker.centroid_threshold):
+            parent[root(head[j])] = root(tail[i])
+
+    groups = {}
+    for key in tracks:
+        groups.setdefault(root(key), []).append(tracks[key])
+    duplicates = []
+    for group in groups.values():
+        if len(group) == 1:
+            continue
+        best = max(group, key=lambda e: e['confidence'])
+        first = min(group, key=lambda e: e['first_frame'])
+        last = max(group, key=lambda e: e['last_frame'])
+        best.update(first_frame=first['first_frame'], first_box=first['first_box'],
+                    last_frame=last['last_frame'], last_box=last['last_box'])
+        duplicates.extend(e for e in group if e is not best)
+
+    dropped = {id(e) for e in duplicates}
+    return [[e for e in frames if id(e) not in dropped] for frames in segment_frames], duplicates
+
+
+def _load(spec):
+    module, func = spec.split(':')
+    return getattr(importlib.import_module(module), func)
+
+
+def _limit_threads(threads):
+    # Share the node's cores between segments rather than each taking all of them
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _segment_main(index, segment, video_path, model_loader, frame_interval, output_folder,
+                  threads, tracker_options, pipeline_options, events):
+    logging.basicConfig(level=logging.INFO)
+    _limit_threads(threads)
+    # The model loader does not set the process up the way init_app_runtime() does
+    metrics.start_exporter()
+    start, end = segment
+    try:
+        m = _load(model_loader)()
+        if m is None:
+            raise RuntimeError("Model could not be loaded")
+        cap = SegmentCapture(cv2.VideoCapture(video_path), start, end)
+        if not cap.isOpened():
+            raise RuntimeError(f"Could not open {video_path}")
+        tracker = PotholeTracker(**tracker_options) if tracker_options is not None else None
+        try:
+            detected_frames, _, stats = run_video_pipeline(
+                cap, m, frame_interval, output_folder, tracker=tracker, frame_offset=start,
+                progress=lambda n: events.put(('progress', index, n - start + 1)),
+                **pipeline_options)
+        finally:
+            cap.release()
+        events.put(('done', index, detected_frames, stats.as_dict()))
+    except Exception as e:
+        logger.exception(f"Video segment {index} ({start}-{end}) failed")
+        events.put(('error', index, f"{type(e).__name__}: {e}"))
+
+
+def run_segmented_video(video_path, model_loader, frame_interval, output_folder, total_frames,
+                        workers=2, tracker_options=None, pipeline_options=None, progress=None):
+    """Process ``video_path`` in ``workers`` parallel segment processes
+
+    ``model_loader`` is a ``"module:function"`` string returning the model in
+    the child process. ``tracker_options`` (PotholeTracker keyword arguments)
+    turns tracking on; ``pipeline_options`` are passed to
+    ``run_video_pipeline``. ``progress``, if given, is called with the
+    fraction of frames done. Returns ``(detected_frames, pothole_images,
+    stats)`` like ``run_video_pipeline``, with ``stats`` already a dict.
+    """
+    segments = plan_segments(total_frames, frame_interval, workers)
+    threads = max(1, (os.cpu_count() or 1) // len(segments))
+    ctx = multiprocessing.get_context('spawn')
+    events = ctx.Queue()
+    started = time.perf_counter()
+    processes = [
+        ctx.Process(target=_segment_main, name=f'video-segment-{i}',
+                    args=(i, segment, video_path, model_loader, frame_interval, output_folder, threads,
+                          tracker_options, pipeline_options or {}, events))
+        for i, segment in enumerate(segments)
+    ]
+    for p in processes:
+        p.start()
+
+    results, done_frames = {}, [0] * len(segments)
+    try:
+        while len(results) < len(segments):
+            try:
+                event = events.get(timeout=1.0)
+            except queue.Empty:
+                dead = [i for i, p in enumerate(processes) if i not in results and not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Video segment {dead[0]} exited with code {processes[dead[0]].exitcode}")
+                continue
+            kind, index = event[0], event[1]
+            if kind == 'progress':
+                done_frames[index] = event[2]
+                if progress is not None:
+                    progress(min(1.0, sum(done_frames) / total_frames))
+            elif kind == 'error':
+                raise RuntimeError(f"Video segment {index} failed: {event[2]}")
+            else:
+                results[index] = (event[2], event[3])
+    finally:
+        for p in processes:
+            if p.is_alive() and len(results) < len(segments):
+                p.terminate()
+            p.join()
+
+    segment_frames = [results[index][0] for index in range(len(segments))]
+    stitched = 0
+    if tracker_options is not None:
+        segment_frames, duplicates = stitch_tracks(segment_frames, segments, frame_interval,
+                                                   PotholeTracker(**tracker_options))
+        for entry in duplicates:
+            thumbnails.remove_variants(entry['path'])
+            try:
+                os.remove(entry['path'])
+            except OSError:
+                pass
+        stitched = len(duplicates)
+
+    # Track ids restart in every segment; renumber them in frame order
+    detected_frames, track_ids = [], {}
+    for index, frames in enumerate(segment_frames):
+        for entry in frames:
+            if 'track_id' in entry:
+                entry['track_id'] = track_ids.setdefault((index, entry['track_id']), len(track_ids) + 1)
+            detected_frames.append(entry)
+    detected_frames.sort(key=lambda f: (f['frame_number'], f.get('track_id', 0)))
+    pothole_images = [f['path'] for f in detected_frames]
+    stats = {
+        'wall_seconds': round(time.perf_counter() - started, 4),
+        'stitched_tracks': stitched,
+        'segments': [dict(results[i][1], frames=list(segments[i])) for i in range(len(segments))],
+    }
+    return detected_frames, pothole_images, stats